@@ -1,6 +1,5 @@
 import os
 from dotenv import load_dotenv
-from modules.discord.bot import start_bot
 
 load_dotenv()
 
@@ -10,6 +9,8 @@ def main():
         print("MISSING DISCORD_TOKEN")
         return
 
+    # Imported here: image workers are spawned and re-import this file, and must not load the bot.
+    from modules.discord.bot import start_bot
     print("Starting Bot...")
     start_bot(token)
 
@@ -0,0 +1,6 @@
+"""Load tests and micro-benchmarks for the bot, run against fake Discord objects and fake ComfyUI servers.
+
+    python -m benchmarks load --rate 2 --duration 30
+    python -m benchmarks micro [name ...]
+    python -m benchmarks compare before.json after.json
+"""
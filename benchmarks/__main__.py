@@ -0,0 +1,139 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+def save(report: dict, out: str, name: str) -> str:
+    path = out or os.path.join(RESULTS_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, default=str)
+    return path
+
+def load_command(args):
+    from benchmarks.harness import prepare_environment
+    workdir = args.workdir or tempfile.mkdtemp(prefix="fullet-bench-")
+    prepare_environment(workdir, args.gpus, args.vram_gb, args.base_port, dict(kv.split("=", 1) for kv in args.env))
+    from benchmarks.loadgen import run_load
+    config = {k: v for k, v in vars(args).items() if k not in ("func", "out", "env")}
+    config["env"] = dict(kv.split("=", 1) for kv in args.env)
+    report = asyncio.run(run_load(config))
+    report["name"], report["started"] = args.name, time.strftime("%Y-%m-%dT%H:%M:%S")
+    path = save(report, args.out, args.name)
+    latency = report["latency_s"].get("all", {})
+    print(f"{report['requests']} in {report['elapsed_s']}s")
+    print(f"throughput {report['throughput_rps']} req/s | latency p50 {latency.get('p50')}s p95 {latency.get('p95')}s "
+          f"p99 {latency.get('p99')}s | GPU idle {report['gpu_idle_fraction']:.1%} | loop lag {report['loop_lag_ms']}")
+    print(f"saved {path}")
+
+def micro_command(args):
+    from benchmarks.micro import BENCHMARKS
+    names = args.names or list(BENCHMARKS)
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        sys.exit(f"unknown benchmark(s): {', '.join(unknown)}; available: {', '.join(BENCHMARKS)}")
+    if len(names) == 1 and args.child:
+        from benchmarks.harness import prepare_environment
+        workdir = tempfile.mkdtemp(prefix="fullet-micro-")
+        prepare_environment(workdir, 1, 24.0, args.base_port)
+        result = asyncio.run(BENCHMARKS[names[0]](workdir))
+        print(json.dumps(result, default=str))
+        return
+
+    # One process per benchmark: settings are read at import time and several tests reconfigure them.
+    report = {"name": "micro", "started": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": {}}
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for name in names:
+        print(f"== {name}", flush=True)
+        proc = subprocess.run([sys.executable, "-m", "benchmarks", "micro", "--child", "--base-port", str(args.base_port), name],
+                              cwd=root, capture_output=True, text=True)
+        lines = proc.stdout.strip().splitlines()
+        try:
+            result = json.loads(lines[-1])
+        except (IndexError, ValueError):
+            result = {"error": (proc.stderr or proc.stdout).strip()[-2000:]}
+        report["results"][name] = result
+        print(json.dumps(result, indent=2, default=str))
+    print(f"saved {save(report, args.out, 'micro')}")
+
+def flatten(data, prefix=""):
+    items = {}
+    for key, value in data.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            items.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            items[path] = value
+    return items
+
+def compare_command(args):
+    with open(args.before, encoding="utf-8") as f:
+        before = flatten(json.load(f))
+    with open(args.after, encoding="utf-8") as f:
+        after = flatten(json.load(f))
+    for key in sorted(set(before) & set(after)):
+        if key.startswith("config.") and before[key] == after[key]:
+            continue
+        a, b = before[key], after[key]
+        change = f"{(b - a) / a:+.1%}" if a else ""
+        print(f"{key:<50} {a:>12g} {b:>12g} {change:>9}")
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Load tests and micro-benchmarks against fake Discord and fake ComfyUI.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    load = sub.add_parser("load", help="end-to-end load test through /imagine and /edit")
+    load.add_argument("--name", default="load")
+    load.add_argument("--out", help="JSON report path (default benchmarks/results/<name>-<time>.json)")
+    load.add_argument("--workdir", help="scratch directory for the database, blobs and caches")
+    load.add_argument("--pattern", choices=("constant", "poisson", "burst", "ramp"), default="poisson")
+    load.add_argument("--rate", type=float, default=2.0, help="mean requests per second")
+    load.add_argument("--duration", type=float, default=30.0, help="seconds of arrivals")
+    load.add_argument("--burst-every", type=float, default=5.0, help="seconds between bursts (burst pattern)")
+    load.add_argument("--users", type=int, default=20)
+    load.add_argument("--edit-fraction", type=float, default=0.2)
+    load.add_argument("--repeat-fraction", type=float, default=0.2, help="share of requests using a popular prompt")
+    load.add_argument("--seeded-fraction", type=float, default=0.1, help="share of requests with a fixed seed (cacheable)")
+    load.add_argument("--models", nargs="+", default=["flux", "z-image"])
+    load.add_argument("--gpus", type=int, default=2)
+    load.add_argument("--vram-gb", type=float, default=24.0)
+    load.add_argument("--base-port", type=int, default=18188)
+    load.add_argument("--base-time", type=float, default=1.0, help="fake GPU seconds per sampler pass")
+    load.add_argument("--per-image-time", type=float, default=0.25, help="fake GPU seconds per image in a batch")
+    load.add_argument("--load-time", type=float, default=0.5, help="fake GPU seconds to switch models")
+    load.add_argument("--prompt-fail", type=float, default=0.0, help="probability /prompt returns 500")
+    load.add_argument("--exec-fail", type=float, default=0.0, help="probability a prompt fails while executing")
+    load.add_argument("--view-fail", type=float, default=0.0, help="probability /view returns 500")
+    load.add_argument("--upload-fail", type=float, default=0.0, help="probability /upload/image returns 500")
+    load.add_argument("--no-ws", action="store_true", help="refuse websocket connections (history polling only)")
+    load.add_argument("--discord-send", type=float, default=0.05, help="seconds per Discord message/edit")
+    load.add_argument("--discord-upload", type=float, default=0.3, help="seconds per Discord attachment upload")
+    load.add_argument("--discord-429", type=float, default=0.0, help="probability a message call is rate limited")
+    load.add_argument("--timeout", type=float, default=300.0, help="per-request give-up time")
+    load.add_argument("--seed", type=int, default=1, help="random seed for the workload")
+    load.add_argument("--env", nargs="*", default=[], metavar="KEY=VALUE", help="extra bot settings, e.g. BATCH_POLICY=adaptive")
+    load.set_defaults(func=load_command)
+
+    micro = sub.add_parser("micro", help="focused benchmarks of single components")
+    micro.add_argument("names", nargs="*", help="benchmarks to run (default: all)")
+    micro.add_argument("--out")
+    micro.add_argument("--base-port", type=int, default=18288)
+    micro.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    micro.set_defaults(func=micro_command)
+
+    compare = sub.add_parser("compare", help="diff the numbers of two JSON reports")
+    compare.add_argument("before")
+    compare.add_argument("after")
+    compare.set_defaults(func=compare_command)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
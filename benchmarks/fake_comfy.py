@@ -0,0 +1,278 @@
+import io
+import time
+import json
+import random
+import asyncio
+from aiohttp import web, WSMsgType
+from PIL import Image
+
+GIB = 1024 ** 3
+
+def make_png(size: int = 512) -> bytes:
+    # Noise keeps the PNG close to a real render's size instead of a few hundred bytes of flat colour.
+    img = Image.effect_noise((size, size), 40).convert("RGB")
+    buf = io.BytesIO()
+    img.save(buf, "PNG")
+    return buf.getvalue()
+
+class FakeComfy:
+    """A single-GPU ComfyUI stand-in: one FIFO executor, timed by batch size, with optional faults.
+
+    Executes nothing; a prompt takes `base_time + per_image_time * batch`, plus `load_time` when
+    its model differs from the one already loaded. Reported VRAM follows the loaded model and the
+    running batch, and a batch that doesn't fit fails with ComfyUI's OOM message.
+    """
+
+    def __init__(self, port: int, vram_gb: float = 24.0, base_time: float = 1.0, per_image_time: float = 0.25,
+                 load_time: float = 0.0, model_gb: float = 4.0, per_image_gb: float = 1.0, steps: int = 4,
+                 prompt_fail: float = 0.0, exec_fail: float = 0.0, view_fail: float = 0.0, upload_fail: float = 0.0,
+                 ws: bool = True, image_size: int = 512, view_time: float = 0.0, host: str = "127.0.0.1"):
+        self.host, self.port = host, port
+        self.vram_gb, self.model_gb, self.per_image_gb = vram_gb, model_gb, per_image_gb
+        self.base_time, self.per_image_time, self.load_time, self.steps = base_time, per_image_time, load_time, steps
+        self.prompt_fail, self.exec_fail, self.view_fail, self.upload_fail = prompt_fail, exec_fail, view_fail, upload_fail
+        self.ws_enabled = ws
+        self.view_time = view_time
+        self.available = True
+        self.version = "0.3.40"
+        self.png = make_png(image_size)
+        self.queue = asyncio.Queue()
+        self.pending = []
+        self.running = None
+        self.history = {}
+        self.inputs = {}
+        self.sockets = {}
+        self.loaded_model = None
+        self.busy_vram_gb = 0.0
+        self.busy_time = 0.0
+        self.started_at = None
+        self.counts = {"prompts": 0, "images": 0, "uploads": 0, "upload_bytes": 0, "views": 0,
+                       "oom": 0, "injected_failures": 0, "model_loads": 0, "requests": 0, "connections": 0, "history": 0}
+        self._peers = set()
+        self._seq = 0
+        self._runner = None
+        self._worker = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    @web.middleware
+    async def _count(self, request, handler):
+        # A new client port is a new TCP connection: that's what keep-alive saves.
+        peer = request.transport.get_extra_info("peername") if request.transport else None
+        if peer not in self._peers:
+            self._peers.add(peer)
+            self.counts["connections"] += 1
+        self.counts["requests"] += 1
+        if not self.available:
+            # What a dead ngrok tunnel answers: not JSON, not ComfyUI.
+            return web.Response(status=502, text="tunnel offline")
+        return await handler(request)
+
+    async def start(self):
+        app = web.Application(client_max_size=256 * 1024 * 1024, middlewares=[self._count])
+        app.router.add_post("/prompt", self.prompt)
+        app.router.add_get("/history", self.history_list)
+        app.router.add_get("/history/{prompt_id}", self.history_entry)
+        app.router.add_route("*", "/view", self.view)
+        app.router.add_post("/upload/image", self.upload)
+        app.router.add_get("/system_stats", self.system_stats)
+        app.router.add_get("/queue", self.queue_state)
+        app.router.add_get("/ws", self.websocket)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self._worker = asyncio.create_task(self._execute_loop())
+        self.started_at = time.perf_counter()
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+        for ws in list(self.sockets.values()):
+            await ws.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def restart(self, version: str = None):
+        """A new server process: history, uploaded inputs and the loaded model are gone."""
+        self.history.clear()
+        self.inputs.clear()
+        self.loaded_model = None
+        if version is not None:
+            self.version = version
+
+    def reset_clock(self):
+        self.busy_time = 0.0
+        self.started_at = time.perf_counter()
+
+    def idle_fraction(self) -> float:
+        wall = time.perf_counter() - self.started_at
+        busy = self.busy_time + (time.perf_counter() - self.running[3] if self.running else 0.0)
+        return max(0.0, 1.0 - busy / wall) if wall > 0 else 0.0
+
+    def _fail(self, rate: float) -> bool:
+        if rate and random.random() < rate:
+            self.counts["injected_failures"] += 1
+            return True
+        return False
+
+    async def _send(self, client_id, kind, data):
+        ws = self.sockets.get(client_id)
+        if ws is None or ws.closed:
+            return
+        try:
+            await ws.send_str(json.dumps({"type": kind, "data": data}))
+        except ConnectionError:
+            pass
+
+    @staticmethod
+    def _describe(workflow: dict):
+        batch, model, outputs = 1, [], []
+        for node_id, node in workflow.items():
+            inputs = node.get("inputs", {})
+            if isinstance(inputs.get("batch_size"), int):
+                batch = max(batch, inputs["batch_size"])
+            for field in ("unet_name", "ckpt_name"):
+                if isinstance(inputs.get(field), str):
+                    model.append(inputs[field])
+            if node.get("class_type") == "SaveImage":
+                outputs.append(node_id)
+        return batch, "|".join(sorted(model)) or "default", outputs
+
+    async def prompt(self, request):
+        body = await request.json()
+        if self._fail(self.prompt_fail):
+            return web.json_response({"error": {"message": "Injected failure"}}, status=500)
+        workflow = body.get("prompt") or {}
+        self._seq += 1
+        prompt_id = f"{self.port}-{self._seq}"
+        entry = (prompt_id, workflow, body.get("client_id"))
+        self.pending.append(prompt_id)
+        await self.queue.put(entry)
+        self.counts["prompts"] += 1
+        return web.json_response({"prompt_id": prompt_id, "number": self._seq})
+
+    async def _execute_loop(self):
+        while True:
+            prompt_id, workflow, client_id = await self.queue.get()
+            self.pending.remove(prompt_id)
+            batch, model, outputs = self._describe(workflow)
+            started = time.perf_counter()
+            self.running = (prompt_id, workflow, client_id, started)
+            try:
+                await self._execute(prompt_id, client_id, batch, model, outputs)
+            finally:
+                self.busy_time += time.perf_counter() - started
+                self.running = None
+                self.busy_vram_gb = 0.0
+
+    async def _execute(self, prompt_id, client_id, batch, model, outputs):
+        await self._send(client_id, "execution_start", {"prompt_id": prompt_id})
+        if model != self.loaded_model:
+            self.counts["model_loads"] += 1
+            await asyncio.sleep(self.load_time)
+            self.loaded_model = model
+        needed = self.model_gb + self.per_image_gb * batch
+        if needed > self.vram_gb:
+            self.counts["oom"] += 1
+            return await self._error(prompt_id, client_id, "Allocation on device out of memory")
+        self.busy_vram_gb = needed
+        if self._fail(self.exec_fail):
+            await asyncio.sleep(self.base_time / 2)
+            return await self._error(prompt_id, client_id, "Injected execution failure")
+
+        duration = self.base_time + self.per_image_time * batch
+        for step in range(1, self.steps + 1):
+            await asyncio.sleep(duration / self.steps)
+            await self._send(client_id, "progress", {"prompt_id": prompt_id, "value": step, "max": self.steps})
+
+        result = {}
+        for node_id in outputs:
+            images = [{"filename": f"{prompt_id}_{node_id}_{i}.png", "subfolder": "", "type": "output"} for i in range(batch)]
+            result[node_id] = {"images": images}
+            await self._send(client_id, "executed", {"prompt_id": prompt_id, "node": node_id, "output": result[node_id]})
+        self.counts["images"] += batch
+        self.history[prompt_id] = {"outputs": result, "status": {"status_str": "success", "completed": True, "messages": [
+            ["execution_start", {"prompt_id": prompt_id}], ["execution_success", {"prompt_id": prompt_id}]]}}
+        await self._send(client_id, "executing", {"prompt_id": prompt_id, "node": None})
+
+    async def _error(self, prompt_id, client_id, message):
+        # What ComfyUI records: no top-level error, just the status and its execution_error message.
+        self.history[prompt_id] = {"outputs": {}, "status": {"status_str": "error", "completed": False, "messages": [
+            ["execution_start", {"prompt_id": prompt_id}],
+            ["execution_error", {"prompt_id": prompt_id, "node_type": "KSampler", "exception_message": message}]]}}
+        await self._send(client_id, "execution_error", {"prompt_id": prompt_id, "exception_message": message})
+
+    async def history_list(self, request):
+        recent = list(self.history.items())
+        if request.query.get("max_items"):
+            recent = recent[-int(request.query["max_items"]):]
+        return web.json_response(dict(recent))
+
+    async def history_entry(self, request):
+        prompt_id = request.match_info["prompt_id"]
+        self.counts["history"] += 1
+        entry = self.history.get(prompt_id)
+        if entry is None:
+            return web.json_response({})
+        return web.json_response({prompt_id: entry})
+
+    async def view(self, request):
+        name = request.query.get("filename", "")
+        if request.query.get("type") == "input":
+            return web.Response(status=200 if name in self.inputs else 404)
+        if request.method == "HEAD":
+            return web.Response(status=200)
+        if self._fail(self.view_fail):
+            return web.Response(status=500)
+        self.counts["views"] += 1
+        if self.view_time:
+            # Tunnel round-trip plus transfer time for one output image.
+            await asyncio.sleep(self.view_time)
+        return web.Response(body=self.png, content_type="image/png")
+
+    async def upload(self, request):
+        if self._fail(self.upload_fail):
+            return web.Response(status=500)
+        form = await request.post()
+        field = form["image"]
+        data = field.file.read()
+        self.inputs[field.filename] = len(data)
+        self.counts["uploads"] += 1
+        self.counts["upload_bytes"] += len(data)
+        return web.json_response({"name": field.filename, "subfolder": "", "type": "input"})
+
+    async def system_stats(self, request):
+        total = int(self.vram_gb * GIB)
+        used = (self.model_gb if self.loaded_model else 0.0) + self.busy_vram_gb
+        free = max(0, total - int(min(used, self.vram_gb) * GIB))
+        system = {"os": "posix", "comfyui_version": self.version, "python_version": "3.11", "pytorch_version": "2.5.1",
+                  "argv": ["main.py", "--port", str(self.port)], "ram_total": 64 * GIB, "ram_free": random.randint(8, 32) * GIB}
+        return web.json_response({"system": system, "devices": [{"name": "fake", "type": "cuda", "vram_total": total,
+                                                                 "vram_free": free, "torch_vram_free": 0}]})
+
+    async def queue_state(self, request):
+        running = [[0, self.running[0]]] if self.running else []
+        return web.json_response({"queue_running": running, "queue_pending": [[0, p] for p in self.pending]})
+
+    async def websocket(self, request):
+        ws = web.WebSocketResponse(heartbeat=30)
+        if not self.ws_enabled:
+            return web.Response(status=404)
+        await ws.prepare(request)
+        client_id = request.query.get("clientId", "")
+        self.sockets[client_id] = ws
+        await ws.send_str(json.dumps({"type": "status", "data": {"sid": client_id}}))
+        try:
+            async for msg in ws:
+                if msg.type == WSMsgType.ERROR:
+                    break
+        finally:
+            if self.sockets.get(client_id) is ws:
+                del self.sockets[client_id]
+        return ws
+
+    def stats(self) -> dict:
+        return dict(self.counts, url=self.url, idle_fraction=round(self.idle_fraction(), 4),
+                    busy_seconds=round(self.busy_time, 3))
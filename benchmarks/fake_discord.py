@@ -0,0 +1,166 @@
+import time
+import random
+import asyncio
+import itertools
+import discord
+
+_ids = itertools.count(10 ** 17)
+
+class Latency:
+    """Delay and failure injection for fake REST calls."""
+
+    def __init__(self, send: float = 0.05, upload: float = 0.3, jitter: float = 0.5, rate_limit: float = 0.0):
+        self.send, self.upload, self.jitter, self.rate_limit = send, upload, jitter, rate_limit
+        self.calls = 0
+        self.rate_limited = 0
+
+    async def wait(self, base: float, limited: bool = False):
+        self.calls += 1
+        if base:
+            await asyncio.sleep(base * random.uniform(1 - self.jitter, 1 + self.jitter))
+        # Only message routes get 429s; setup calls failing would just abort the command.
+        if limited and self.rate_limit and random.random() < self.rate_limit:
+            self.rate_limited += 1
+            raise RateLimited()
+
+class _Response:
+    status, reason = 429, "Too Many Requests"
+
+class RateLimited(discord.HTTPException):
+    def __init__(self):
+        super().__init__(_Response(), "You are being rate limited.")
+        self.retry_after = 0.05
+
+class FakePermissions:
+    administrator = False
+
+class FakeUser:
+    def __init__(self, name: str):
+        self.id = next(_ids)
+        self.name = name
+        self.mention = f"<@{self.id}>"
+        self.guild_permissions = FakePermissions()
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __eq__(self, other):
+        return getattr(other, "id", None) == self.id
+
+class FakeMessage:
+    def __init__(self, channel, content, attachment=None):
+        self.id = next(_ids)
+        self.channel = channel
+        self.content = content
+        self.attachment = attachment
+        self.created_at = time.perf_counter()
+
+    async def edit(self, content=None, **kwargs):
+        await self.channel.latency.wait(self.channel.latency.send, limited=True)
+        self.channel.edits += 1
+        self.content = content
+
+    async def delete(self):
+        await self.channel.latency.wait(self.channel.latency.send)
+
+class FakeChannel:
+    def __init__(self, guild, name, overwrites=None, category=None):
+        self.id = next(_ids)
+        self.guild = guild
+        self.name = name
+        self.category = category
+        self.mention = f"<#{self.id}>"
+        self.latency = guild.latency
+        self.overwrites = {}
+        for target, overwrite in (overwrites or {}).items():
+            self.overwrites[getattr(target, "id", id(target))] = overwrite
+        self.messages = []
+        self.edits = 0
+
+    def overwrites_for(self, target):
+        return self.overwrites.get(getattr(target, "id", id(target)), discord.PermissionOverwrite())
+
+    async def set_permissions(self, target, overwrite=None, **permissions):
+        await self.latency.wait(self.latency.send)
+        self.overwrites[getattr(target, "id", id(target))] = overwrite or discord.PermissionOverwrite(**permissions)
+
+    async def send(self, content=None, file=None, **kwargs):
+        attachment = None
+        if file is not None:
+            attachment = (file.filename, len(file.fp.read()))
+        await self.latency.wait(self.latency.upload if file is not None else self.latency.send, limited=True)
+        message = FakeMessage(self, content, attachment)
+        self.messages.append(message)
+        self.guild.on_message(message)
+        return message
+
+    async def delete(self):
+        await self.latency.wait(self.latency.send)
+        self.guild.channels.pop(self.id, None)
+
+class FakeCategory:
+    def __init__(self, name):
+        self.id = next(_ids)
+        self.name = name
+
+class FakeGuild:
+    """Just enough of discord.Guild for SessionManager and the image commands."""
+
+    def __init__(self, latency: Latency = None, on_message=None):
+        self.id = next(_ids)
+        self.latency = latency or Latency()
+        self.channels = {}
+        self.categories = []
+        self.default_role = object()
+        self.me = object()
+        self.on_message = on_message or (lambda message: None)
+
+    @property
+    def text_channels(self):
+        return list(self.channels.values())
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    async def create_category(self, name, overwrites=None):
+        await self.latency.wait(self.latency.send)
+        category = FakeCategory(name)
+        self.categories.append(category)
+        return category
+
+    async def create_text_channel(self, name, overwrites=None, category=None):
+        await self.latency.wait(self.latency.send)
+        channel = FakeChannel(self, name, overwrites, category)
+        self.channels[channel.id] = channel
+        return channel
+
+class FakeAttachment:
+    def __init__(self, data: bytes, filename: str = "upload.png"):
+        self.data = data
+        self.filename = filename
+
+    async def read(self):
+        return self.data
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def defer(self, ephemeral=False, thinking=False):
+        self.interaction.deferred = True
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, ephemeral=False, **kwargs):
+        self.interaction.replies.append(content)
+
+class FakeInteraction:
+    def __init__(self, guild: FakeGuild, user: FakeUser):
+        self.guild = guild
+        self.user = user
+        self.deferred = False
+        self.replies = []
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
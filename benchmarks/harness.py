@@ -0,0 +1,188 @@
+import os
+import sys
+import time
+import asyncio
+from collections import defaultdict, deque
+from benchmarks.fake_discord import FakeGuild, FakeUser, FakeInteraction, Latency
+
+def prepare_environment(workdir: str, gpus: int = 1, vram_gb: float = 24.0, base_port: int = 18188, overrides: dict = None) -> list:
+    """Points the bot's settings at a scratch directory and fake GPUs. Must run before `modules` is imported,
+    because every module reads its settings at import time. Returns the GPU URLs."""
+    if any(name.startswith("modules.") for name in sys.modules):
+        raise RuntimeError("prepare_environment() must run before the bot modules are imported")
+    workdir = os.path.abspath(workdir)
+    os.makedirs(workdir, exist_ok=True)
+    urls = [f"http://127.0.0.1:{base_port + i}" for i in range(gpus)]
+    for name in ("EXPORT_PATH", "METRICS_PORT", "COMFY_URL", "COMFY_API_KEY"):
+        os.environ.pop(name, None)
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bot.db')}",
+        "BLOB_STORE_PATH": os.path.join(workdir, "blobs"),
+        "RESULT_CACHE_DIR": os.path.join(workdir, "results"),
+        "COMFY_URLS": ",".join(urls),
+        "GPU_VRAM_GB": ",".join(str(vram_gb) for _ in urls),
+        "GPU_HEALTH_INTERVAL": "1",
+        "MAX_JOBS_PER_USER": "1000",
+    })
+    os.environ.update({k: str(v) for k, v in (overrides or {}).items()})
+    return urls
+
+def percentiles(values, points=(50, 95, 99), scale: float = 1.0, digits: int = 4) -> dict:
+    if not values:
+        return {}
+    ordered = sorted(values)
+    summary = {f"p{p}": ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))] for p in points}
+    summary["mean"] = sum(ordered) / len(ordered)
+    summary["max"] = ordered[-1]
+    return {k: round(v * scale, digits) for k, v in summary.items()}
+
+class LoopLag:
+    """Samples how late a short sleep wakes up; anything blocking the event loop shows up here."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(time.perf_counter() - started - self.interval)
+
+    def start(self):
+        self.samples = []
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            # Let a sampler that was starved by blocking work record that stall before it goes.
+            await asyncio.sleep(self.interval * 2)
+            self._task.cancel()
+            self._task = None
+
+    def summary(self) -> dict:
+        return percentiles(self.samples, (50, 99), scale=1000, digits=2)
+
+class Recorder:
+    """Matches result messages posted to session channels back to the request that caused them."""
+
+    def __init__(self):
+        self.waiters = defaultdict(deque)
+        self.unmatched = 0
+
+    def expect(self, channel_name: str, prompt: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[(channel_name, prompt)].append(future)
+        return future
+
+    def discard(self, channel_name: str, prompt: str, future):
+        waiters = self.waiters.get((channel_name, prompt))
+        if waiters and future in waiters:
+            waiters.remove(future)
+
+    def on_message(self, message):
+        content = message.content or ""
+        if content.startswith("Done in"):
+            status = "success"
+        elif content.startswith("Error for"):
+            status = "error"
+        else:
+            return
+        # "Done in ...\nPrompt: `p`" and "Error for `p`: ..." both carry the prompt in the first backticks.
+        parts = content.split("`")
+        waiters = self.waiters.get((message.channel.name, parts[1] if len(parts) > 1 else ""))
+        while waiters:
+            future = waiters.popleft()
+            if not future.done():
+                future.set_result((status, message.created_at, content))
+                return
+        self.unmatched += 1
+
+class Harness:
+    """The real bot (queue, batching, ComfyUI client, delivery) wired to fake Discord objects and fake GPUs."""
+
+    def __init__(self, fakes, latency: Latency = None, timeout: float = 300.0):
+        self.fakes = fakes
+        self.recorder = Recorder()
+        self.guild = FakeGuild(latency or Latency(), on_message=self.recorder.on_message)
+        self.users = {}
+        self.timeout = timeout
+        self.lag = LoopLag()
+        self.bot = None
+        self._worker = None
+
+    def user(self, index: int) -> FakeUser:
+        if index not in self.users:
+            self.users[index] = FakeUser(f"user{index}")
+        return self.users[index]
+
+    async def start(self):
+        for fake in self.fakes:
+            await fake.start()
+        from modules.utils.db_manager import init_db
+        from modules.discord.bot import ImageBot
+        from modules.discord.cogs.sessions import SessionManager
+        from modules.discord.cogs.image_commands import ImageCommands
+        from modules.queue_manager.manager import queue_manager
+        from modules.ai.gpu_pool import gpu_pool
+        await asyncio.to_thread(init_db)
+        self.bot = ImageBot()
+        self.sessions = SessionManager(self.bot)
+        self.commands = ImageCommands(self.bot)
+        # Cogs are used directly; add_cog would try to sync with a Discord that isn't there.
+        self.bot.get_cog = {"SessionManager": self.sessions, "ImageCommands": self.commands}.get
+        for gpu in gpu_pool.gpus:
+            await gpu_pool.health_check(gpu)
+        gpu_pool.start_health_checks()
+        self._worker = asyncio.create_task(queue_manager.start_worker(
+            self.bot.process_queue_job, deliver_callback=self.bot.deliver_result))
+        self.lag.start()
+
+    def reset_clocks(self):
+        for fake in self.fakes:
+            fake.reset_clock()
+        self.lag.samples.clear()
+
+    async def submit(self, kind: str, user: FakeUser, prompt: str, model: str = "flux", seed: int = None, attachment=None) -> dict:
+        channel_name = f"session-{user.name.lower()}"
+        done = self.recorder.expect(channel_name, prompt)
+        interaction = FakeInteraction(self.guild, user)
+        started = time.perf_counter()
+        try:
+            if kind == "edit":
+                await self.commands.edit.callback(self.commands, interaction, prompt, attachment, model)
+            else:
+                await self.commands.imagine.callback(self.commands, interaction, model, prompt, None, seed)
+        except Exception as e:
+            self.recorder.discard(channel_name, prompt, done)
+            return {"kind": kind, "status": "crashed", "reply": repr(e)}
+        reply = interaction.replies[-1] if interaction.replies else ""
+        if not reply.startswith(("Queued", "Served from cache")):
+            self.recorder.discard(channel_name, prompt, done)
+            return {"kind": kind, "status": "rejected", "reply": reply}
+        try:
+            status, finished, content = await asyncio.wait_for(done, self.timeout)
+        except asyncio.TimeoutError:
+            return {"kind": kind, "status": "timeout", "reply": reply}
+        return {"kind": kind, "status": status, "latency": finished - started, "cached": reply.startswith("Served"),
+                "reply": reply if status == "success" else content}
+
+    async def stop(self):
+        from modules.queue_manager.manager import queue_manager
+        from modules.ai.gpu_pool import gpu_pool
+        from modules.discord.delivery import outbox
+        from modules.utils.session_cache import session_cache
+        from modules.utils.image_pipeline import image_pipeline
+        from modules.utils.db_manager import close_db
+        await self.lag.stop()
+        await queue_manager.stop(timeout=30)
+        if self._worker is not None:
+            self._worker.cancel()
+        await outbox.drain(timeout=30)
+        await session_cache.flush()
+        await gpu_pool.close()
+        for fake in self.fakes:
+            await fake.stop()
+        image_pipeline.close()
+        close_db()
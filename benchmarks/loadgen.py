@@ -0,0 +1,148 @@
+import time
+import random
+import asyncio
+from benchmarks.fake_comfy import FakeComfy, make_png
+from benchmarks.fake_discord import Latency, FakeAttachment
+from benchmarks.harness import Harness, percentiles
+
+PATTERNS = ("constant", "poisson", "burst", "ramp")
+PROMPTS = ["cyberpunk city at night", "fantasy landscape, golden hour", "portrait of an old sailor",
+           "3d render of a glass teapot", "watercolor fox in the snow", "isometric pixel art castle"]
+EDITS = ["change the background", "change the lighting", "make it winter", "in a realistic style"]
+
+def arrivals(pattern: str, rate: float, duration: float, burst_every: float = 5.0) -> list:
+    """Send times (seconds from start) for about `rate * duration` requests."""
+    count = max(1, round(rate * duration))
+    if pattern == "constant":
+        return [i / rate for i in range(count)]
+    if pattern == "poisson":
+        times, now = [], 0.0
+        while True:
+            now += random.expovariate(rate)
+            if now >= duration:
+                return times
+            times.append(now)
+    if pattern == "burst":
+        per_burst = max(1, round(rate * burst_every))
+        return [b * burst_every for b in range(max(1, round(duration / burst_every))) for _ in range(per_burst)]
+    if pattern == "ramp":
+        # Rate grows linearly from 0 to 2x, same mean as "constant".
+        return [duration * (i / count) ** 0.5 for i in range(count)]
+    raise ValueError(f"unknown arrival pattern {pattern!r}; expected one of {PATTERNS}")
+
+class Workload:
+    def __init__(self, users: int = 20, edit_fraction: float = 0.2, seeded_fraction: float = 0.1,
+                 repeat_fraction: float = 0.2, models=("flux", "z-image")):
+        self.users = users
+        self.edit_fraction = edit_fraction
+        self.seeded_fraction = seeded_fraction
+        self.repeat_fraction = repeat_fraction
+        self.models = list(models)
+        self.counter = 0
+        self.source = make_png(256)
+
+    def next(self, harness: Harness, has_image: set) -> dict:
+        self.counter += 1
+        index = random.randrange(self.users)
+        user = harness.user(index)
+        if random.random() < self.edit_fraction:
+            # Users without a result yet attach a picture; the others edit their last image.
+            attachment = None if index in has_image else FakeAttachment(self.source, "photo.png")
+            return {"kind": "edit", "user": user, "index": index, "prompt": f"{random.choice(EDITS)} #{self.counter}",
+                    "model": "flux", "attachment": attachment}
+        model = random.choice(self.models)
+        seed = None
+        if random.random() < self.repeat_fraction:
+            # Popular prompts: identical requests from different users can share one GPU job.
+            prompt = random.choice(PROMPTS)
+            if random.random() < self.seeded_fraction / max(self.repeat_fraction, 1e-9):
+                seed = 42
+        else:
+            prompt = f"{random.choice(PROMPTS)} #{self.counter}"
+        return {"kind": "imagine", "user": user, "index": index, "prompt": prompt, "model": model, "seed": seed}
+
+async def run_load(config: dict) -> dict:
+    """Drives the real bot with `config` (see benchmarks.__main__ for the keys) and returns the report."""
+    random.seed(config.get("seed", 1))
+    fakes = [FakeComfy(config["base_port"] + i, vram_gb=config["vram_gb"], base_time=config["base_time"],
+                       per_image_time=config["per_image_time"], load_time=config["load_time"],
+                       prompt_fail=config["prompt_fail"], exec_fail=config["exec_fail"],
+                       view_fail=config["view_fail"], upload_fail=config["upload_fail"], ws=not config["no_ws"])
+             for i in range(config["gpus"])]
+    latency = Latency(send=config["discord_send"], upload=config["discord_upload"], rate_limit=config["discord_429"])
+    harness = Harness(fakes, latency, timeout=config["timeout"])
+    workload = Workload(users=config["users"], edit_fraction=config["edit_fraction"],
+                        seeded_fraction=config["seeded_fraction"], repeat_fraction=config["repeat_fraction"],
+                        models=config["models"])
+    await harness.start()
+    has_image = set()
+    results = []
+
+    async def one(request):
+        result = await harness.submit(request["kind"], request["user"], request["prompt"], request["model"],
+                                      request.get("seed"), request.get("attachment"))
+        result["sent_at"] = request["sent_at"]
+        if result["status"] == "success":
+            has_image.add(request["index"])
+        results.append(result)
+
+    schedule = arrivals(config["pattern"], config["rate"], config["duration"], config["burst_every"])
+    harness.reset_clocks()
+    started = time.perf_counter()
+    tasks = []
+    for offset in schedule:
+        delay = started + offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        request = workload.next(harness, has_image)
+        if request["kind"] == "imagine":
+            # /imagine clears the session's last image until the new one is delivered.
+            has_image.discard(request["index"])
+        request["sent_at"] = time.perf_counter() - started
+        tasks.append(asyncio.create_task(one(request)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    idle = [fake.idle_fraction() for fake in fakes]
+    lag = harness.lag.summary()
+    report = build_report(config, results, elapsed, idle, lag, fakes, latency)
+    await harness.stop()
+    return report
+
+def build_report(config, results, elapsed, idle, lag, fakes, latency) -> dict:
+    from modules.utils.metrics import metrics
+    from modules.discord.delivery import outbox
+    from modules.utils.result_cache import result_cache
+    from modules.utils.session_cache import session_cache
+
+    by_status = {}
+    for result in results:
+        by_status[result["status"]] = by_status.get(result["status"], 0) + 1
+    done = [r for r in results if r["status"] == "success"]
+    latencies = {"all": percentiles([r["latency"] for r in done])}
+    for kind in ("imagine", "edit"):
+        values = [r["latency"] for r in done if r["kind"] == kind]
+        if values:
+            latencies[kind] = percentiles(values)
+    cached = [r["latency"] for r in done if r.get("cached")]
+    if cached:
+        latencies["cached"] = percentiles(cached)
+
+    stages = {stage: {"count": n, "p50": p50, "p95": p95, "mean": round(mean, 4)}
+              for stage, n, p50, p95, mean in metrics.summary("stage_seconds", by="stage")}
+    batches = metrics.summary("batch_size")
+    return {
+        "config": config,
+        "requests": dict(by_status, submitted=len(results)),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(done) / elapsed, 4) if elapsed else 0.0,
+        "latency_s": latencies,
+        "gpu_idle_fraction": round(sum(idle) / len(idle), 4) if idle else None,
+        "loop_lag_ms": lag,
+        "gpus": [fake.stats() for fake in fakes],
+        "stages_s": stages,
+        "batch_size_mean": round(batches[0][4], 3) if batches else None,
+        "discord": {"calls": latency.calls, "injected_429": latency.rate_limited, **outbox.stats()},
+        "result_cache": result_cache.stats(),
+        "session_cache": session_cache.stats(),
+        "errors": sorted({r.get("reply", "") for r in results if r["status"] != "success"})[:20],
+    }
@@ -0,0 +1,502 @@
+import os
+import time
+import random
+import asyncio
+import timeit
+import multiprocessing
+from benchmarks.fake_comfy import FakeComfy, make_png
+from benchmarks.fake_discord import Latency, FakeGuild, FakeUser, FakeInteraction
+from benchmarks.harness import Harness, LoopLag, percentiles
+
+def _gpu(fake):
+    from modules.ai.gpu_pool import GPUInstance
+    return GPUInstance(url=fake.url, api_key="", total_vram=fake.vram_gb)
+
+async def comfy_pooling(workdir, jobs=50):
+    """Per-job HTTP cost (submit, history, download): a new session per call vs the pooled client."""
+    import aiohttp
+    fake = FakeComfy(18392, base_time=0.0, per_image_time=0.0, steps=1, ws=False)
+    await fake.start()
+    gpu = _gpu(fake)
+    workflow = {"9": {"class_type": "SaveImage", "inputs": {}}}
+
+    async def fresh(method, path, **kwargs):
+        # The old comfy_api: one ClientSession, so one TCP connection, per call.
+        async with aiohttp.ClientSession() as session:
+            async with session.request(method, f"{fake.url}{path}", **kwargs) as response:
+                return await (response.json() if path != "/view" else response.read())
+
+    async def pooled(method, path, **kwargs):
+        if path == "/view":
+            return await gpu.client.stream_bytes(path, params=kwargs.get("params"))
+        if method == "POST":
+            return await gpu.client.post_json(path, kwargs["json"])
+        return await gpu.client.get_json(path)
+
+    result = {"jobs": jobs}
+    for mode, call in (("new_session", fresh), ("pooled", pooled)):
+        before = dict(fake.counts)
+        timings = []
+        for _ in range(jobs):
+            started = time.perf_counter()
+            prompt_id = (await call("POST", "/prompt", json={"prompt": workflow}))["prompt_id"]
+            while prompt_id not in await call("GET", f"/history/{prompt_id}"):
+                await asyncio.sleep(0.005)
+            await call("GET", "/view", params={"filename": "a.png", "subfolder": "", "type": "output"})
+            timings.append(time.perf_counter() - started)
+        result[mode] = {"job_ms": percentiles(timings, scale=1000, digits=3),
+                        "requests": fake.counts["requests"] - before["requests"],
+                        "connections": fake.counts["connections"] - before["connections"]}
+    await gpu.client.close()
+    await fake.stop()
+    return result
+
+async def admission(workdir, jobs=10000, users=1000, legacy_jobs=2000):
+    """Cost of one enqueue as the queue grows: per-user counters vs draining the queue to count."""
+    from modules.queue_manager.manager import QueueManager
+    per_user = jobs // users
+    manager = QueueManager(max_jobs_per_user=per_user)
+    buckets = []
+    for start in range(0, jobs, 1000):
+        started = time.perf_counter()
+        for i in range(start, start + 1000):
+            await manager.add_job(1, f"prompt {i}", None, i % users)
+        buckets.append((time.perf_counter() - started) / 1000)
+    rejected = sum([await manager.add_job(1, "one too many", None, u) == -1 for u in range(users)])
+
+    async def drain_count(queue, user_id):
+        # The old add_job: empty the PriorityQueue to count the user's jobs, then put everything back.
+        items, count = [], 0
+        while not queue.empty():
+            item = await queue.get()
+            count += item[1] == user_id
+            items.append(item)
+        for item in items:
+            await queue.put(item)
+        return count
+
+    legacy = asyncio.PriorityQueue()
+    legacy_buckets = []
+    for start in range(0, legacy_jobs, 500):
+        started = time.perf_counter()
+        for i in range(start, start + 500):
+            if await drain_count(legacy, i % users) < per_user:
+                await legacy.put((i, i % users))
+        legacy_buckets.append((time.perf_counter() - started) / 500)
+    return {
+        "jobs": jobs, "users": users, "rejected_over_limit": rejected,
+        "counters_us_per_enqueue": {"first_1000": round(buckets[0] * 1e6, 2), "last_1000": round(buckets[-1] * 1e6, 2)},
+        "drain_us_per_enqueue": {"first_500": round(legacy_buckets[0] * 1e6, 2),
+                                 f"at_{legacy_jobs}": round(legacy_buckets[-1] * 1e6, 2)},
+    }
+
+async def batching_policies(workdir, duration=15.0, scale=0.4):
+    """Each batching policy against a fake processor, idle and near capacity.
+
+    The processor runs one batch at a time, like ComfyUI's FIFO, taking 1 s + 0.25 s per image;
+    the fixed window is 2 s. All times are multiplied by `scale`.
+    """
+    from modules.ai.gpu_pool import GPUPool, GPUInstance
+    from modules.queue_manager.manager import QueueManager
+    from modules.queue_manager.batching import POLICIES, create_policy
+    base, per_image, max_batch = 1.0 * scale, 0.25 * scale, 4
+    capacity = max_batch / (base + per_image * max_batch)
+    result = {"service_s": f"{base:g} + {per_image:g}/image", "max_batch": max_batch}
+    for load, rate in (("idle", capacity * 0.15), ("busy", capacity * 0.8)):
+        random.seed(5)
+        schedule, now = [], 0.0
+        while now < duration:
+            schedule.append(now)
+            now += random.expovariate(rate)
+        for name in POLICIES:
+            pool = GPUPool()
+            pool.gpus = [GPUInstance(url="sim://gpu0", api_key="", total_vram=24.0)]
+            manager = QueueManager(max_jobs_per_user=10 ** 6, policy=create_policy(name, max_batch=max_batch, max_wait=2.0 * scale))
+            latencies, sizes, executor = [], [], asyncio.Lock()
+            async def process(jobs, gpu):
+                async with executor:
+                    await asyncio.sleep(base + per_image * len(jobs))
+                sizes.append(len(jobs))
+                for job in jobs:
+                    latencies.append(time.time() - job.timestamp)
+                    job.resolve({"status": "success"})
+            worker = asyncio.create_task(manager.start_worker(process, pool=pool))
+            started = time.perf_counter()
+            for i, offset in enumerate(schedule):
+                await asyncio.sleep(max(0, started + offset - time.perf_counter()))
+                await manager.add_job(1, f"prompt {i}", None, i % 50)
+            while len(latencies) < len(schedule):
+                await asyncio.sleep(0.05)
+            elapsed = time.perf_counter() - started
+            await manager.stop()
+            worker.cancel()
+            result[f"{load}_{name}"] = {"jobs": len(schedule), "throughput_per_s": round(len(schedule) / elapsed, 3),
+                                        "batch_mean": round(sum(sizes) / len(sizes), 2),
+                                        **percentiles(latencies, (50, 95), digits=3)}
+    return result
+
+async def db_loop_stall(workdir):
+    """Session saves with a 1.5 MB image: called inline on the loop vs through the DB executor."""
+    from modules.utils import db_manager as db
+    db.init_db()
+    image = os.urandom(1_500_000)
+    result = {}
+    for mode in ("inline", "executor"):
+        lag = LoopLag(0.001)
+        lag.start()
+        await asyncio.sleep(0.01)
+        started = time.perf_counter()
+        async def one(i):
+            if mode == "inline":
+                db._save_db_session(i % 20, i, image, "a.png")
+                db._get_db_session(i % 20)
+            else:
+                await db.save_db_session(i % 20, i, image, "a.png")
+                await db.get_db_session(i % 20)
+        await asyncio.gather(*(one(i) for i in range(100)))
+        wall = time.perf_counter() - started
+        await lag.stop()
+        result[mode] = {"wall_s": round(wall, 3), "loop_lag_ms": lag.summary()}
+    db.close_db()
+    return result
+
+async def session_rows(workdir, sessions=10000, image_kb=48, fetches=1000):
+    """Session row fetches and database size with 10k sessions: image bytes inline vs blob hash."""
+    from sqlalchemy import create_engine, Column, String, BigInteger, Float, LargeBinary
+    from sqlalchemy.orm import DeclarativeBase, sessionmaker
+    from modules.utils import db_manager as db
+    from modules.utils.blob_store import blob_store
+
+    class LegacyBase(DeclarativeBase):
+        pass
+
+    class LegacySession(LegacyBase):
+        # The table before the blob store: the image is a plain column, loaded with every row.
+        __tablename__ = "sessions"
+        user_id = Column(String, primary_key=True)
+        channel_id = Column(BigInteger)
+        last_img_name = Column(String, nullable=True)
+        last_img_bytes = Column(LargeBinary, nullable=True)
+        updated_at = Column(Float, index=True)
+
+    legacy_path = os.path.join(workdir, "legacy.db")
+    legacy_engine = create_engine(f"sqlite:///{legacy_path}")
+    LegacyBase.metadata.create_all(legacy_engine)
+    db.init_db()
+    db_path = db.engine.url.database
+
+    def fill(make_session, model, row):
+        with make_session() as session:
+            for i in range(sessions):
+                session.add(model(**row(i)))
+            session.commit()
+
+    def image(i):
+        return random.Random(i).randbytes(image_kb * 1024)
+
+    def fetch(make_session, model):
+        users = random.Random(0).sample(range(sessions), fetches)
+        timings = []
+        for user in users:
+            started = time.perf_counter()
+            with make_session() as session:
+                session.get(model, str(user)).channel_id
+            timings.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        with make_session() as session:
+            session.query(model).all()
+        scan = time.perf_counter() - started
+        return {"get_ms": percentiles(timings, scale=1000, digits=3), "load_all_s": round(scan, 3)}
+
+    base = {"channel_id": 0, "last_img_name": "a.png", "updated_at": time.time()}
+    size_before = os.path.getsize(db_path)
+    await asyncio.to_thread(fill, sessionmaker(bind=legacy_engine), LegacySession,
+                            lambda i: dict(base, user_id=str(i), channel_id=i, last_img_bytes=image(i)))
+    await asyncio.to_thread(fill, db.SessionLocal, db.UserSession,
+                            lambda i: dict(base, user_id=str(i), channel_id=i, last_img_hash=blob_store.put(image(i))))
+    result = {
+        "sessions": sessions, "image_kb": image_kb,
+        "inline": dict(await asyncio.to_thread(fetch, sessionmaker(bind=legacy_engine), LegacySession),
+                       db_mb=round(os.path.getsize(legacy_path) / 2**20, 1)),
+        "blob_hash": dict(await asyncio.to_thread(fetch, db.SessionLocal, db.UserSession),
+                          db_mb=round((os.path.getsize(db_path) - size_before) / 2**20, 1),
+                          blob_store_mb=round(blob_store.total_bytes / 2**20, 1)),
+    }
+    legacy_engine.dispose()
+    db.close_db()
+    return result
+
+def _allocate(count, queue):
+    from sqlalchemy import event
+    from modules.utils import db_manager as db
+    statements = [0]
+    @event.listens_for(db.engine, "before_cursor_execute")
+    def counted(*args):
+        statements[0] += 1
+    async def run():
+        return await asyncio.gather(*(db.get_next_image_index() for _ in range(count)))
+    queue.put((asyncio.run(run()), statements[0]))
+
+async def index_allocator(workdir, processes=4, count=500):
+    """Image numbers handed out by several bot processes sharing one database."""
+    from modules.utils import db_manager as db
+    db.init_db()
+    db.close_db()
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    workers = [context.Process(target=_allocate, args=(count, queue)) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    results = [await asyncio.to_thread(queue.get) for _ in workers]
+    for worker in workers:
+        worker.join()
+    ids = [i for allocated, _ in results for i in allocated]
+    return {"allocated": len(ids), "unique": len(set(ids)),
+            "statements_per_image": round(sum(n for _, n in results) / len(ids), 4)}
+
+async def image_pipeline(workdir, images=20):
+    """Encoding results for upload: inline on the loop vs the worker process pool."""
+    from modules.utils.image_pipeline import ImagePipeline, render_outputs, UPLOAD_FORMAT, UPLOAD_QUALITY
+    pngs = [make_png(1024) for _ in range(images)]
+    pipeline = ImagePipeline()
+    await pipeline.process(pngs[0], "warm")
+    result = {"png_kb": len(pngs[0]) // 1024}
+    for mode in ("inline", "pool"):
+        lag = LoopLag(0.005)
+        lag.start()
+        started = time.perf_counter()
+        async def one(i, png):
+            if mode == "inline":
+                render_outputs(png, f"a{i}", UPLOAD_FORMAT, UPLOAD_QUALITY, None, 256)
+            else:
+                await pipeline.process(png, f"b{i}")
+        await asyncio.gather(*(one(i, png) for i, png in enumerate(pngs)))
+        wall = time.perf_counter() - started
+        await lag.stop()
+        result[mode] = {"wall_s": round(wall, 3), "loop_lag_ms": lag.summary()}
+    processed = await pipeline.process(pngs[0], "c")
+    result["upload_kb"] = len(processed["image_bytes"]) // 1024
+    pipeline.close()
+    return result
+
+async def clip_batch(workdir, sizes=(1, 4, 8, 16), repeats=3):
+    """CLIPTextEncodeBatch on CPU with a stub CLIP, for batches past the old 4-prompt ceiling."""
+    import json
+    import torch
+    from benchmarks.stub_clip import StubCLIP, prompt_of
+    from various_indications_node.batch_conditioning import CLIPTextEncodeBatch, encode_cache
+    torch.set_num_threads(max(1, min(4, os.cpu_count() or 1)))
+    clip, node = StubCLIP(width=1024), CLIPTextEncodeBatch()
+    result = {"stub": "1024 wide, 2 layers, 77-token chunks"}
+    for size in sizes:
+        prompts = json.dumps([prompt_of(1 + i % 3, i) for i in range(size)])
+        timings = []
+        for _ in range(repeats):
+            encode_cache.clear()
+            started = time.perf_counter()
+            (cond, extra), = node.encode(clip, size, "", "", texts=prompts, alignment="pad")[0]
+            timings.append(time.perf_counter() - started)
+        best = min(timings)
+        result[f"batch_{size}"] = {"ms": round(best * 1000, 1), "ms_per_prompt": round(best * 1000 / size, 1),
+                                   "cond_shape": list(cond.shape), "pooled_shape": list(extra["pooled_output"].shape)}
+    return result
+
+async def batch_downloads(workdir, batch=4, view_time=0.3):
+    """Output images of one 4-image batch through a /view that takes 0.3 s: one after another vs concurrently."""
+    import json
+    from modules.ai import comfy_api
+    from modules.ai.workflows import get_template
+    from modules.queue_manager.manager import Job
+    fake = FakeComfy(18393, base_time=0.2, per_image_time=0.0, view_time=view_time, image_size=1024)
+    await fake.start()
+    gpu = _gpu(fake)
+    template = get_template("flux_image")
+    jobs = [Job(1, f"prompt {i}", None, i) for i in range(batch)]
+    result = {"batch": batch, "view_s": view_time}
+
+    # The old process_standard_batch: wait for the prompt, then fetch each image in turn.
+    started = time.perf_counter()
+    workflow = template.render(batch_size=batch, prompts=json.dumps([j.prompt for j in jobs]), negatives="", seed=1)
+    prompt_id = (await comfy_api.queue_prompt(workflow, gpu))["prompt_id"]
+    entry = await comfy_api.wait_for_image(prompt_id, gpu)
+    arrivals = []
+    for img in entry["outputs"][template.output_node]["images"]:
+        await comfy_api.get_image(img["filename"], img["subfolder"], img["type"], gpu)
+        arrivals.append(time.perf_counter() - started)
+    result["serial"] = {"first_result_s": round(arrivals[0], 3), "last_result_s": round(arrivals[-1], 3)}
+
+    arrivals = []
+    async def on_result(job, res):
+        arrivals.append(time.perf_counter() - started)
+    started = time.perf_counter()
+    results = await comfy_api.process_standard_batch(jobs, gpu, on_result=on_result)
+    result["concurrent"] = {"first_result_s": round(min(arrivals), 3), "last_result_s": round(max(arrivals), 3),
+                            "ok": sum(r["status"] == "success" for r in results)}
+    await gpu.client.close()
+    await fake.stop()
+    return result
+
+async def upload_dedupe(workdir):
+    """A chain of five edits on the same 4 MB source, then the same after a bot restart."""
+    from modules.ai import comfy_api
+    fake = FakeComfy(18390)
+    await fake.start()
+    gpu = _gpu(fake)
+    source = os.urandom(4_000_000)
+    for _ in range(5):
+        await comfy_api.upload_image(source, "photo.png", gpu)
+    chain = fake.counts["upload_bytes"]
+    gpu.client.uploads.clear()
+    await comfy_api.upload_image(source, "photo.png", gpu)
+    restart = fake.counts["upload_bytes"] - chain
+    await gpu.client.close()
+    await fake.stop()
+    return {"source_mb": 4.0, "chain_of_5_uploaded_mb": round(chain / 1e6, 2), "after_restart_uploaded_mb": round(restart / 1e6, 2)}
+
+async def edit_batching(workdir, edits=4):
+    """Edits one at a time vs one stacked edit workflow, on a GPU costing 1s + 0.25s per image."""
+    from modules.ai import comfy_api
+    from modules.queue_manager.manager import Job
+    fake = FakeComfy(18391, base_time=1.0, per_image_time=0.25)
+    await fake.start()
+    gpu = _gpu(fake)
+    source = make_png(256)
+    def jobs():
+        return [Job(1, f"edit {i}", None, i, is_edit=True, input_image_bytes=source + bytes([i]), input_filename="a.png")
+                for i in range(edits)]
+    started = time.perf_counter()
+    serial = []
+    for job in jobs():
+        serial += await comfy_api.process_image_batch([job], gpu)
+    serial_s = time.perf_counter() - started
+    started = time.perf_counter()
+    batched = await comfy_api.process_image_batch(jobs(), gpu)
+    batched_s = time.perf_counter() - started
+    await gpu.client.close()
+    await fake.stop()
+    return {"edits": edits, "serial_s": round(serial_s, 3), "batched_s": round(batched_s, 3),
+            "serial_ok": sum(r["status"] == "success" for r in serial), "batched_ok": sum(r["status"] == "success" for r in batched)}
+
+async def request_coalescing(workdir, users=8):
+    """The same prompt from several users at once, then again with a seed (result cache)."""
+    fake = FakeComfy(int(os.environ["COMFY_URLS"].rsplit(":", 1)[1]), base_time=1.0, per_image_time=0.25)
+    harness = Harness([fake], Latency(send=0, upload=0))
+    await harness.start()
+    same = await asyncio.gather(*(harness.submit("imagine", harness.user(i), "a lighthouse in a storm") for i in range(users)))
+    coalesced = dict(fake.counts)
+    first = await harness.submit("imagine", harness.user(0), "a quiet harbour", seed=7)
+    again = await asyncio.gather(*(harness.submit("imagine", harness.user(i), "a quiet harbour", seed=7) for i in range(1, users)))
+    result = {
+        "identical_requests": users,
+        "delivered": sum(r["status"] == "success" for r in same),
+        "gpu_prompts": coalesced["prompts"], "gpu_images": coalesced["images"],
+        "seeded_first_s": round(first.get("latency", 0), 3),
+        "seeded_repeats_from_cache": sum(bool(r.get("cached")) for r in again),
+        "seeded_repeat_latency_s": percentiles([r["latency"] for r in again if "latency" in r]),
+        "gpu_prompts_after_repeats": fake.counts["prompts"],
+    }
+    await harness.stop()
+    return result
+
+async def session_reaper(workdir, sessions=10000):
+    """Idle wakeups of the expiry timer with many live sessions, and expiry of untouched ones."""
+    from modules.discord.session_reaper import SessionReaper
+    expired = []
+    async def expire(channel_ids):
+        expired.extend(channel_ids)
+    idle = SessionReaper(expire, ttl=3600)
+    idle.load((c, time.time()) for c in range(sessions))
+    idle.start()
+    await asyncio.sleep(1.0)
+    idle.stop()
+    busy = SessionReaper(expire, ttl=2.0, batch=100, pause=0.01)
+    now = time.time()
+    busy.load((c, now - random.uniform(0, 1.0)) for c in range(sessions))
+    busy.start()
+    kept = list(range(sessions // 2))
+    started = time.time()
+    while time.time() - started < 2.5:
+        for c in random.sample(kept, 500):
+            busy.touch(c, time.time())
+        await asyncio.sleep(0.1)
+    busy.stop()
+    kept = set(kept)
+    return {"sessions": sessions, "idle_wakeups_per_s": idle.wakeups, "busy_wakeups": busy.wakeups,
+            "expired_untouched": len(set(expired) - kept), "expired_touched": len(set(expired) & kept)}
+
+async def session_cache(workdir, users=50, interactions=1000):
+    """get_or_create plus the /imagine session save, with 50 ms Discord calls."""
+    from modules.utils.db_manager import init_db
+    from modules.utils.session_cache import session_cache as cache
+    from modules.discord.cogs.sessions import SessionManager
+    init_db()
+    latency = Latency(send=0.05, upload=0.05, jitter=0)
+    guild = FakeGuild(latency)
+    sessions = SessionManager(None)
+    people = [FakeUser(f"user{i}") for i in range(users)]
+    async def interact(user):
+        started = time.perf_counter()
+        channel = await sessions.get_or_create(FakeInteraction(guild, user))
+        await cache.save(user.id, channel.id)
+        return time.perf_counter() - started
+    for user in people:
+        await interact(user)
+    await cache.flush()
+    calls = latency.calls
+    timings = []
+    for _ in range(interactions // 20):
+        timings += await asyncio.gather(*(interact(random.choice(people)) for _ in range(20)))
+    await cache.flush()
+    return {"latency_ms": percentiles(timings, scale=1000, digits=3),
+            "discord_calls": latency.calls - calls, **cache.stats()}
+
+async def delivery(workdir, jobs=24):
+    """GPU idle time while Discord uploads are slow (1 s) and 10% of message calls get a 429."""
+    fake = FakeComfy(int(os.environ["COMFY_URLS"].rsplit(":", 1)[1]), base_time=0.5, per_image_time=0.1)
+    latency = Latency(send=0.2, upload=1.0, rate_limit=0.1)
+    harness = Harness([fake], latency)
+    await harness.start()
+    harness.reset_clocks()
+    started = time.perf_counter()
+    results = await asyncio.gather(*(harness.submit("imagine", harness.user(i % 6), f"tower #{i}") for i in range(jobs)))
+    elapsed = time.perf_counter() - started
+    from modules.discord.delivery import outbox
+    result = {"jobs": jobs, "delivered": sum(r["status"] == "success" for r in results), "elapsed_s": round(elapsed, 3),
+              "gpu_busy_s": round(fake.busy_time, 3), "gpu_idle_fraction": round(fake.idle_fraction(), 4), "injected_429": latency.rate_limited, **outbox.stats()}
+    await harness.stop()
+    return result
+
+async def metrics_overhead(workdir):
+    """Cost of recording one observation and of rendering the endpoint."""
+    from modules.utils.metrics import Metrics
+    registry = Metrics()
+    n = 100000
+    observe = timeit.timeit(lambda: registry.observe("stage_seconds", 0.1, stage="download", gpu="http://gpu:8188"), number=n) / n
+    def timed():
+        with registry.timer("stage_seconds", stage="db", op="save"):
+            pass
+    timer = timeit.timeit(timed, number=n) / n
+    for stage in ("queue_wait", "batch_form", "submit", "execute", "download", "upload", "db", "encode"):
+        for gpu in range(4):
+            registry.observe("stage_seconds", random.random(), stage=stage, gpu=gpu)
+    render = timeit.timeit(registry.render, number=100) / 100
+    return {"observe_us": round(observe * 1e6, 3), "timer_us": round(timer * 1e6, 3), "render_ms": round(render * 1000, 3)}
+
+BENCHMARKS = {
+    "comfy_pooling": comfy_pooling,
+    "admission": admission,
+    "batching_policies": batching_policies,
+    "db_loop_stall": db_loop_stall,
+    "session_rows": session_rows,
+    "index_allocator": index_allocator,
+    "image_pipeline": image_pipeline,
+    "clip_batch": clip_batch,
+    "batch_downloads": batch_downloads,
+    "upload_dedupe": upload_dedupe,
+    "edit_batching": edit_batching,
+    "request_coalescing": request_coalescing,
+    "session_reaper": session_reaper,
+    "session_cache": session_cache,
+    "delivery": delivery,
+    "metrics_overhead": metrics_overhead,
+}
@@ -0,0 +1,28 @@
+import zlib
+import torch
+
+class StubCLIP:
+    """Stands in for ComfyUI's CLIP object: 77-token chunks (one per 20 words) run through a few
+    dense layers, so encoding costs real CPU time and grows with prompt length."""
+
+    def __init__(self, width: int = 4096, pooled_width: int = 768, layers: int = 2, chunk: int = 77):
+        generator = torch.Generator().manual_seed(0)
+        self.width, self.pooled_width, self.chunk = width, pooled_width, chunk
+        self.layers = [torch.randn(width, width, generator=generator) / width ** 0.5 for _ in range(layers)]
+        self.encodes = 0
+
+    def tokenize(self, text: str) -> dict:
+        return {"text": text, "chunks": 1 + len(text.split()) // 20}
+
+    def encode_from_tokens(self, tokens: dict, return_pooled: bool = False):
+        self.encodes += 1
+        generator = torch.Generator().manual_seed(zlib.crc32(tokens["text"].encode()))
+        hidden = torch.randn(1, self.chunk * tokens["chunks"], self.width, generator=generator)
+        for weight in self.layers:
+            hidden = torch.tanh(hidden @ weight)
+        pooled = hidden.mean(dim=1)[:, :self.pooled_width]
+        return (hidden, pooled) if return_pooled else hidden
+
+def prompt_of(chunks: int, seed: int = 0) -> str:
+    """A prompt that tokenizes to `chunks` chunks."""
+    return " ".join(f"w{seed}_{i}" for i in range(20 * chunks - 1))
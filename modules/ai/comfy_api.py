@@ -1,70 +1,130 @@
+import os
 import json
 import random
 import time
+import hashlib
 import asyncio
-import os
 import aiohttp
-import base64
 from modules.utils.image_filter import sanitize_image
-from modules.ai.gpu_pool import gpu_pool
+from modules.ai.gpu_pool import gpu_pool, GPUInstance
+from modules.ai.comfy_events import history_error
+from modules.ai.workflows import get_template, ANIMA_BASE_MODEL
+from modules.utils.metrics import metrics
 
-ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+POLL_MIN_INTERVAL = 0.5
+POLL_MAX_INTERVAL = 2.0
+WS_RECHECK_INTERVAL = 30.0
 
-def get_headers(api_key: str) -> dict:
-    headers = {"ngrok-skip-browser-warning": "69420"}
-    if not api_key:
-        return headers
-    if ":" in api_key:
-        encoded = base64.b64encode(api_key.encode()).decode()
-        headers["Authorization"] = f"Basic {encoded}"
-    else:
-        headers["Authorization"] = f"Bearer {api_key}"
-    return headers
+async def queue_prompt(workflow: dict, gpu: GPUInstance, model: str = "") -> dict:
+    gpu.client.events.start()
+    with metrics.timer("stage_seconds", stage="submit", gpu=gpu.url, model=model):
+        return await gpu.client.post_json("/prompt", {"prompt": workflow, "client_id": gpu.client.events.client_id})
 
-def load_workflow(filename: str) -> dict:
-    path = os.path.join(ROOT_DIR, "flujos", filename)
-    if not os.path.exists(path):
-        raise FileNotFoundError(f"Workflow file not found at {path}")
-    with open(path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+async def get_history(prompt_id: str, gpu: GPUInstance) -> dict:
+    return await gpu.client.get_json(f"/history/{prompt_id}", timeout=15)
 
-async def queue_prompt(workflow: dict, gpu_url: str, api_key: str) -> dict:
-    p = {"prompt": workflow}
-    async with aiohttp.ClientSession() as session:
-        async with session.post(f"{gpu_url}/prompt", json=p, headers=get_headers(api_key)) as response:
-            return await response.json()
+async def get_image(filename: str, subfolder: str, folder_type: str, gpu: GPUInstance) -> bytes:
+    params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+    with metrics.timer("stage_seconds", stage="download", gpu=gpu.url):
+        return await gpu.client.stream_bytes("/view", params=params)
 
-async def get_history(prompt_id: str, gpu_url: str, api_key: str) -> dict:
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f"{gpu_url}/history/{prompt_id}", headers=get_headers(api_key)) as response:
-            return await response.json()
+async def upload_image(image_bytes: bytes, filename: str, gpu: GPUInstance) -> str:
+    with metrics.timer("stage_seconds", stage="upload", gpu=gpu.url):
+        return await _upload_image(image_bytes, filename, gpu)
 
-async def get_image(filename: str, subfolder: str, folder_type: str, gpu_url: str, api_key: str) -> bytes:
-    data = {"filename": filename, "subfolder": subfolder, "type": folder_type}
-    async with aiohttp.ClientSession() as session:
-        async with session.get(f"{gpu_url}/view", params=data, headers=get_headers(api_key)) as response:
-            return await response.read()
+async def _upload_image(image_bytes: bytes, filename: str, gpu: GPUInstance) -> str:
+    # Named after the content, so an edit chain reusing one source image uploads it once per GPU.
+    digest = (await asyncio.to_thread(hashlib.sha256, image_bytes)).hexdigest()
+    cached = gpu.client.uploads.get(digest)
+    if cached:
+        return cached
+    ext = os.path.splitext(filename)[1].lower() or ".png"
+    name = f"fullet_{digest[:32]}{ext}"
+    try:
+        present = await gpu.client.head_status("/view", params={"filename": name, "type": "input"}, timeout=5) == 200
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        present = False
+    if not present:
+        data = aiohttp.FormData()
+        data.add_field('image', image_bytes, filename=name, content_type='image/png')
+        data.add_field('overwrite', 'true')
+        resp = await gpu.client.post_form("/upload/image", data)
+        name = resp.get("name", name)
+    gpu.client.uploads.put(digest, name, len(image_bytes))
+    return name
 
-async def upload_image(image_bytes: bytes, filename: str, gpu_url: str, api_key: str) -> str:
-    data = aiohttp.FormData()
-    data.add_field('image', image_bytes, filename=filename, content_type='image/png')
-    data.add_field('overwrite', 'true')
-    
-    async with aiohttp.ClientSession() as session:
-        async with session.post(f"{gpu_url}/upload/image", data=data, headers=get_headers(api_key)) as response:
-            resp = await response.json()
-            return resp.get("name", filename)
+async def wait_for_image(prompt_id: str, gpu: GPUInstance, timeout: int = 300, on_progress=None, model: str = "") -> dict:
+    with metrics.timer("stage_seconds", stage="execute", gpu=gpu.url, model=model):
+        return await _wait_for_image(prompt_id, gpu, timeout, on_progress)
 
-async def wait_for_image(prompt_id: str, gpu_url: str, api_key: str, timeout: int = 300) -> dict:
-    start_time = time.time()
-    while time.time() - start_time < timeout:
-        history = await get_history(prompt_id, gpu_url, api_key)
-        if prompt_id in history:
-            return history[prompt_id]
-        await asyncio.sleep(2)
-    return None
+async def _wait_for_image(prompt_id: str, gpu: GPUInstance, timeout: int, on_progress) -> dict:
+    events = gpu.client.events
+    events.start()
+    tracker = events.track(prompt_id, on_progress)
+    start_time = synced_at = time.time()
+    delay = POLL_MIN_INTERVAL
+    try:
+        while time.time() - start_time < timeout:
+            remaining = timeout - (time.time() - start_time)
+            # Socket events are only trusted once the socket was up at the last point we synced state.
+            if events.connected and events.connected_at <= synced_at and not tracker.future.done():
+                down = asyncio.ensure_future(events.wait_disconnected())
+                try:
+                    await asyncio.wait([tracker.future, down], timeout=min(remaining, WS_RECHECK_INTERVAL), return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    down.cancel()
+            if tracker.future.done():
+                entry = tracker.future.result()
+                if entry["outputs"] or history_error(entry):
+                    return entry
+                # Cached output nodes emit no "executed" event; history still has them.
+
+            synced_at = time.time()
+            history = await get_history(prompt_id, gpu)
+            if prompt_id in history:
+                return history[prompt_id]
+            if not events.connected or tracker.future.done():
+                await asyncio.sleep(min(delay, max(0, timeout - (time.time() - start_time))))
+                delay = min(delay * 2, POLL_MAX_INTERVAL)
+        return None
+    finally:
+        events.forget(prompt_id)
+
+def job_seed(jobs):
+    seed = getattr(jobs[0], 'seed', None) if len(jobs) == 1 else None
+    return seed if seed is not None else random.randint(1, 10**15)
+
+def result_key(job):
+    """Cache key of a seeded text-to-image job, or None when its output isn't reproducible."""
+    if getattr(job, 'seed', None) is None or job.is_edit or job.input_image_bytes:
+        return None
+    model_type = getattr(job, 'model_type', 'flux')
+    name = "anima" if model_type == "anima" else "flux_image"
+    template = get_template(name)
+    try:
+        resolution = (template.default("width"), template.default("height"))
+    except (OSError, KeyError):
+        resolution = None
+    return (name, model_type, getattr(job, 'lora_name', None), job.prompt, job.seed, resolution)
 
-async def process_image_batch(jobs):
+def progress_fanout(jobs):
+    callbacks = [j.on_progress for j in jobs if getattr(j, 'on_progress', None)]
+    if not callbacks:
+        return None
+    def report(value, total):
+        for callback in callbacks:
+            callback(value, total)
+    return report
+
+async def emit_result(on_result, job, result):
+    if on_result is None:
+        return
+    try:
+        await on_result(job, result)
+    except Exception as e:
+        print(f"Result delivery error: {e}")
+
+async def process_image_batch(jobs, gpu: GPUInstance, on_result=None):
     if not jobs: return []
     
     edit_jobs = [j for j in jobs if j.is_edit or j.input_image_bytes]
@@ -74,7 +134,7 @@ async def process_image_batch(jobs):
     results = [None] * len(jobs)
     
     if standard_jobs:
-        std_results = await process_standard_batch(standard_jobs)
+        std_results = await process_standard_batch(standard_jobs, gpu, on_result)
         std_idx = 0
         for i, job in enumerate(jobs):
             if not job.is_edit and not job.input_image_bytes and getattr(job, 'model_type', 'flux') != 'anima':
@@ -84,53 +144,52 @@ async def process_image_batch(jobs):
     if anima_jobs:
         for i, job in enumerate(jobs):
             if not job.is_edit and not job.input_image_bytes and getattr(job, 'model_type', 'flux') == 'anima':
-                results[i] = await process_anima_job(job)
+                results[i] = await process_anima_job(job, gpu)
+                await emit_result(on_result, job, results[i])
                 
-    if edit_jobs:
+    if len(edit_jobs) > 1:
+        edit_results = iter(await process_edit_batch(edit_jobs, gpu, on_result))
+        for i, job in enumerate(jobs):
+            if job.is_edit or job.input_image_bytes:
+                results[i] = next(edit_results)
+    elif edit_jobs:
         for i, job in enumerate(jobs):
             if job.is_edit or job.input_image_bytes:
-                results[i] = await process_single_edit_job(job)
+                results[i] = await process_single_edit_job(job, gpu)
+                await emit_result(on_result, job, results[i])
                 
     return results
 
-async def process_anima_job(job):
-    print(f"[ANIMA] Processing job: {job.prompt}")
-    gpu = await gpu_pool.wait_for_available_gpu("anima", timeout=120.0)
-    if not gpu: return {"status": "error", "message": "No GPU available"}
-    print(f"[ANIMA] GPU found: {gpu.url}")
-    
-    await gpu_pool.reserve_gpu(gpu, "anima")
+async def process_anima_job(job, gpu: GPUInstance):
+    print(f"[ANIMA] Processing job on {gpu.url}: {job.prompt}")
     try:
-        workflow = load_workflow("anima.json")
-        
-        lora_node = "101"
+        template = get_template("anima")
+        values = {"prompt": job.prompt, "seed": job_seed([job])}
         if getattr(job, 'lora_name', None):
             print(f"[ANIMA] Using LoRA: {job.lora_name}")
-            if lora_node in workflow:
-                workflow[lora_node]["inputs"]["lora_name"] = job.lora_name
+            values["lora_name"] = job.lora_name
         else:
             print("[ANIMA] No LoRA selected, bypassing...")
-            if "3" in workflow:
-                workflow["3"]["inputs"]["model"] = ["2", 0]
-
-        if "4" in workflow:
-            workflow["4"]["inputs"]["text"] = job.prompt
-        if "3" in workflow:
-            workflow["3"]["inputs"]["seed"] = random.randint(1, 10**15)
+            values["sampler_model"] = ANIMA_BASE_MODEL
+        workflow = template.render(**values)
             
         print("[ANIMA] Sending to ComfyUI...")
-        response = await queue_prompt(workflow, gpu.url, gpu.api_key)
+        response = await queue_prompt(workflow, gpu, template.name)
         prompt_id = response.get("prompt_id")
         if not prompt_id:
             msg = response.get("error", {}).get("message", "Workflow rejected")
             return {"status": "error", "message": msg}
             
-        history_entry = await wait_for_image(prompt_id, gpu.url, gpu.api_key)
+        history_entry = await wait_for_image(prompt_id, gpu, on_progress=progress_fanout([job]), model=template.name)
+        error = history_error(history_entry)
+        if error:
+            return {"status": "error", "message": error}
         if history_entry:
             outputs = history_entry.get("outputs", {})
-            if "10" in outputs and "images" in outputs["10"]:
-                img_data = outputs["10"]["images"][0]
-                img_bytes = await get_image(img_data["filename"], img_data["subfolder"], img_data["type"], gpu.url, gpu.api_key)
+            save_node = template.output_node
+            if save_node in outputs and "images" in outputs[save_node]:
+                img_data = outputs[save_node]["images"][0]
+                img_bytes = await get_image(img_data["filename"], img_data["subfolder"], img_data["type"], gpu)
                 return {"status": "success", "image_bytes": img_bytes, "filename": img_data["filename"], "user_id": job.user_id}
         return {"status": "error", "message": "Timeout or no output"}
     except aiohttp.ContentTypeError:
@@ -139,159 +198,152 @@ async def process_anima_job(job):
         return {"status": "error", "message": "Connection error"}
     except Exception:
         return {"status": "error", "message": "Generation failed"}
-    finally:
-        await gpu_pool.release_gpu(gpu, "anima")
 
-async def process_single_edit_job(job):
-    gpu = await gpu_pool.wait_for_available_gpu("flux", timeout=120.0)
-    if not gpu: return {"status": "error", "message": "No GPU available"}
-    
-    await gpu_pool.reserve_gpu(gpu, "flux")
+async def process_single_edit_job(job, gpu: GPUInstance):
+    template = get_template("flux_edit")
     try:
-        try:
-            workflow = load_workflow("flux_edit.json")
-        except FileNotFoundError:
-            return {"status": "error", "message": "Edit workflow not found"}
-            
-        if job.input_image_bytes:
-            filename = job.input_filename or f"upload_{int(time.time())}.png"
-            uploaded_name = await upload_image(job.input_image_bytes, filename, gpu.url, gpu.api_key)
-        else:
-            return {"status": "error", "message": "No input image for edit"}
-            
-        INPUT_NODE = "103"
-        POS_NODE = "75:74"
-        NEG_NODE = "75:67"
+        template.load()
+    except FileNotFoundError:
+        return {"status": "error", "message": "Edit workflow not found"}
         
-        if INPUT_NODE in workflow:
-            workflow[INPUT_NODE]["inputs"]["image"] = uploaded_name
-            
-        if POS_NODE in workflow:
-            workflow[POS_NODE]["inputs"]["text"] = job.prompt
-            
-        if NEG_NODE in workflow:
-            workflow[NEG_NODE]["inputs"]["text"] = ""
+    if job.input_image_bytes:
+        filename = job.input_filename or f"upload_{int(time.time())}.png"
+        uploaded_name = await upload_image(job.input_image_bytes, filename, gpu)
+    else:
+        return {"status": "error", "message": "No input image for edit"}
 
-        NOISE_NODE = "75:73"
-        if NOISE_NODE in workflow:
-            workflow[NOISE_NODE]["inputs"]["noise_seed"] = random.randint(1, 10**15)
+    workflow = template.render(image=uploaded_name, prompt=job.prompt, negative="", seed=random.randint(1, 10**15))
 
-        try:
-            response = await queue_prompt(workflow, gpu.url, gpu.api_key)
-            prompt_id = response.get("prompt_id")
-            if not prompt_id:
-                msg = response.get("error", {}).get("message", "Workflow rejected")
-                return {"status": "error", "message": msg}
-                
-            history_entry = await wait_for_image(prompt_id, gpu.url, gpu.api_key)
+    try:
+        response = await queue_prompt(workflow, gpu, template.name)
+        prompt_id = response.get("prompt_id")
+        if not prompt_id:
+            msg = response.get("error", {}).get("message", "Workflow rejected")
+            return {"status": "error", "message": msg}
+            
+        history_entry = await wait_for_image(prompt_id, gpu, on_progress=progress_fanout([job]), model=template.name)
+        error = history_error(history_entry)
+        if error:
+            return {"status": "error", "message": error}
             
-            if history_entry:
-                outputs = history_entry.get("outputs", {})
-                save_node = "9" 
-                if save_node in outputs and "images" in outputs[save_node]:
-                    img_data = outputs[save_node]["images"][0]
-                    img_bytes = await get_image(img_data["filename"], img_data["subfolder"], img_data["type"], gpu.url, gpu.api_key)
-                    return {
-                        "status": "success",
-                        "image_bytes": img_bytes,
-                        "filename": img_data["filename"],
-                        "user_id": job.user_id
-                    }
-                else:
-                    return {"status": "error", "message": "No output images"}
+        if history_entry:
+            outputs = history_entry.get("outputs", {})
+            save_node = template.output_node
+            if save_node in outputs and "images" in outputs[save_node]:
+                img_data = outputs[save_node]["images"][0]
+                img_bytes = await get_image(img_data["filename"], img_data["subfolder"], img_data["type"], gpu)
+                return {
+                    "status": "success",
+                    "image_bytes": img_bytes,
+                    "filename": img_data["filename"],
+                    "user_id": job.user_id
+                }
             else:
-                return {"status": "error", "message": "Timeout"}
-                
-        except aiohttp.ContentTypeError:
-            return {"status": "error", "message": "GPU server unavailable"}
-        except aiohttp.ClientError:
-            return {"status": "error", "message": "Connection error"}
-        except Exception:
-            return {"status": "error", "message": "Edit failed"}
+                return {"status": "error", "message": "No output images"}
+        else:
+            return {"status": "error", "message": "Timeout"}
+            
+    except aiohttp.ContentTypeError:
+        return {"status": "error", "message": "GPU server unavailable"}
+    except aiohttp.ClientError:
+        return {"status": "error", "message": "Connection error"}
+    except Exception:
+        return {"status": "error", "message": "Edit failed"}
 
-    finally:
-        await gpu_pool.release_gpu(gpu, "flux")
 
-async def process_standard_batch(jobs):
+async def process_standard_batch(jobs, gpu: GPUInstance, on_result=None):
     if not jobs: return []
-    gpu = await gpu_pool.wait_for_available_gpu("flux", timeout=120.0)
-    if not gpu: return [{"status": "error", "message": "No GPU available"} for _ in jobs]
-    await gpu_pool.reserve_gpu(gpu, "flux")
-    try:
-        workflow = load_workflow("flux_image.json")
-        batch_size = len(jobs)
-        prompts = [j.prompt for j in jobs]
-        while len(prompts) < 4: prompts.append("")
+    template = get_template("flux_image")
+    workflow = template.render(
+        batch_size=len(jobs),
+        prompts=json.dumps([j.prompt for j in jobs], ensure_ascii=False),
+        negatives="",
+        seed=job_seed(jobs)
+    )
+    return await run_batch_workflow(workflow, template, jobs, gpu, on_result)
 
-        POS_NODE = "75:74"
-        NEG_NODE = "75:67"
-        LATENT_NODE = "75:66"
-        NOISE_NODE = "75:73"
+async def process_edit_batch(jobs, gpu: GPUInstance, on_result=None):
+    if not jobs: return []
+    template = get_template("flux_edit_batch")
+    try:
+        template.load()
+    except FileNotFoundError:
+        return [{"status": "error", "message": "Edit workflow not found"} for _ in jobs]
+    if any(not j.input_image_bytes for j in jobs):
+        ready = [j for j in jobs if j.input_image_bytes]
+        done = iter(await process_edit_batch(ready, gpu, on_result))
+        results = []
+        for job in jobs:
+            if job.input_image_bytes:
+                results.append(next(done))
+            else:
+                results.append({"status": "error", "message": "No input image for edit"})
+                await emit_result(on_result, job, results[-1])
+        return results
 
-        if POS_NODE in workflow:
-            workflow[POS_NODE]["inputs"].update({
-                "batch_size": batch_size,
-                "text_1": prompts[0],
-                "text_2": prompts[1],
-                "text_3": prompts[2],
-                "text_4": prompts[3]
-            })
-        
-        if NEG_NODE in workflow:
-            workflow[NEG_NODE]["inputs"].update({
-                "batch_size": batch_size,
-                "text_1": "",
-                "text_2": "",
-                "text_3": "",
-                "text_4": ""
-            })
+    try:
+        names = await asyncio.gather(*(
+            upload_image(j.input_image_bytes, j.input_filename or "upload.png", gpu) for j in jobs
+        ))
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return [{"status": "error", "message": "Connection error"} for _ in jobs]
 
-        if LATENT_NODE in workflow:
-            workflow[LATENT_NODE]["inputs"]["batch_size"] = batch_size
+    workflow = template.render(
+        images=json.dumps(names, ensure_ascii=False),
+        batch_size=len(jobs),
+        prompts=json.dumps([j.prompt for j in jobs], ensure_ascii=False),
+        negatives="",
+        seed=random.randint(1, 10**15)
+    )
+    return await run_batch_workflow(workflow, template, jobs, gpu, on_result)
 
-        if NOISE_NODE in workflow:
-            workflow[NOISE_NODE]["inputs"]["noise_seed"] = random.randint(1, 10**15)
+async def run_batch_workflow(workflow, template, jobs, gpu: GPUInstance, on_result=None):
+    try:
+        response = await queue_prompt(workflow, gpu, template.name)
+        prompt_id = response.get("prompt_id")
+    except aiohttp.ContentTypeError:
+        return [{"status": "error", "message": "GPU server unavailable"} for _ in jobs]
+    except aiohttp.ClientError:
+        return [{"status": "error", "message": "Connection error"} for _ in jobs]
+    except:
+        return [{"status": "error", "message": "Generation failed"} for _ in jobs]
+    
+    if not prompt_id:
+        msg = response.get("error", {}).get("message", "Workflow rejected")
+        return [{"status": "error", "message": msg} for _ in jobs]
 
-        try:
-            response = await queue_prompt(workflow, gpu.url, gpu.api_key)
-            prompt_id = response.get("prompt_id")
-        except aiohttp.ContentTypeError:
-            return [{"status": "error", "message": "GPU server unavailable"} for _ in jobs]
-        except aiohttp.ClientError:
-            return [{"status": "error", "message": "Connection error"} for _ in jobs]
-        except:
-            return [{"status": "error", "message": "Generation failed"} for _ in jobs]
-        
-        if not prompt_id:
-            msg = response.get("error", {}).get("message", "Workflow rejected")
-            return [{"status": "error", "message": msg} for _ in jobs]
+    history_entry = await wait_for_image(prompt_id, gpu, on_progress=progress_fanout(jobs), model=template.name)
+    error = history_error(history_entry)
+    if error:
+        return [{"status": "error", "message": error} for _ in jobs]
+    if not history_entry:
+        return [{"status": "error", "message": "Timeout"} for _ in jobs]
+    outputs = history_entry.get("outputs", {})
+    save_node = template.output_node
+    if save_node not in outputs or "images" not in outputs[save_node]:
+        return [{"status": "error", "message": "No output images"} for _ in jobs]
+    images_list = outputs[save_node]["images"]
 
-        history_entry = await wait_for_image(prompt_id, gpu.url, gpu.api_key)
-        final_responses = []
-        if history_entry:
-            outputs = history_entry.get("outputs", {})
-            save_node = "9"
-            if save_node in outputs and "images" in outputs[save_node]:
-                images_list = outputs[save_node]["images"]
-                for i, job in enumerate(jobs):
-                    if i < len(images_list):
-                        img_data = images_list[i]
-                        img_bytes = await get_image(img_data["filename"], img_data["subfolder"], img_data["type"], gpu.url, gpu.api_key)
-                        final_responses.append({
-                            "status": "success",
-                            "image_bytes": img_bytes,
-                            "filename": img_data["filename"],
-                            "user_id": job.user_id
-                        })
-                    else:
-                        final_responses.append({"status": "error", "message": "Index missing"})
-            else:
-                return [{"status": "error", "message": "No output images"} for _ in jobs]
+    async def fetch(i, job):
+        # Downloads run concurrently (bounded per GPU); each result is handed off as soon as it lands.
+        if i < len(images_list):
+            img_data = images_list[i]
+            try:
+                img_bytes = await get_image(img_data["filename"], img_data["subfolder"], img_data["type"], gpu)
+                result = {
+                    "status": "success",
+                    "image_bytes": img_bytes,
+                    "filename": img_data["filename"],
+                    "user_id": job.user_id
+                }
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                result = {"status": "error", "message": "Download failed"}
         else:
-            return [{"status": "error", "message": "Timeout"} for _ in jobs]
-        return final_responses
-    finally:
-        await gpu_pool.release_gpu(gpu, "flux")
+            result = {"status": "error", "message": "Index missing"}
+        await emit_result(on_result, job, result)
+        return result
+
+    return list(await asyncio.gather(*(fetch(i, job) for i, job in enumerate(jobs))))
 
 async def process_image_gen(prompt, input_image_bytes=None, input_filename=None, model_type="flux"):
     class MockJob:
@@ -299,5 +351,11 @@ async def process_image_gen(prompt, input_image_bytes=None, input_filename=None,
             self.prompt = p
             self.user_id = "single"
             self.model_type = "flux"
-    res = await process_image_batch([MockJob(prompt)])
+    gpu = await gpu_pool.wait_for_available_gpu("flux", timeout=120.0)
+    if not gpu: return {"status": "error", "message": "No GPU available"}
+    await gpu_pool.reserve_gpu(gpu, "flux")
+    try:
+        res = await process_image_batch([MockJob(prompt)], gpu)
+    finally:
+        await gpu_pool.release_gpu(gpu, "flux")
     return res[0]
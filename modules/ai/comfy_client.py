@@ -0,0 +1,164 @@
+import os
+import base64
+import asyncio
+import aiohttp
+from collections import OrderedDict
+from modules.ai.comfy_events import ComfyEventListener
+
+CONNECTION_LIMIT = int(os.getenv("COMFY_MAX_CONNECTIONS", "8"))
+DNS_CACHE_TTL = int(os.getenv("COMFY_DNS_TTL", "300"))
+KEEPALIVE_TIMEOUT = float(os.getenv("COMFY_KEEPALIVE", "60"))
+CONNECT_TIMEOUT = float(os.getenv("COMFY_CONNECT_TIMEOUT", "10"))
+REQUEST_TIMEOUT = float(os.getenv("COMFY_REQUEST_TIMEOUT", "60"))
+DOWNLOAD_CONCURRENCY = int(os.getenv("COMFY_DOWNLOAD_CONCURRENCY", "4"))
+DOWNLOAD_CHUNK = 64 * 1024
+UPLOAD_CACHE_MB = float(os.getenv("COMFY_UPLOAD_CACHE_MB", "512"))
+
+def get_headers(api_key: str) -> dict:
+    headers = {"ngrok-skip-browser-warning": "69420"}
+    if not api_key:
+        return headers
+    if ":" in api_key:
+        encoded = base64.b64encode(api_key.encode()).decode()
+        headers["Authorization"] = f"Basic {encoded}"
+    else:
+        headers["Authorization"] = f"Bearer {api_key}"
+    return headers
+
+class UploadCache:
+    """Server-side filenames of images already uploaded to one GPU, keyed by content hash."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+
+    def get(self, digest: str):
+        entry = self.entries.get(digest)
+        if entry is None:
+            return None
+        self.entries.move_to_end(digest)
+        return entry[0]
+
+    def put(self, digest: str, name: str, size: int):
+        if digest in self.entries:
+            self.bytes -= self.entries.pop(digest)[1]
+        self.entries[digest] = (name, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes and self.entries:
+            _, (_, old_size) = self.entries.popitem(last=False)
+            self.bytes -= old_size
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+def server_identity(system_stats: dict) -> tuple:
+    """What stays the same for one ComfyUI install: versions, launch flags and devices, not free memory."""
+    system = system_stats.get("system") or {}
+    devices = tuple((d.get("name"), d.get("vram_total")) for d in system_stats.get("devices") or [])
+    return (system.get("comfyui_version"), system.get("pytorch_version"), tuple(system.get("argv") or ()), devices)
+
+class ComfyClient:
+    def __init__(self, url: str, api_key: str, limit: int = CONNECTION_LIMIT, dns_ttl: int = DNS_CACHE_TTL):
+        self.url = url.rstrip("/")
+        self.api_key = api_key
+        self.headers = get_headers(api_key)
+        self.limit = limit
+        self.dns_ttl = dns_ttl
+        self._session: aiohttp.ClientSession = None
+        self.closed = False
+        self.downloads = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+        self.uploads = UploadCache(int(UPLOAD_CACHE_MB * 1024 * 1024))
+        self.identity = None
+        self.history_marker = None
+        self.events = ComfyEventListener(self)
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # Created lazily: the pool is built at import time, before the bot's loop exists.
+        if self.closed:
+            raise RuntimeError(f"ComfyUI client for {self.url} is closed")
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit,
+                ttl_dns_cache=self.dns_ttl,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT, sock_connect=CONNECT_TIMEOUT),
+            )
+        return self._session
+
+    def _timeout(self, timeout):
+        if timeout is None:
+            return None
+        return aiohttp.ClientTimeout(total=timeout, sock_connect=min(timeout, CONNECT_TIMEOUT))
+
+    async def get_json(self, path: str, params: dict = None, timeout: float = None):
+        async with self.session.get(f"{self.url}{path}", params=params, timeout=self._timeout(timeout)) as response:
+            return await response.json()
+
+    async def post_json(self, path: str, payload: dict, timeout: float = None):
+        async with self.session.post(f"{self.url}{path}", json=payload, timeout=self._timeout(timeout)) as response:
+            return await response.json()
+
+    async def post_form(self, path: str, data: aiohttp.FormData, timeout: float = None):
+        async with self.session.post(f"{self.url}{path}", data=data, timeout=self._timeout(timeout)) as response:
+            return await response.json()
+
+    async def get_bytes(self, path: str, params: dict = None, timeout: float = None) -> bytes:
+        async with self.session.get(f"{self.url}{path}", params=params, timeout=self._timeout(timeout)) as response:
+            return await response.read()
+
+    async def stream_bytes(self, path: str, params: dict = None, timeout: float = None) -> bytes:
+        async with self.downloads:
+            async with self.session.get(f"{self.url}{path}", params=params, timeout=self._timeout(timeout)) as response:
+                response.raise_for_status()
+                chunks = []
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK):
+                    chunks.append(chunk)
+                return b"".join(chunks)
+
+    async def get_status(self, path: str, timeout: float = None) -> int:
+        async with self.session.get(f"{self.url}{path}", timeout=self._timeout(timeout)) as response:
+            await response.read()
+            return response.status
+
+    async def head_status(self, path: str, params: dict = None, timeout: float = None) -> int:
+        async with self.session.head(f"{self.url}{path}", params=params, timeout=self._timeout(timeout)) as response:
+            return response.status
+
+    async def check_restart(self, system_stats: dict = None) -> bool:
+        """Whether a new ComfyUI process answers since the last check; its input folder can't be trusted then.
+
+        Another install behind the same URL changes the /system_stats identity. A restart of the
+        same install doesn't, but it loses /history, which ComfyUI only keeps in memory: a prompt
+        seen there before and now gone means a new process, however fast the restart was.
+        """
+        if system_stats is None:
+            system_stats = await self.get_json("/system_stats", timeout=5)
+        identity = server_identity(system_stats)
+        restarted = self.identity is not None and identity != self.identity
+        self.identity = identity
+        if not restarted and self.history_marker is not None:
+            restarted = self.history_marker not in await self.get_json(f"/history/{self.history_marker}", timeout=5)
+        if restarted:
+            print(f"[GPU] {self.url} restarted, dropping {len(self.uploads.entries)} cached uploads")
+            self.uploads.clear()
+            self.history_marker = None
+        if self.history_marker is None:
+            latest = await self.get_json("/history", params={"max_items": 1}, timeout=5)
+            self.history_marker = next(iter(latest), None)
+        return restarted
+
+    async def close(self):
+        # Never reopened afterwards: a late caller would leak a session nobody closes.
+        self.closed = True
+        await self.events.stop()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
@@ -0,0 +1,144 @@
+import os
+import time
+import uuid
+import asyncio
+import aiohttp
+from collections import OrderedDict
+
+WS_RECONNECT_MAX = float(os.getenv("COMFY_WS_RECONNECT_MAX", "30"))
+MAX_TRACKED_PROMPTS = 256
+
+class PromptTracker:
+    def __init__(self):
+        self.future = asyncio.get_running_loop().create_future()
+        self.outputs = {}
+        self.on_progress = None
+
+    def finish(self, error: str = None):
+        # Shaped like a ComfyUI history entry, so callers read socket and polled results the same way.
+        if self.future.done():
+            return
+        if error:
+            status = {"status_str": "error", "completed": False,
+                      "messages": [["execution_error", {"exception_message": error}]]}
+        else:
+            status = {"status_str": "success", "completed": True, "messages": []}
+        self.future.set_result({"outputs": self.outputs, "status": status})
+
+def history_error(entry):
+    """The failure ComfyUI recorded in a history entry's status, or None if the prompt didn't fail."""
+    status = (entry or {}).get("status") or {}
+    if status.get("status_str") != "error":
+        return None
+    for message in status.get("messages") or []:
+        if len(message) == 2 and message[0] == "execution_error":
+            return message[1].get("exception_message") or "Execution failed"
+        if len(message) == 2 and message[0] == "execution_interrupted":
+            return "Execution interrupted"
+    return "Execution failed"
+
+class ComfyEventListener:
+    def __init__(self, client):
+        self.client = client
+        self.client_id = uuid.uuid4().hex
+        self.connected = False
+        self.connected_at = 0.0
+        self._down = None
+        self._task = None
+        self._trackers = OrderedDict()
+
+    @property
+    def ws_url(self) -> str:
+        return f"{self.client.url}/ws"
+
+    def start(self):
+        if self.client.closed:
+            return
+        if self._task is None or self._task.done():
+            self._down = asyncio.Event()
+            self._down.set()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+        self._task = None
+        self.connected = False
+
+    async def wait_disconnected(self):
+        await self._down.wait()
+
+    def track(self, prompt_id: str, on_progress=None) -> PromptTracker:
+        tracker = self._trackers.get(prompt_id)
+        if tracker is None:
+            tracker = PromptTracker()
+            self._trackers[prompt_id] = tracker
+            while len(self._trackers) > MAX_TRACKED_PROMPTS:
+                self._trackers.popitem(last=False)
+        if on_progress is not None:
+            tracker.on_progress = on_progress
+        return tracker
+
+    def fail_all(self, error: str):
+        for tracker in self._trackers.values():
+            tracker.finish(error=error)
+
+    def forget(self, prompt_id: str):
+        self._trackers.pop(prompt_id, None)
+
+    async def _run(self):
+        backoff = 1.0
+        while True:
+            try:
+                async with self.client.session.ws_connect(
+                    self.ws_url, params={"clientId": self.client_id}, heartbeat=30, timeout=aiohttp.ClientWSTimeout(ws_close=10)
+                ) as ws:
+                    if self.connected_at:
+                        # A dropped socket may mean ComfyUI restarted, or only the network blinked.
+                        try:
+                            await self.client.check_restart()
+                        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                            print(f"[WS] {self.client.url}: restart check failed: {e}")
+                    self.connected = True
+                    self.connected_at = time.time()
+                    self._down.clear()
+                    backoff = 1.0
+                    async for msg in ws:
+                        if msg.type == aiohttp.WSMsgType.TEXT:
+                            self._dispatch(msg.json())
+                        elif msg.type == aiohttp.WSMsgType.ERROR:
+                            break
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[WS] {self.client.url}: {e}")
+            finally:
+                self.connected = False
+                self._down.set()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, WS_RECONNECT_MAX)
+
+    def _dispatch(self, message: dict):
+        data = message.get("data") or {}
+        prompt_id = data.get("prompt_id")
+        if not prompt_id:
+            return
+        kind = message.get("type")
+        tracker = self.track(prompt_id)
+
+        if kind == "progress":
+            if tracker.on_progress:
+                try: tracker.on_progress(data.get("value", 0), data.get("max", 0))
+                except Exception as e: print(f"[WS] Progress callback error: {e}")
+        elif kind == "executed":
+            if data.get("node") is not None:
+                tracker.outputs[data["node"]] = data.get("output") or {}
+        elif kind == "executing":
+            if data.get("node") is None:
+                tracker.finish()
+        elif kind == "execution_success":
+            tracker.finish()
+        elif kind in ("execution_error", "execution_interrupted"):
+            tracker.finish(error=data.get("exception_message", "Execution interrupted"))
@@ -1,10 +1,11 @@
 import os
+import random
 import asyncio
-import aiohttp
-import base64
 from dataclasses import dataclass, field
 from typing import Optional, List, Dict
 import time
+from modules.ai.comfy_client import ComfyClient
+from modules.utils.metrics import metrics
 
 VRAM_REQUIREMENTS = {
     "flux": 4.0,
@@ -13,7 +14,22 @@ VRAM_REQUIREMENTS = {
     "anima": 4.0
 }
 
+# Extra VRAM per additional image in one batched sampler pass.
+VRAM_PER_IMAGE = {
+    "flux": float(os.getenv("VRAM_PER_IMAGE_GB", "1.0")),
+    "flux_edit": float(os.getenv("VRAM_PER_IMAGE_GB", "1.0")),
+    "z-image": float(os.getenv("VRAM_PER_IMAGE_GB", "1.0"))
+}
+
 DEFAULT_VRAM_GB = 8.0
+GIB = 1024 ** 3
+
+HEALTH_INTERVAL = float(os.getenv("GPU_HEALTH_INTERVAL", "10"))
+FAILURE_THRESHOLD = int(os.getenv("GPU_FAILURE_THRESHOLD", "3"))
+BREAKER_COOLDOWN = float(os.getenv("GPU_BREAKER_COOLDOWN", "30"))
+BREAKER_COOLDOWN_MAX = 300.0
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
 
 @dataclass
 class GPUInstance:
@@ -24,10 +40,22 @@ class GPUInstance:
     active_jobs: int = 0
     is_healthy: bool = True
     last_check: float = 0.0
+    breaker: str = CLOSED
+    failures: int = 0
+    cooldown: float = BREAKER_COOLDOWN
+    opened_at: float = 0.0
+    reported_vram: float = 0.0
+    remote_queue: int = 0
+    client: ComfyClient = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.client = ComfyClient(self.url, self.api_key)
     
     @property
     def free_vram(self) -> float:
-        return self.total_vram - self.used_vram
+        # Reported usage only counts while we have work there; idle ComfyUI keeps models cached.
+        used = max(self.used_vram, self.reported_vram) if self.active_jobs else self.used_vram
+        return self.total_vram - used
     
     def can_accept(self, model_type: str) -> bool:
         if not self.is_healthy:
@@ -35,20 +63,72 @@ class GPUInstance:
         required = VRAM_REQUIREMENTS.get(model_type, 4.0)
         return self.free_vram >= required
     
-    def reserve(self, model_type: str):
-        required = VRAM_REQUIREMENTS.get(model_type, 4.0)
-        self.used_vram += required
+    def fits(self, model_type: str) -> bool:
+        """Whether the card could ever run this model, healthy and empty."""
+        return self.total_vram >= VRAM_REQUIREMENTS.get(model_type, 4.0)
+
+    def max_batch(self, model_type: str, cap: int) -> int:
+        per_image = VRAM_PER_IMAGE.get(model_type)
+        if not per_image:
+            return 1
+        spare = self.free_vram - VRAM_REQUIREMENTS.get(model_type, 4.0)
+        return max(1, min(cap, 1 + int(spare // per_image)))
+
+    def batch_vram(self, model_type: str, count: int = 1) -> float:
+        return VRAM_REQUIREMENTS.get(model_type, 4.0) + VRAM_PER_IMAGE.get(model_type, 0.0) * (count - 1)
+    
+    def reserve(self, model_type: str, count: int = 1):
+        self.used_vram += self.batch_vram(model_type, count)
         self.active_jobs += 1
     
-    def release(self, model_type: str):
-        required = VRAM_REQUIREMENTS.get(model_type, 4.0)
-        self.used_vram = max(0, self.used_vram - required)
+    def release(self, model_type: str, count: int = 1):
+        self.used_vram = max(0, self.used_vram - self.batch_vram(model_type, count))
         self.active_jobs = max(0, self.active_jobs - 1)
 
+    def record_success(self) -> bool:
+        recovered = self.breaker != CLOSED
+        self.breaker = CLOSED
+        self.failures = 0
+        self.cooldown = BREAKER_COOLDOWN
+        self.is_healthy = True
+        return recovered
+
+    def record_failure(self) -> bool:
+        self.failures += 1
+        tripped = False
+        if self.breaker == HALF_OPEN:
+            self.cooldown = min(self.cooldown * 2, BREAKER_COOLDOWN_MAX)
+            tripped = True
+        elif self.breaker == CLOSED and self.failures >= FAILURE_THRESHOLD:
+            tripped = True
+        if tripped:
+            self.breaker = OPEN
+            self.opened_at = time.time()
+            self.is_healthy = False
+        return tripped
+
+    def apply_stats(self, system_stats: dict, queue: dict):
+        devices = system_stats.get("devices") or []
+        if devices:
+            device = devices[0]
+            vram_total = device.get("vram_total", 0)
+            if vram_total:
+                self.total_vram = vram_total / GIB
+                # vram_free already counts torch's cached-but-free memory (torch_vram_free is part of it).
+                in_use = vram_total - device.get("vram_free", 0)
+                self.reported_vram = max(0.0, in_use / GIB)
+        self.remote_queue = len(queue.get("queue_running", [])) + len(queue.get("queue_pending", []))
+        if not self.remote_queue and not self.active_jobs:
+            # Nothing runs on either side: drop any drift left by the static VRAM guesses.
+            self.used_vram = 0.0
+
 class GPUPool:
     def __init__(self):
         self.gpus: List[GPUInstance] = []
         self.lock = asyncio.Lock()
+        self.changed = asyncio.Condition(self.lock)
+        self.listeners = []
+        self._probes = []
         self._initialize()
     
     def _initialize(self):
@@ -67,46 +147,93 @@ class GPUPool:
             vram = float(os.getenv("GPU_VRAM_GB", str(DEFAULT_VRAM_GB)))
             self.gpus.append(GPUInstance(url=single_url, api_key=api_key, total_vram=vram))
     
+    def _best_gpu(self, model_type: str) -> Optional[GPUInstance]:
+        available = [gpu for gpu in self.gpus if gpu.can_accept(model_type)]
+        if not available:
+            return None
+        return max(available, key=lambda g: g.free_vram)
+
     async def get_best_gpu(self, model_type: str) -> Optional[GPUInstance]:
         async with self.lock:
-            available = [gpu for gpu in self.gpus if gpu.can_accept(model_type)]
-            if not available:
-                return None
-            return max(available, key=lambda g: g.free_vram)
+            return self._best_gpu(model_type)
     
-    async def reserve_gpu(self, gpu: GPUInstance, model_type: str):
+    async def reserve_gpu(self, gpu: GPUInstance, model_type: str, count: int = 1):
         async with self.lock:
-            gpu.reserve(model_type)
+            gpu.reserve(model_type, count)
     
-    async def release_gpu(self, gpu: GPUInstance, model_type: str):
+    async def release_gpu(self, gpu: GPUInstance, model_type: str, count: int = 1):
         async with self.lock:
-            gpu.release(model_type)
+            gpu.release(model_type, count)
+        await self.notify(gpu)
+
+    def subscribe(self, callback):
+        self.listeners.append(callback)
+
+    async def notify(self, gpu: GPUInstance):
+        # Called whenever a GPU may accept more work (released capacity, recovered health).
+        async with self.lock:
+            self.changed.notify_all()
+        for callback in self.listeners:
+            callback(gpu)
     
     async def health_check(self, gpu: GPUInstance) -> bool:
+        was_accepting, free_before = gpu.is_healthy, gpu.free_vram
         try:
-            headers = {"ngrok-skip-browser-warning": "69420"}
-            if gpu.api_key:
-                if ":" in gpu.api_key:
-                    encoded = base64.b64encode(gpu.api_key.encode()).decode()
-                    headers["Authorization"] = f"Basic {encoded}"
-                else:
-                    headers["Authorization"] = f"Bearer {gpu.api_key}"
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.get(f"{gpu.url}/system_stats", headers=headers, timeout=aiohttp.ClientTimeout(total=5)) as response:
-                    gpu.is_healthy = response.status == 200
-        except:
-            gpu.is_healthy = False
+            stats = await gpu.client.get_json("/system_stats", timeout=5)
+            queue = await gpu.client.get_json("/queue", timeout=5)
+            gpu.apply_stats(stats, queue)
+            # Only a restart invalidates uploads; a probe lost to a network blip doesn't.
+            await gpu.client.check_restart(stats)
+            gpu.record_success()
+        except Exception as e:
+            if gpu.record_failure():
+                print(f"[GPU] Circuit open for {gpu.url} ({gpu.failures} failures): {e}")
+                gpu.client.events.fail_all("GPU unavailable")
         gpu.last_check = time.time()
+        if gpu.is_healthy and not was_accepting:
+            print(f"[GPU] {gpu.url} recovered")
+            await self.notify(gpu)
+        elif gpu.is_healthy and gpu.free_vram > free_before:
+            await self.notify(gpu)
         return gpu.is_healthy
-    
+
+    async def _probe_loop(self, gpu: GPUInstance):
+        while True:
+            if gpu.breaker == OPEN:
+                await asyncio.sleep(max(0, gpu.opened_at + gpu.cooldown - time.time()))
+                gpu.breaker = HALF_OPEN
+            else:
+                await asyncio.sleep(HEALTH_INTERVAL * random.uniform(0.8, 1.2))
+            await self.health_check(gpu)
+
+    def start_health_checks(self):
+        if not self._probes:
+            self._probes = [asyncio.create_task(self._probe_loop(gpu)) for gpu in self.gpus]
+
     async def wait_for_available_gpu(self, model_type: str, timeout: float = 300.0) -> Optional[GPUInstance]:
-        start = time.time()
-        while time.time() - start < timeout:
-            gpu = await self.get_best_gpu(model_type)
-            if gpu:
-                return gpu
-            await asyncio.sleep(1.0)
-        return None
+        async with self.lock:
+            try:
+                await asyncio.wait_for(self.changed.wait_for(lambda: self._best_gpu(model_type) is not None), timeout=timeout)
+            except asyncio.TimeoutError:
+                return None
+            return self._best_gpu(model_type)
+
+    async def close(self):
+        for task in self._probes:
+            task.cancel()
+        self._probes = []
+        for gpu in self.gpus:
+            await gpu.client.close()
 
 gpu_pool = GPUPool()
+
+@metrics.collector
+def gpu_gauges():
+    for gpu in gpu_pool.gpus:
+        labels = {"gpu": gpu.url}
+        yield "gpu_vram_total_gib", labels, gpu.total_vram
+        yield "gpu_vram_reserved_gib", labels, gpu.used_vram
+        yield "gpu_vram_reported_gib", labels, gpu.reported_vram
+        yield "gpu_active_batches", labels, gpu.active_jobs
+        yield "gpu_remote_queue", labels, gpu.remote_queue
+        yield "gpu_healthy", labels, int(gpu.is_healthy)
@@ -6,8 +6,8 @@ async def process_image_gen(prompt, input_image_bytes=None, input_filename=None,
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
-async def process_image_batch(jobs):
+async def process_image_batch(jobs, gpu, on_result=None):
     try:
-        return await gen_logic_batch(jobs)
+        return await gen_logic_batch(jobs, gpu, on_result)
     except Exception as e:
         return [{"status": "error", "message": str(e)} for _ in jobs]
@@ -0,0 +1,114 @@
+import os
+import json
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+WORKFLOW_DIR = os.path.join(ROOT_DIR, "flujos")
+
+class WorkflowTemplate:
+    def __init__(self, filename: str, bindings: dict, output_node: str):
+        self.filename = filename
+        self.path = os.path.join(WORKFLOW_DIR, filename)
+        self.bindings = bindings
+        self.output_node = output_node
+        self.problems = []
+        self._nodes = None
+        self._mtime = None
+
+    @property
+    def name(self) -> str:
+        return os.path.splitext(self.filename)[0]
+
+    def load(self) -> dict:
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"Workflow file not found at {self.path}")
+        mtime = os.path.getmtime(self.path)
+        if self._nodes is None or mtime != self._mtime:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                nodes = json.load(f)
+            self.problems = self.validate(nodes)
+            self._nodes, self._mtime = nodes, mtime
+            for problem in self.problems:
+                print(f"[WORKFLOW] {self.filename}: {problem}")
+        return self._nodes
+
+    def validate(self, nodes: dict) -> list:
+        problems = []
+        if self.output_node not in nodes:
+            problems.append(f"output node '{self.output_node}' not found")
+        for slot, targets in self.bindings.items():
+            for node_id, input_name in targets:
+                if node_id not in nodes:
+                    problems.append(f"slot '{slot}': node '{node_id}' not found")
+                elif input_name not in nodes[node_id].get("inputs", {}):
+                    problems.append(f"slot '{slot}': node '{node_id}' has no input '{input_name}'")
+        return problems
+
+    def default(self, slot: str):
+        node_id, input_name = self.bindings[slot][0]
+        return self.load()[node_id]["inputs"][input_name]
+
+    def render(self, **values) -> dict:
+        nodes = self.load()
+        if self.problems:
+            raise ValueError(f"Workflow {self.filename} is invalid: {'; '.join(self.problems)}")
+        # Only nodes we write to are copied; the rest are shared with the cached template.
+        payload = dict(nodes)
+        copied = {}
+        for slot, value in values.items():
+            for node_id, input_name in self.bindings[slot]:
+                node = copied.get(node_id)
+                if node is None:
+                    source = nodes[node_id]
+                    node = copied[node_id] = payload[node_id] = {**source, "inputs": dict(source["inputs"])}
+                node["inputs"][input_name] = value
+        return payload
+
+TEMPLATES = {
+    "flux_image": WorkflowTemplate("flux_image.json", {
+        "batch_size": [("75:74", "batch_size"), ("75:67", "batch_size"), ("75:66", "batch_size")],
+        "prompts": [("75:74", "texts")],
+        "negatives": [("75:67", "texts")],
+        "seed": [("75:73", "noise_seed")],
+        "width": [("75:66", "width"), ("75:62", "width")],
+        "height": [("75:66", "height"), ("75:62", "height")],
+    }, output_node="9"),
+    "anima": WorkflowTemplate("anima.json", {
+        "prompt": [("4", "text")],
+        "seed": [("3", "seed")],
+        "lora_name": [("101", "lora_name")],
+        "sampler_model": [("3", "model")],
+        "width": [("7", "width")],
+        "height": [("7", "height")],
+    }, output_node="10"),
+    "flux_edit": WorkflowTemplate("flux_edit.json", {
+        "image": [("103", "image")],
+        "prompt": [("75:74", "text")],
+        "negative": [("75:67", "text")],
+        "seed": [("75:73", "noise_seed")],
+    }, output_node="9"),
+    "flux_edit_batch": WorkflowTemplate("flux_edit_batch.json", {
+        "images": [("103", "images")],
+        "batch_size": [("75:74", "batch_size"), ("75:67", "batch_size"), ("75:66", "batch_size")],
+        "prompts": [("75:74", "texts")],
+        "negatives": [("75:67", "texts")],
+        "seed": [("75:73", "noise_seed")],
+    }, output_node="9"),
+}
+
+# Anima without a LoRA feeds the sampler straight from the UNet loader.
+ANIMA_BASE_MODEL = ["2", 0]
+
+def get_template(name: str) -> WorkflowTemplate:
+    return TEMPLATES[name]
+
+def validate_all() -> bool:
+    ok = True
+    for name, template in TEMPLATES.items():
+        try:
+            template.load()
+        except (OSError, ValueError) as e:
+            print(f"[WORKFLOW] {name}: {e}")
+            ok = False
+            continue
+        ok = ok and not template.problems
+    return ok
@@ -1,9 +1,16 @@
 import discord
 from discord.ext import commands
 from modules.queue_manager.manager import queue_manager
+from modules.ai.gpu_pool import gpu_pool
+from modules.ai.workflows import validate_all as validate_workflows
 from modules.ai.image_gen import process_image_gen
-from modules.utils.db_manager import get_db_session, save_db_session, get_next_image_index
-import io
+from modules.ai.comfy_api import result_key
+from modules.utils.result_cache import result_cache
+from modules.utils.image_pipeline import image_pipeline
+from modules.utils.db_manager import get_last_image, get_next_image_index, close_db
+from modules.utils.session_cache import session_cache
+from modules.discord.delivery import outbox
+from modules.utils.metrics import metrics
 import os
 import time
 
@@ -17,12 +24,23 @@ class ImageBot(commands.Bot):
     async def setup_hook(self):
         for ext in ["modules.discord.cogs.admin", "modules.discord.cogs.image_commands", "modules.discord.cogs.sessions"]:
             await self.load_extension(ext)
-        
-        urls = os.getenv("COMFY_URLS", os.getenv("COMFY_URL", "")).split(",")
-        num_workers = len([u for u in urls if u.strip()])
-        if num_workers == 0: num_workers = 1
-            
-        self.loop.create_task(queue_manager.start_worker(self.process_queue_job, num_workers=num_workers))
+
+        if not validate_workflows():
+            print("[WORKFLOW] Some workflow templates are invalid; jobs using them will fail")
+        gpu_pool.start_health_checks()
+        await metrics.start_server()
+        self.loop.create_task(queue_manager.start_worker(self.process_queue_job, deliver_callback=self.deliver_result))
+
+    async def close(self):
+        # Workers first, then deliveries, and only then the ComfyUI clients they use.
+        await queue_manager.stop(timeout=30)
+        await outbox.drain(timeout=30)
+        await gpu_pool.close()
+        await metrics.stop_server()
+        await session_cache.flush()
+        await super().close()
+        image_pipeline.close()
+        close_db()
 
     async def on_ready(self):
         print(f"Bot: {self.user.name}")
@@ -41,50 +59,96 @@ class ImageBot(commands.Bot):
             return
         raise error
 
-    async def process_queue_job(self, jobs):
+    def progress_updater(self, job, min_interval=2.0):
+        last_edit = [0.0]
+        def update(value, total):
+            now = time.time()
+            if not total or (value < total and now - last_edit[0] < min_interval):
+                return
+            last_edit[0] = now
+            pct = int(100 * value / total)
+            outbox.status(job.context, job, f"Batch Processing: `{job.prompt}` ({pct}%)")
+        return update
+
+    async def process_queue_job(self, jobs, gpu):
         from modules.ai.image_gen import process_image_batch
         
         batch_info = []
         for job in jobs:
             channel = job.context
-            db_s = get_db_session(job.user_id)
-            img_bytes, img_name = job.input_image_bytes, job.input_filename
-            
-            if job.is_edit and not img_bytes and db_s and db_s.last_img_bytes:
-                img_bytes, img_name = db_s.last_img_bytes, db_s.last_img_name
+            if job.cancelled and not job.subscribers:
+                continue
+            if await self.serve_cached(job):
+                continue
+            if job.is_edit and not job.input_image_bytes:
+                db_s = await session_cache.get(job.user_id)
+                img_bytes = await get_last_image(db_s)
+                if img_bytes:
+                    job.input_image_bytes, job.input_filename = img_bytes, db_s.last_img_name
 
             job.start_time = time.time()
-            await channel.send(f"Batch Processing: `{job.prompt}`")
+            # Queued, not awaited: a slow or rate-limited channel must not hold the GPU.
+            outbox.status(channel, job, f"Batch Processing: `{job.prompt}`")
+            job.on_progress = self.progress_updater(job)
             batch_info.append(job)
 
-        results = await process_image_batch(batch_info)
-        
-        for i, result in enumerate(results):
-            job = batch_info[i]
-            channel = job.context
-            
-            if result["status"] == "success":
-                duration = round(time.time() - job.start_time, 1)
-                idx = get_next_image_index()
-                name = f"{idx:02d}.jpg"
-                
-                export_path = os.getenv("EXPORT_PATH")
-                if export_path:
-                    if not os.path.exists(export_path):
-                        try: os.makedirs(export_path)
-                        except: pass
-                    
-                    if os.path.exists(export_path):
-                        try:
-                            with open(os.path.join(export_path, name), "wb") as f:
-                                f.write(result["image_bytes"])
-                        except: pass
-
-                save_db_session(job.user_id, channel.id, result["image_bytes"], name)
-                file = discord.File(io.BytesIO(result["image_bytes"]), filename=name)
-                await channel.send(content=f"Done in {duration}s! <@{job.user_id}>\nPrompt: `{job.prompt}`", file=file)
-            else:
-                await channel.send(f"Error for `{job.prompt}`: {result.get('message', 'Failed')}")
+        if not batch_info:
+            return
+
+        delivered = set()
+        async def on_result(job, result):
+            delivered.add(id(job))
+            key = result_key(job)
+            if key is not None and result["status"] == "success":
+                await result_cache.put(key, result["image_bytes"])
+            await self.finish_job(job, result)
+
+        results = await process_image_batch(batch_info, gpu, on_result=on_result)
+        for job, result in zip(batch_info, results):
+            if id(job) not in delivered:
+                await self.finish_job(job, result)
+
+    async def finish_job(self, job, result):
+        # Resolving the job hands the same result to everyone who coalesced onto it.
+        outbox.status(job.context, job, None)
+        if not job.cancelled:
+            outbox.run(self.deliver_result(job, result))
+        job.resolve(result)
+
+    async def serve_cached(self, job) -> bool:
+        # Seeded requests are reproducible; a hit is delivered without going near a GPU.
+        key = result_key(job)
+        if key is None:
+            return False
+        img_bytes = await result_cache.get(key)
+        if img_bytes is None:
+            return False
+        stats = result_cache.stats()
+        print(f"[CACHE] Hit for `{job.prompt}` (hit rate {stats['hit_rate']:.0%}, {stats['bytes_saved'] / 1e6:.1f} MB saved)")
+        job.start_time = time.time()
+        await self.finish_job(job, {"status": "success", "image_bytes": img_bytes, "user_id": job.user_id})
+        return True
+
+    async def deliver_result(self, job, result):
+        channel = job.context
+        if result["status"] == "success":
+            duration = round(time.time() - job.start_time, 1)
+            idx = await get_next_image_index()
+            try:
+                processed = await image_pipeline.process(result["image_bytes"], f"{idx:02d}", os.getenv("EXPORT_PATH"))
+            except Exception as e:
+                print(f"Image pipeline error: {e}")
+                processed = {"image_bytes": result["image_bytes"], "filename": f"{idx:02d}.png"}
+            name = processed["filename"]
+
+            await session_cache.save(job.user_id, channel.id, result["image_bytes"], name)
+            sent = outbox.send(channel, f"Done in {duration}s! <@{job.user_id}>\nPrompt: `{job.prompt}`", processed["image_bytes"], name)
+            model, queued_at = job.model_type, job.timestamp
+            sent.add_done_callback(lambda f: metrics.observe("job_seconds", time.time() - queued_at, model=model))
+        else:
+            # Failures from the queue manager don't pass through finish_job, which clears the line.
+            outbox.status(channel, job, None)
+            outbox.send(channel, f"Error for `{job.prompt}`: {result.get('message', 'Failed')}")
 
 bot = ImageBot()
 
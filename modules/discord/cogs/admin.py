@@ -1,5 +1,6 @@
 import discord
 from discord.ext import commands
+from modules.utils.metrics import metrics
 import os
 
 class AdminTools(commands.Cog):
@@ -42,6 +43,36 @@ class AdminTools(commands.Cog):
         if ctx.channel.name != "admin-tools": return
         await ctx.send(f"ID: `{ctx.guild.id}`")
 
+    @commands.command(name="stats", hidden=True)
+    @commands.has_permissions(administrator=True)
+    async def stats(self, ctx):
+        if ctx.channel.name != "admin-tools": return
+        lines = [f"{'stage':<15}{'n':>6}{'p50':>8}{'p95':>8}{'mean':>8}"]
+        for stage, count, p50, p95, mean in metrics.summary("stage_seconds", by="stage"):
+            lines.append(f"{stage:<15}{count:>6}{p50:>7g}s{p95:>7g}s{mean:>7.2f}s")
+        for model, count, p50, p95, mean in metrics.summary("job_seconds", by="model"):
+            lines.append(f"{'total ' + model:<15}{count:>6}{p50:>7g}s{p95:>7g}s{mean:>7.2f}s")
+        for model, count, _, _, mean in metrics.summary("batch_size", by="model"):
+            lines.append(f"batch size {model}: mean {mean:.1f} over {count} batches")
+
+        gauges = metrics.gauges()
+        def value(name, default=0):
+            samples = gauges.get(name)
+            return samples[0][1] if samples else default
+        depth = ", ".join(f"{dict(key)['model']} {v}" for key, v in gauges.get("queue_depth", [])) or "empty"
+        lines.append(f"queue: {depth} | idle workers {value('idle_workers')} | in flight {value('inflight_requests')}")
+        users = sum(v for _, v in gauges.get("user_jobs", []))
+        lines.append(f"user jobs: {users} across {len({dict(k)['user'] for k, _ in gauges.get('user_jobs', [])})} users")
+        reserved = dict(gauges.get("gpu_vram_reserved_gib", []))
+        healthy = dict(gauges.get("gpu_healthy", []))
+        for key, total in gauges.get("gpu_vram_total_gib", []):
+            state = "up" if healthy.get(key) else "down"
+            lines.append(f"{dict(key)['gpu']}: {reserved.get(key, 0):.1f}/{total:.1f} GiB reserved, {state}")
+        lines.append(f"result cache hit {value('result_cache_hit_rate'):.0%} | session cache hit {value('session_cache_hit_rate'):.0%}")
+        lines.append(f"delivery: sent {value('delivery_sent')}, retried {value('delivery_retried')}, "
+                     f"failed {value('delivery_failed')}, queued {value('delivery_queued')}")
+        await ctx.send("```\n" + "\n".join(lines)[:1900] + "\n```")
+
 
 async def setup(bot):
     await bot.add_cog(AdminTools(bot))
@@ -1,8 +1,8 @@
 import discord
 from discord import app_commands
 from discord.ext import commands
-from modules.queue_manager.manager import queue_manager
-from modules.utils.db_manager import get_db_session, save_db_session
+from modules.queue_manager.manager import queue_manager, Job
+from modules.utils.session_cache import session_cache
 
 PROMPTS = ["hyperrealistic, 8k", "cyberpunk city", "fantasy landscape", "portrait", "3d render"]
 PROMPTS_EDIT = ["Exactly the same image, don't change anything, but in a realistic style", "change the background", "change the lighting", "change the composition", "change the style", "change the colors"]
@@ -17,18 +17,23 @@ class ImageCommands(commands.Cog):
         app_commands.Choice(name="Z-Image (Turbo)", value="z-image"),
         app_commands.Choice(name="Anima", value="anima")
     ])
-    async def imagine(self, interaction: discord.Interaction, model: str, prompt: str, lora: str = None):
+    @app_commands.describe(seed="Fixed seed: same prompt and seed give the same image, served from cache when possible")
+    async def imagine(self, interaction: discord.Interaction, model: str, prompt: str, lora: str = None, seed: app_commands.Range[int, 1, 10**15] = None):
         await interaction.response.defer(ephemeral=True)
         sessions = self.bot.get_cog("SessionManager")
         channel = await sessions.get_or_create(interaction)
-        save_db_session(interaction.user.id, channel.id, img_bytes=None, img_name=None)
+        await session_cache.save(interaction.user.id, channel.id, img_bytes=None, img_name=None)
+        if seed is not None:
+            job = Job(0, prompt, channel, interaction.user.id, model_type=model, lora_name=lora, seed=seed)
+            if await self.bot.serve_cached(job):
+                return await interaction.followup.send(f"Served from cache in: {channel.mention}", ephemeral=True)
         q_pos = await queue_manager.add_job(
             priority=(0 if interaction.user.guild_permissions.administrator else 1),
             prompt=prompt, context=channel, user_id=interaction.user.id,
-            is_edit=False, model_type=model, lora_name=lora
+            is_edit=False, model_type=model, lora_name=lora, seed=seed
         )
         if q_pos == -1:
-            return await interaction.followup.send("Limit reached (max 2 jobs).", ephemeral=True)
+            return await interaction.followup.send(f"Limit reached (max {queue_manager.max_jobs_per_user} jobs).", ephemeral=True)
         await interaction.followup.send(f"Queued (Pos: {q_pos}) in: {channel.mention}", ephemeral=True)
 
     @imagine.autocomplete("prompt")
@@ -53,8 +58,8 @@ class ImageCommands(commands.Cog):
             else:
                 return await interaction.followup.send("Invalid format.", ephemeral=True)
 
-        db_s = get_db_session(interaction.user.id)
-        if not img_bytes and (not db_s or not db_s.last_img_bytes):
+        db_s = await session_cache.get(interaction.user.id)
+        if not img_bytes and (not db_s or not db_s.last_img_hash):
             return await interaction.followup.send("No image found.", ephemeral=True)
 
         sessions = self.bot.get_cog("SessionManager")
@@ -66,12 +71,19 @@ class ImageCommands(commands.Cog):
             model_type=model
         )
         if q_pos == -1:
-            return await interaction.followup.send("Limit reached (max 2 jobs).", ephemeral=True)
+            return await interaction.followup.send(f"Limit reached (max {queue_manager.max_jobs_per_user} jobs).", ephemeral=True)
         await interaction.followup.send(f"Queued (Pos: {q_pos}) in: {channel.mention}", ephemeral=True)
 
     @edit.autocomplete("new_prompt")
     async def edit_auto(self, interaction: discord.Interaction, current: str):
         return [app_commands.Choice(name=c, value=c) for c in PROMPTS_EDIT if current.lower() in c.lower()][:25]
 
+    @app_commands.command(name="cancel", description="Cancel your queued jobs")
+    async def cancel(self, interaction: discord.Interaction):
+        cancelled = queue_manager.cancel_user(interaction.user.id)
+        if not cancelled:
+            return await interaction.response.send_message("Nothing queued to cancel.", ephemeral=True)
+        await interaction.response.send_message(f"Cancelled {cancelled} job(s).", ephemeral=True)
+
 async def setup(bot):
     await bot.add_cog(ImageCommands(bot))
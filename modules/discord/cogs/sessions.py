@@ -1,54 +1,81 @@
 import discord
 from discord.ext import commands
-from modules.utils.db_manager import get_db_session, save_db_session, delete_db_session
+from modules.utils.db_manager import get_session_times, subscribe_sessions, unsubscribe_sessions
+from modules.utils.session_cache import session_cache
+from modules.discord.session_reaper import SessionReaper, SESSION_TTL
 import time
-import asyncio
+
+USER_OVERWRITE = dict(
+    view_channel=True, send_messages=True, use_application_commands=True,
+    read_message_history=True, embed_links=True, attach_files=True
+)
 
 class SessionManager(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.reaper = SessionReaper(self.reap)
+        self._starter = None
+
+    async def cog_load(self):
+        # The listener list is module-global: tie the subscription to the cog's lifetime, not the object's.
+        subscribe_sessions(self.reaper.touch)
+        self._starter = self.bot.loop.create_task(self.start_reaper())
+
+    async def cog_unload(self):
+        unsubscribe_sessions(self.reaper.touch)
+        if self._starter is not None:
+            self._starter.cancel()
+            self._starter = None
+        self.reaper.stop()
 
-    async def auto_delete_loop(self, channel, user_id):
-        while True:
-            await asyncio.sleep(60)
-            db_s = get_db_session(user_id)
-            if not db_s: break
-            if (time.time() - db_s.updated_at) >= 1800:
-                try:
-                    delete_db_session(channel.id)
-                    await channel.delete()
-                except: pass
-                break
+    async def start_reaper(self):
+        # Rebuilt from the table, so channels left behind by a restart still expire.
+        await self.bot.wait_until_ready()
+        self.reaper.load(await get_session_times())
+        print(f"[REAPER] Tracking {len(self.reaper)} sessions")
+        self.reaper.start()
+
+    async def reap(self, channel_ids):
+        now = time.time()
+        current = dict(await get_session_times(channel_ids=channel_ids))
+        for channel_id in channel_ids:
+            updated_at = current.get(channel_id)
+            if updated_at is None:
+                continue
+            if now - updated_at < SESSION_TTL:
+                # Touched by another process, or a save that didn't reach the reaper.
+                self.reaper.touch(channel_id, updated_at)
+                continue
+            await session_cache.delete(channel_id)
+            channel = self.bot.get_channel(channel_id)
+            if channel:
+                try: await channel.delete()
+                except discord.HTTPException: pass
 
     async def get_or_create(self, interaction: discord.Interaction):
         user_id = str(interaction.user.id)
-        db_s = get_db_session(user_id)
+        db_s = await session_cache.get(user_id)
         now = time.time()
 
-        if db_s and db_s.updated_at and (now - db_s.updated_at) < 1800:
+        if db_s and db_s.updated_at and (now - db_s.updated_at) < SESSION_TTL:
             channel = interaction.guild.get_channel(db_s.channel_id)
             if channel:
-                try:
-                    await channel.set_permissions(interaction.user,
-                        view_channel=True,
-                        send_messages=True,
-                        use_application_commands=True,
-                        read_message_history=True,
-                        embed_links=True,
-                        attach_files=True
-                    )
-                except: pass
+                overwrite = discord.PermissionOverwrite(**USER_OVERWRITE)
+                # Most interactions reuse a channel whose overwrite is already in place.
+                if channel.overwrites_for(interaction.user) != overwrite:
+                    try: await channel.set_permissions(interaction.user, overwrite=overwrite)
+                    except discord.HTTPException: pass
                 return channel
-            delete_db_session(db_s.channel_id)
+            await session_cache.delete(db_s.channel_id)
         elif db_s:
-            delete_db_session(db_s.channel_id)
+            await session_cache.delete(db_s.channel_id)
 
         category = discord.utils.get(interaction.guild.categories, name="sessions")
         
         ch_name = f"session-{interaction.user.name.lower()}"
         existing_ch = discord.utils.get(interaction.guild.text_channels, name=ch_name)
         if existing_ch:
-            save_db_session(user_id, existing_ch.id)
+            await session_cache.save(user_id, existing_ch.id)
             return existing_ch
 
         if not category:
@@ -60,10 +87,7 @@ class SessionManager(commands.Cog):
 
         overwrites = {
             interaction.guild.default_role: discord.PermissionOverwrite(view_channel=False),
-            interaction.user: discord.PermissionOverwrite(
-                view_channel=True, send_messages=True, use_application_commands=True,
-                read_message_history=True, embed_links=True, attach_files=True
-            ),
+            interaction.user: discord.PermissionOverwrite(**USER_OVERWRITE),
             interaction.guild.me: discord.PermissionOverwrite(
                 view_channel=True, send_messages=True, attach_files=True,
                 embed_links=True, read_message_history=True, manage_channels=True
@@ -73,8 +97,7 @@ class SessionManager(commands.Cog):
             name=ch_name,
             overwrites=overwrites, category=category
         )
-        save_db_session(user_id, channel.id)
-        self.bot.loop.create_task(self.auto_delete_loop(channel, user_id))
+        await session_cache.save(user_id, channel.id)
         return channel
 
 async def setup(bot):
@@ -0,0 +1,188 @@
+import os
+import io
+import time
+import asyncio
+import aiohttp
+import discord
+from collections import deque
+from modules.utils.metrics import metrics
+
+DELIVERY_CONCURRENCY = int(os.getenv("DELIVERY_CONCURRENCY", "8"))
+DELIVERY_RETRIES = int(os.getenv("DELIVERY_RETRIES", "4"))
+DELIVERY_BACKOFF = float(os.getenv("DELIVERY_BACKOFF", "1.0"))
+STATUS_INTERVAL = float(os.getenv("DELIVERY_STATUS_INTERVAL", "1.5"))
+
+class ChannelOutbox:
+    """Everything waiting to go out to one channel, drained by a single task.
+
+    Status lines from all jobs in the channel share one progress message. Only the latest text
+    is ever sent, so bursts of progress updates collapse into one edit.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.sends = deque()
+        self.lines = {}
+        self.dirty = False
+        self.message = None
+        self.last_edit = 0.0
+        self.task = None
+        self.wakeup = asyncio.Event()
+
+    def render(self):
+        return "\n".join(self.lines.values())[:2000]
+
+class Outbox:
+    """Sends Discord messages off the GPU workers: one queue per channel, concurrent across channels."""
+
+    def __init__(self, concurrency: int = DELIVERY_CONCURRENCY, retries: int = DELIVERY_RETRIES,
+                 backoff: float = DELIVERY_BACKOFF, status_interval: float = STATUS_INTERVAL):
+        self.slots = asyncio.Semaphore(max(1, concurrency))
+        self.retries = retries
+        self.backoff = backoff
+        self.status_interval = status_interval
+        self.channels = {}
+        self.tasks = set()
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    def _outbox(self, channel):
+        box = self.channels.get(channel.id)
+        if box is None:
+            box = self.channels[channel.id] = ChannelOutbox(channel)
+        box.channel = channel
+        return box
+
+    def _wake(self, box):
+        box.wakeup.set()
+        if box.task is None or box.task.done():
+            box.task = asyncio.create_task(self._drain(box))
+
+    def status(self, channel, key, text):
+        """Sets (or with None, clears) the line `key` in the channel's progress message."""
+        box = self._outbox(channel)
+        if text is None:
+            if box.lines.pop(key, None) is None:
+                return
+        elif box.lines.get(key) == text:
+            return
+        else:
+            box.lines[key] = text
+        box.dirty = True
+        self._wake(box)
+
+    def send(self, channel, content=None, file_bytes=None, filename=None) -> asyncio.Future:
+        box = self._outbox(channel)
+        future = asyncio.get_running_loop().create_future()
+        box.sends.append((content, file_bytes, filename, future))
+        self._wake(box)
+        return future
+
+    def run(self, coro):
+        # Fire-and-forget work (e.g. preparing a result) that must not hold up the caller.
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self._ran)
+        return task
+
+    def _ran(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[DELIVERY] {task.exception()}")
+
+    async def _call(self, make, stage="discord_send"):
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.slots:
+                    with metrics.timer("stage_seconds", stage=stage):
+                        return await make()
+            except discord.HTTPException as e:
+                # 4xx other than 429 won't get better by asking again.
+                if (e.status < 500 and e.status != 429) or attempt == self.retries:
+                    raise
+                delay = getattr(e, "retry_after", None) or self.backoff * 2 ** attempt
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError):
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+            self.retried += 1
+            await asyncio.sleep(delay)
+
+    async def _drain(self, box):
+        while box.sends or box.dirty:
+            if box.sends:
+                # Results go before progress edits; the latter are only cosmetic.
+                content, file_bytes, filename, future = box.sends.popleft()
+                def make():
+                    file = discord.File(io.BytesIO(file_bytes), filename=filename) if file_bytes is not None else None
+                    return box.channel.send(content=content, file=file)
+                try:
+                    message = await self._call(make, "discord_upload" if file_bytes is not None else "discord_send")
+                    self.sent += 1
+                    if not future.done():
+                        future.set_result(message)
+                except Exception as e:
+                    self.failed += 1
+                    print(f"[DELIVERY] Send to #{getattr(box.channel, 'name', box.channel.id)} failed: {e}")
+                    if not future.done():
+                        future.set_result(None)
+                continue
+
+            wait = box.last_edit + self.status_interval - time.time()
+            if wait > 0:
+                box.wakeup.clear()
+                try: await asyncio.wait_for(box.wakeup.wait(), wait)
+                except asyncio.TimeoutError: pass
+                continue
+            box.dirty = False
+            box.last_edit = time.time()
+            await self._update_status(box)
+
+        if not box.lines and box.message is None and self.channels.get(box.channel.id) is box:
+            del self.channels[box.channel.id]
+
+    async def _update_status(self, box):
+        text = box.render()
+        try:
+            if not text:
+                if box.message is not None:
+                    message, box.message = box.message, None
+                    await self._call(message.delete, "discord_status")
+            elif box.message is None:
+                box.message = await self._call(lambda: box.channel.send(text), "discord_status")
+            else:
+                await self._call(lambda: box.message.edit(content=text), "discord_status")
+        except discord.NotFound:
+            # Someone deleted the progress message; post a fresh one next time.
+            box.message = None
+            box.dirty = bool(box.lines)
+        except Exception as e:
+            print(f"[DELIVERY] Status update failed: {e}")
+
+    async def drain(self, timeout: float = None):
+        """Waits until every queued message and delivery task has finished."""
+        async def settle():
+            while self.tasks or any(b.task and not b.task.done() for b in self.channels.values()):
+                pending = list(self.tasks) + [b.task for b in self.channels.values() if b.task and not b.task.done()]
+                await asyncio.gather(*pending, return_exceptions=True)
+        try:
+            await asyncio.wait_for(settle(), timeout)
+        except asyncio.TimeoutError:
+            print("[DELIVERY] Gave up waiting for pending messages")
+
+    def stats(self) -> dict:
+        return {
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "queued": sum(len(b.sends) for b in self.channels.values()),
+            "channels": len(self.channels),
+        }
+
+outbox = Outbox()
+
+@metrics.collector
+def outbox_gauges():
+    for name, value in outbox.stats().items():
+        yield f"delivery_{name}", {}, value
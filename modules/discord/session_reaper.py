@@ -0,0 +1,95 @@
+import os
+import time
+import heapq
+import asyncio
+
+SESSION_TTL = float(os.getenv("SESSION_TTL", "1800"))
+REAP_BATCH = int(os.getenv("SESSION_REAP_BATCH", "5"))
+REAP_PAUSE = float(os.getenv("SESSION_REAP_PAUSE", "1.0"))
+
+class SessionReaper:
+    """One deadline heap for every session channel instead of a polling task per channel.
+
+    Touching a session only records its new deadline; the stale heap entry is skipped when it
+    surfaces. The loop sleeps until the earliest deadline, so idle wakeups don't grow with the
+    number of sessions.
+    """
+
+    def __init__(self, on_expire, ttl: float = SESSION_TTL, batch: int = REAP_BATCH, pause: float = REAP_PAUSE):
+        self.on_expire = on_expire
+        self.ttl = ttl
+        self.batch = max(1, batch)
+        self.pause = pause
+        self.heap = []
+        self.deadlines = {}
+        self.changed = asyncio.Event()
+        self.wakeups = 0
+        self._task = None
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def touch(self, channel_id, updated_at):
+        if updated_at is None:
+            self.deadlines.pop(channel_id, None)
+            return
+        deadline = updated_at + self.ttl
+        if self.deadlines.get(channel_id) == deadline:
+            return
+        earliest = self.heap[0][0] if self.heap else None
+        self.deadlines[channel_id] = deadline
+        heapq.heappush(self.heap, (deadline, channel_id))
+        if len(self.heap) > 2 * len(self.deadlines) + 64:
+            self.heap = [(d, c) for c, d in self.deadlines.items()]
+            heapq.heapify(self.heap)
+        # Pushing a deadline back never needs the loop; only an earlier head does.
+        if earliest is None or deadline < earliest:
+            self.changed.set()
+
+    def load(self, sessions):
+        for channel_id, updated_at in sessions:
+            self.touch(channel_id, updated_at)
+
+    def _drop_stale(self):
+        while self.heap and self.deadlines.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+
+    def due(self, now: float) -> list:
+        expired = []
+        while len(expired) < self.batch:
+            self._drop_stale()
+            if not self.heap or self.heap[0][0] > now:
+                break
+            _, channel_id = heapq.heappop(self.heap)
+            del self.deadlines[channel_id]
+            expired.append(channel_id)
+        return expired
+
+    async def run(self):
+        while True:
+            self._drop_stale()
+            self.changed.clear()
+            timeout = max(0.0, self.heap[0][0] - time.time()) if self.heap else None
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self.changed.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            self.wakeups += 1
+            expired = self.due(time.time())
+            if expired:
+                try:
+                    await self.on_expire(expired)
+                except Exception as e:
+                    print(f"[REAPER] {e}")
+                # Channel deletes share a rate-limit bucket; space the batches out.
+                await asyncio.sleep(self.pause)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
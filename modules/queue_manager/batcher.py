@@ -0,0 +1,146 @@
+import heapq
+import itertools
+from collections import deque
+
+# Models whose workflow encodes every prompt through one "CLIP Text Encode (Batch)" node.
+BATCHED_MODELS = {"flux", "z-image"}
+# Edits go through flux_edit_batch.json, which also stacks the input images.
+BATCHED_EDIT_MODELS = {"flux"}
+
+def batch_key(job):
+    seeded = getattr(job, 'seed', None) is not None
+    return (getattr(job, 'model_type', 'flux'), getattr(job, 'lora_name', None), bool(job.is_edit or job.input_image_bytes), seeded)
+
+def request_key(job):
+    """Identity of a request for coalescing; None for edits, whose input image is per user."""
+    if job.is_edit or job.input_image_bytes:
+        return None
+    prompt = " ".join((job.prompt or "").split())
+    return (prompt, getattr(job, 'model_type', 'flux'), getattr(job, 'lora_name', None), getattr(job, 'seed', None))
+
+def vram_profile(key) -> str:
+    model_type, _, is_edit, _ = key
+    return "flux_edit" if is_edit else model_type
+
+def is_batchable(key) -> bool:
+    # A seeded job must run alone: batch noise depends on the other items in the pass.
+    model_type, _, is_edit, seeded = key
+    if seeded:
+        return False
+    return model_type in (BATCHED_EDIT_MODELS if is_edit else BATCHED_MODELS)
+
+class SubQueue:
+    def __init__(self):
+        self.by_user = {}
+        self.heads = []
+        self.size = 0
+
+    def push(self, job, seq):
+        user = str(job.user_id)
+        jobs = self.by_user.get(user)
+        if jobs is None:
+            jobs = self.by_user[user] = deque()
+        jobs.append(job)
+        if len(jobs) == 1:
+            heapq.heappush(self.heads, (job.priority, job.timestamp, seq, user))
+        self.size += 1
+
+    def peek(self):
+        return self.heads[0][:2] if self.heads else None
+
+    def take(self, n, seq_counter):
+        # Round-robin: a user gets a second slot in the batch only once every other user got one.
+        taken, deferred = [], []
+        while len(taken) < n and (self.heads or deferred):
+            if not self.heads:
+                for user in deferred:
+                    self._push_head(user, next(seq_counter))
+                deferred = []
+            _, _, _, user = heapq.heappop(self.heads)
+            jobs = self.by_user[user]
+            taken.append(jobs.popleft())
+            if jobs:
+                deferred.append(user)
+            else:
+                del self.by_user[user]
+        for user in deferred:
+            self._push_head(user, next(seq_counter))
+        self.size -= len(taken)
+        return taken
+
+    def remove(self, job, seq) -> bool:
+        user = str(job.user_id)
+        jobs = self.by_user.get(user)
+        if not jobs or job not in jobs:
+            return False
+        was_head = jobs[0] is job
+        jobs.remove(job)
+        self.size -= 1
+        if was_head:
+            # The user's heap entry describes the removed job; replace it with the next one, if any.
+            self.heads = [head for head in self.heads if head[3] != user]
+            heapq.heapify(self.heads)
+            if jobs:
+                self._push_head(user, seq)
+        if not jobs:
+            del self.by_user[user]
+        return True
+
+    def _push_head(self, user, seq):
+        head = self.by_user[user][0]
+        heapq.heappush(self.heads, (head.priority, head.timestamp, seq, user))
+
+class BatchFormer:
+    def __init__(self):
+        self.queues = {}
+        self.size = 0
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return self.size
+
+    def push(self, job):
+        key = batch_key(job)
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = self.queues[key] = SubQueue()
+        queue.push(job, next(self._seq))
+        self.size += 1
+
+    def count(self, key) -> int:
+        queue = self.queues.get(key)
+        return queue.size if queue else 0
+
+    def best_key(self, accept=None):
+        best, best_head = None, None
+        for key, queue in self.queues.items():
+            if accept is not None and not accept(key):
+                continue
+            head = queue.peek()
+            if head is not None and (best_head is None or head < best_head):
+                best, best_head = key, head
+        return best
+
+    def batch_limit(self, key, max_batch: int) -> int:
+        return max(1, max_batch) if is_batchable(key) else 1
+
+    def remove(self, job) -> bool:
+        """Takes one job out of the queue, wherever it is; False if it isn't queued."""
+        key = batch_key(job)
+        queue = self.queues.get(key)
+        if queue is None or not queue.remove(job, next(self._seq)):
+            return False
+        self.size -= 1
+        if not queue.size:
+            del self.queues[key]
+        return True
+
+    def take(self, key, n: int):
+        queue = self.queues.get(key)
+        if not queue:
+            return []
+        jobs = queue.take(n, self._seq)
+        self.size -= len(jobs)
+        if not queue.size:
+            del self.queues[key]
+        return jobs
@@ -0,0 +1,82 @@
+import os
+import time
+from abc import ABC, abstractmethod
+
+DEFAULT_MAX_WAIT = 2.0
+EWMA_ALPHA = 0.2
+
+class BatchingPolicy(ABC):
+    name = "base"
+
+    def __init__(self, max_batch=None, max_wait=None):
+        self.max_batch = max(1, max_batch or int(os.getenv("MAX_BATCH_SIZE", "2")))
+        self.max_wait = max_wait if max_wait is not None else float(os.getenv("BATCH_MAX_WAIT", str(DEFAULT_MAX_WAIT)))
+
+    @abstractmethod
+    def window(self, available: int, limit: int, depth: int, idle_workers: int, busy: int = 0) -> float:
+        """Seconds (from the first job being seen) a worker may hold a batch open; `busy` counts batches running on its GPU."""
+
+    def record_arrival(self, now: float = None):
+        pass
+
+    def record_batch(self, size: int, duration: float):
+        pass
+
+class ImmediatePolicy(BatchingPolicy):
+    name = "immediate"
+
+    def window(self, available, limit, depth, idle_workers, busy=0):
+        return 0.0
+
+class FixedWindowPolicy(BatchingPolicy):
+    name = "fixed"
+
+    def window(self, available, limit, depth, idle_workers, busy=0):
+        return 0.0 if available >= limit else self.max_wait
+
+class AdaptivePolicy(BatchingPolicy):
+    name = "adaptive"
+
+    def __init__(self, max_batch=None, max_wait=None):
+        super().__init__(max_batch, max_wait)
+        self.arrival_interval = None
+        self.batch_time = None
+        self._last_arrival = None
+
+    @staticmethod
+    def _ewma(current, sample):
+        return sample if current is None else (1 - EWMA_ALPHA) * current + EWMA_ALPHA * sample
+
+    def record_arrival(self, now=None):
+        now = now if now is not None else time.time()
+        if self._last_arrival is not None:
+            self.arrival_interval = self._ewma(self.arrival_interval, now - self._last_arrival)
+        self._last_arrival = now
+
+    def record_batch(self, size, duration):
+        self.batch_time = self._ewma(self.batch_time, duration)
+
+    def window(self, available, limit, depth, idle_workers, busy=0):
+        if available >= limit or self.batch_time is None or not self.arrival_interval:
+            return 0.0
+        # Another GPU is idle, or jobs arrive slower than a batch takes: waiting only adds latency.
+        if idle_workers > 1:
+            return 0.0
+        if busy:
+            # ComfyUI runs one prompt at a time: a batch sent now would only queue behind the running one.
+            # The worker is woken when that batch releases the GPU, so this rarely runs to the end.
+            return min(self.max_wait, self.batch_time)
+        if depth < limit and self.arrival_interval >= self.batch_time:
+            return 0.0
+        fill_time = (limit - available) * self.arrival_interval
+        budget = min(self.max_wait, self.batch_time / 2)
+        return fill_time if fill_time <= budget else 0.0
+
+POLICIES = {p.name: p for p in (ImmediatePolicy, FixedWindowPolicy, AdaptivePolicy)}
+
+def create_policy(name=None, **kwargs) -> BatchingPolicy:
+    name = name or os.getenv("BATCH_POLICY", "adaptive")
+    if name not in POLICIES:
+        print(f"Unknown BATCH_POLICY '{name}', using adaptive")
+        name = "adaptive"
+    return POLICIES[name](**kwargs)
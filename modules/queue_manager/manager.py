@@ -1,9 +1,17 @@
 import asyncio
 import time
 import os
+from collections import defaultdict
+from modules.queue_manager.batcher import BatchFormer, batch_key, request_key, vram_profile
+from modules.queue_manager.batching import create_policy
+from modules.ai.gpu_pool import gpu_pool
+from modules.utils.metrics import metrics, BATCH_BUCKETS
+
+QUEUE_MAX_WAIT = float(os.getenv("QUEUE_MAX_WAIT", "120"))
+QUEUE_CHECK_INTERVAL = 5.0
 
 class Job:
-    def __init__(self, priority, prompt, context, user_id, is_edit=False, input_image_bytes=None, input_filename=None, model_type="flux", lora_name=None):
+    def __init__(self, priority, prompt, context, user_id, is_edit=False, input_image_bytes=None, input_filename=None, model_type="flux", lora_name=None, seed=None):
         self.priority = priority
         self.prompt = prompt
         self.context = context
@@ -13,69 +21,350 @@ class Job:
         self.input_filename = input_filename
         self.model_type = model_type
         self.lora_name = lora_name
+        self.seed = seed
         self.timestamp = time.time()
         self.start_time = 0
+        self.on_progress = None
+        self.future = None
+        self.request_key = None
+        self.primary = None
+        self.subscribers = []
+        self.follower = None
+        self.cancelled = False
+
+    def resolve(self, result):
+        if self.future is not None and not self.future.done():
+            self.future.set_result(result)
 
     def __lt__(self, other):
         if self.priority == other.priority:
             return self.timestamp < other.timestamp
         return self.priority < other.priority
 
+class GPUWorker:
+    def __init__(self, gpu):
+        self.gpu = gpu
+        self.wakeup = asyncio.Event()
+        self.waiting = False
+        self.window_key = None
+
+    async def wait(self, timeout=None):
+        # Callers check queue/GPU state synchronously right before this, so clearing loses no signal.
+        self.wakeup.clear()
+        self.waiting = True
+        try:
+            if timeout is None:
+                await self.wakeup.wait()
+            else:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting = False
+
 class QueueManager:
-    def __init__(self):
-        self.queue = asyncio.PriorityQueue()
+    def __init__(self, max_jobs_per_user=None, policy=None):
+        self.pending = BatchFormer()
+        self.policy = policy or create_policy()
+        self.pool = gpu_pool
+        self.workers = []
+        self._loops = []
+        self._batches = set()
+        self._tasks = set()
+        self.idle_workers = 0
         self.is_running = False
+        self.max_jobs_per_user = max_jobs_per_user or int(os.getenv("MAX_JOBS_PER_USER", "2"))
+        self.queued_by_user = defaultdict(int)
+        self.running_by_user = defaultdict(int)
+        self.inflight = {}
+        self.deliver_callback = None
+        self.max_queue_wait = QUEUE_MAX_WAIT
+        self.unplaceable_since = {}
 
-    async def add_job(self, priority, prompt, context, user_id, is_edit=False, input_image_bytes=None, input_filename=None, model_type="flux", lora_name=None):
+    def active_jobs(self, user_id):
         user_id_str = str(user_id)
-        active_count = 0
-        
-        tmp_queue = []
-        while not self.queue.empty():
-            item = await self.queue.get()
-            if str(item.user_id) == user_id_str:
-                active_count += 1
-            tmp_queue.append(item)
-            
-        for item in tmp_queue:
-            await self.queue.put(item)
-            
-        if active_count >= 2:
+        return self.queued_by_user.get(user_id_str, 0) + self.running_by_user.get(user_id_str, 0)
+
+    def _mark_running(self, job):
+        user_id_str = str(job.user_id)
+        self.queued_by_user[user_id_str] -= 1
+        if self.queued_by_user[user_id_str] <= 0:
+            del self.queued_by_user[user_id_str]
+        self.running_by_user[user_id_str] += 1
+
+    def _mark_done(self, job):
+        user_id_str = str(job.user_id)
+        self.running_by_user[user_id_str] -= 1
+        if self.running_by_user[user_id_str] <= 0:
+            del self.running_by_user[user_id_str]
+
+    def _release_queued(self, job):
+        user_id_str = str(job.user_id)
+        self.queued_by_user[user_id_str] -= 1
+        if self.queued_by_user[user_id_str] <= 0:
+            del self.queued_by_user[user_id_str]
+
+    async def add_job(self, priority, prompt, context, user_id, is_edit=False, input_image_bytes=None, input_filename=None, model_type="flux", lora_name=None, seed=None):
+        # No await before push: the check and the enqueue are atomic on the event loop.
+        if self.active_jobs(user_id) >= self.max_jobs_per_user:
             return -1
 
-        job = Job(priority, prompt, context, user_id, is_edit, input_image_bytes, input_filename, model_type, lora_name)
-        await self.queue.put(job)
-        return self.queue.qsize()
+        job = Job(priority, prompt, context, user_id, is_edit, input_image_bytes, input_filename, model_type, lora_name, seed)
+        job.future = asyncio.get_running_loop().create_future()
+        self.queued_by_user[str(user_id)] += 1
 
-    async def start_worker(self, processor_callback, num_workers=1):
-        self.is_running = True
-        workers = [self._worker_loop(processor_callback) for _ in range(num_workers)]
-        await asyncio.gather(*workers)
+        job.request_key = request_key(job)
+        primary = self.inflight.get(job.request_key) if job.request_key is not None else None
+        if primary is not None and self._can_join(job, primary):
+            self._subscribe(job, primary)
+            return len(self.pending) or 1
+        if job.request_key is not None:
+            self.inflight[job.request_key] = job
+
+        self.pending.push(job)
+        self.policy.record_arrival(job.timestamp)
+        self._wake_for(batch_key(job))
+        return len(self.pending)
+
+    @staticmethod
+    def _can_join(job, primary) -> bool:
+        # A user repeating their own prompt wants a new image, not the same one twice.
+        users = {str(primary.user_id)} | {str(sub.user_id) for sub in primary.subscribers}
+        return str(job.user_id) not in users and not primary.future.done()
+
+    def _subscribe(self, job, primary):
+        # The subscriber keeps its quota slot until the shared result reaches its channel.
+        job.primary = primary
+        job.start_time = time.time()
+        primary.subscribers.append(job)
+        job.follower = asyncio.create_task(self._follow(job))
+        self._tasks.add(job.follower)
+        job.follower.add_done_callback(lambda task: self._followed(job, task))
+
+    async def _follow(self, job):
+        result = await asyncio.shield(job.primary.future)
+        if self.deliver_callback is not None:
+            try:
+                await self.deliver_callback(job, result)
+            except Exception as e:
+                print(f"Delivery error: {e}")
+        job.resolve(result)
+
+    def _followed(self, job, task):
+        # A done callback rather than `finally`: a follower cancelled before it first ran never executes its body.
+        self._tasks.discard(task)
+        if task.cancelled():
+            job.future.cancel()
+        self._release_queued(job)
+
+    def cancel(self, job) -> bool:
+        """Stops delivery to `job`. Its GPU work still runs while other requesters share it."""
+        if job.cancelled or job.future is None or job.future.done():
+            return False
+        job.cancelled = True
+        primary = job.primary
+        if primary is not None:
+            if job in primary.subscribers:
+                primary.subscribers.remove(job)
+            job.follower.cancel()
+            if primary.cancelled and not primary.subscribers:
+                self._withdraw(primary)
+        elif not job.subscribers:
+            self._withdraw(job)
+        return True
+
+    def _withdraw(self, job):
+        # Nobody waits on it any more: out of the queue now, so it holds neither a quota slot nor a batch place.
+        if self.pending.remove(job):
+            self._release_queued(job)
+            self._finish(job, {"status": "error", "message": "Cancelled"})
+
+    def cancel_user(self, user_id) -> int:
+        """Cancels the user's jobs no GPU has started on: queued ones and ones waiting on another user's."""
+        user_id_str = str(user_id)
+        jobs = [job for queue in self.pending.queues.values() for job in queue.by_user.get(user_id_str, ())]
+        jobs += [sub for primary in self.inflight.values() for sub in primary.subscribers if str(sub.user_id) == user_id_str]
+        return sum(self.cancel(job) for job in jobs)
+
+    def _finish(self, job, result):
+        job.resolve(result)
+        if self.inflight.get(job.request_key) is job:
+            del self.inflight[job.request_key]
 
-    async def _worker_loop(self, processor_callback):
+    def _fail(self, job, result):
+        # For jobs the processor never answered: it would have delivered their result, so do it here.
+        answered = job.future is None or job.future.done()
+        self._finish(job, result)
+        if not answered and not job.cancelled and self.deliver_callback is not None:
+            task = asyncio.create_task(self._deliver(job, result))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, job, result):
+        try:
+            await self.deliver_callback(job, result)
+        except Exception as e:
+            print(f"Delivery error: {e}")
+
+    def expire_unplaceable(self, now=None):
+        """Fails queued jobs no GPU can run: none has the VRAM for them, or none has been healthy for `max_queue_wait`."""
+        now = now or time.time()
+        for key in list(self.pending.queues):
+            model = vram_profile(key)
+            gpus = [gpu for gpu in self.pool.gpus if gpu.fits(model)]
+            if any(gpu.is_healthy for gpu in gpus):
+                self.unplaceable_since.pop(key, None)
+                continue
+            since = self.unplaceable_since.setdefault(key, now)
+            if gpus and now - since < self.max_queue_wait:
+                continue
+            del self.unplaceable_since[key]
+            failure = {"status": "error", "message": "No GPU available" if gpus else f"No GPU has enough VRAM for {model}"}
+            jobs = self.pending.take(key, self.pending.count(key))
+            print(f"[QUEUE] Failing {len(jobs)} {model} job(s): {failure['message']}")
+            for job in jobs:
+                self._release_queued(job)
+                self._fail(job, failure)
+
+    async def _expire_loop(self):
         while self.is_running:
-            jobs = []
-            job = await self.queue.get()
-            jobs.append(job)
-            
-            start_wait = time.time()
-            max_batch = int(os.getenv("MAX_BATCH_SIZE", "2"))
-            while len(jobs) < max_batch:
-                remaining = 2.0 - (time.time() - start_wait)
-                if remaining <= 0:
+            await asyncio.sleep(QUEUE_CHECK_INTERVAL)
+            self.expire_unplaceable()
+
+    def _wake_for(self, key) -> bool:
+        # Wake one waiting worker: the one already holding a window for this key, else the emptiest GPU.
+        model = vram_profile(key)
+        candidates = [w for w in self.workers if w.waiting and not w.wakeup.is_set() and w.gpu.can_accept(model)]
+        if not candidates:
+            return False
+        holding = [w for w in candidates if w.window_key == key]
+        target = holding[0] if holding else max(candidates, key=lambda w: w.gpu.free_vram)
+        target.wakeup.set()
+        return True
+
+    def _wake_any(self):
+        for key in list(self.pending.queues):
+            if self._wake_for(key):
+                return
+
+    def _on_gpu_available(self, gpu):
+        for worker in self.workers:
+            if worker.gpu is gpu:
+                worker.wakeup.set()
+
+    async def start_worker(self, processor_callback, pool=None, deliver_callback=None):
+        self.is_running = True
+        self.pool = pool or gpu_pool
+        self.deliver_callback = deliver_callback
+        self.workers = [GPUWorker(gpu) for gpu in self.pool.gpus]
+        self.pool.subscribe(self._on_gpu_available)
+        self._loops = [asyncio.create_task(self._gpu_loop(worker, processor_callback)) for worker in self.workers]
+        self._loops.append(asyncio.create_task(self._expire_loop()))
+        await asyncio.gather(*self._loops)
+
+    async def stop(self, timeout=30.0):
+        """Stops taking new batches and waits up to `timeout` for running ones and their deliveries."""
+        self.is_running = False
+        for task in self._loops:
+            task.cancel()
+        await asyncio.gather(*self._loops, return_exceptions=True)
+        self._loops = []
+        deadline = time.time() + timeout
+        if self._batches:
+            await asyncio.wait(list(self._batches), timeout=timeout)
+        # Subscribers of jobs still queued would wait forever; only followers with a result are waited on.
+        stuck = {sub.follower for primary in self.inflight.values() for sub in primary.subscribers}
+        followers = [t for t in self._tasks if t not in stuck]
+        if followers:
+            await asyncio.wait(followers, timeout=max(0, deadline - time.time()))
+        for task in list(self._batches) + list(self._tasks):
+            task.cancel()
+
+    async def _next_batch(self, worker):
+        gpu = worker.gpu
+        accept = lambda key: gpu.can_accept(vram_profile(key))
+        self.idle_workers += 1
+        try:
+            start_wait, current = None, None
+            while True:
+                key = self.pending.best_key(accept)
+                if key is None:
+                    worker.window_key, start_wait, current = None, None, None
+                    await worker.wait()
+                    continue
+                if key != current:
+                    # A key that overtook the one being held gets its own window, not the rest of the old one.
+                    start_wait, current = time.time(), key
+                limit = self.pending.batch_limit(key, gpu.max_batch(vram_profile(key), self.policy.max_batch))
+                available = self.pending.count(key)
+                window = self.policy.window(available, limit, len(self.pending), self.idle_workers, gpu.active_jobs)
+                remaining = window - (time.time() - start_wait)
+                if available >= limit or remaining <= 0:
                     break
-                try:
-                    next_job = await asyncio.wait_for(self.queue.get(), timeout=remaining)
-                    jobs.append(next_job)
-                except asyncio.TimeoutError:
+                worker.window_key = key
+                if not await worker.wait(remaining):
                     break
-            
-            try:
-                await processor_callback(jobs)
-            except Exception as e:
-                print(f"Error: {e}")
-            finally:
-                for _ in range(len(jobs)):
-                    self.queue.task_done()
+        finally:
+            worker.window_key = None
+            self.idle_workers -= 1
+
+        jobs = []
+        dispatched = time.time()
+        for job in self.pending.take(key, limit):
+            # Queue wait ends when a worker starts forming a batch for the job's key; the rest is the window.
+            formed_from = max(job.timestamp, start_wait)
+            metrics.observe("stage_seconds", formed_from - job.timestamp, stage="queue_wait", model=key[0])
+            metrics.observe("stage_seconds", dispatched - formed_from, stage="batch_form", model=key[0])
+            self._mark_running(job)
+            jobs.append(job)
+        if self.pending:
+            # Pass the baton so jobs left behind don't wait for the next enqueue or release.
+            self._wake_any()
+        return key, jobs
+
+    async def _gpu_loop(self, worker, processor_callback):
+        while self.is_running:
+            key, jobs = await self._next_batch(worker)
+            if not jobs:
+                continue
+            # Reserved synchronously with the pick, so no other worker can claim the same VRAM.
+            model = vram_profile(key)
+            worker.gpu.reserve(model, len(jobs))
+            metrics.observe("batch_size", len(jobs), buckets=BATCH_BUCKETS, model=model)
+            task = asyncio.create_task(self._run_batch(worker.gpu, model, jobs, processor_callback))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _run_batch(self, gpu, model, jobs, processor_callback):
+        started = time.time()
+        failure = {"status": "error", "message": "No result"}
+        try:
+            await processor_callback(jobs, gpu)
+            self.policy.record_batch(len(jobs), time.time() - started)
+            metrics.observe("stage_seconds", time.time() - started, stage="batch", gpu=gpu.url, model=model)
+        except Exception as e:
+            print(f"Error: {e}")
+            failure = {"status": "error", "message": "Generation failed"}
+        finally:
+            # Whatever the processor didn't resolve fails here, for its own user and every subscriber.
+            for job in jobs:
+                self._fail(job, failure)
+                self._mark_done(job)
+            await self.pool.release_gpu(gpu, model, len(jobs))
 
 queue_manager = QueueManager()
+
+@metrics.collector
+def queue_gauges():
+    depth = defaultdict(int)
+    for key, queue in queue_manager.pending.queues.items():
+        depth[key[0]] += queue.size
+    for model, size in depth.items():
+        yield "queue_depth", {"model": model}, size
+    for user_id, count in queue_manager.queued_by_user.items():
+        yield "user_jobs", {"user": user_id, "state": "queued"}, count
+    for user_id, count in queue_manager.running_by_user.items():
+        yield "user_jobs", {"user": user_id, "state": "running"}, count
+    yield "idle_workers", {}, queue_manager.idle_workers
+    yield "inflight_requests", {}, len(queue_manager.inflight)
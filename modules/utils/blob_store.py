@@ -0,0 +1,109 @@
+import os
+import time
+import hashlib
+import threading
+
+BLOB_DIR = os.getenv("BLOB_STORE_PATH", os.path.join("database", "blobs"))
+BLOB_STORE_MB = float(os.getenv("BLOB_STORE_MB", "2048"))
+# Unreferenced blobs this young may belong to a row that is still being committed.
+ORPHAN_GRACE = 60.0
+
+class BlobStore:
+    """Content-addressed files named by their sha256, sharded by the first two hex chars."""
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.sizes = None
+        self.bytes = 0
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _scan(self):
+        if self.sizes is None:
+            self.sizes = {}
+            if os.path.isdir(self.root):
+                for shard in os.scandir(self.root):
+                    if shard.is_dir():
+                        for entry in os.scandir(shard.path):
+                            if entry.is_file() and not entry.name.endswith(".tmp"):
+                                self.sizes[entry.name] = entry.stat().st_size
+            self.bytes = sum(self.sizes.values())
+        return self.sizes
+
+    @property
+    def total_bytes(self) -> int:
+        with self.lock:
+            self._scan()
+            return self.bytes
+
+    def put(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        with self.lock:
+            sizes = self._scan()
+            if digest in sizes:
+                os.utime(path)
+                return digest
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            sizes[digest] = len(data)
+            self.bytes += len(data)
+        return digest
+
+    def get(self, digest: str):
+        if not digest:
+            return None
+        try:
+            with open(self._path(digest), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, digest: str, grace: float = 0.0) -> bool:
+        """Remove a blob unless it was written or re-put within `grace` seconds."""
+        with self.lock:
+            if grace:
+                # Checked under the lock put() touches the mtime with, so a re-put can't slip in between.
+                try:
+                    if os.path.getmtime(self._path(digest)) > time.time() - grace:
+                        return False
+                except FileNotFoundError:
+                    pass
+            self.bytes -= self._scan().pop(digest, 0)
+            try: os.remove(self._path(digest))
+            except FileNotFoundError: pass
+            return True
+
+    def over_limit(self) -> bool:
+        return self.total_bytes > self.max_bytes
+
+    def prune(self, referenced: set) -> int:
+        """Drop orphans older than ORPHAN_GRACE, then the oldest referenced blobs while over the size limit."""
+        freed = 0
+        cutoff = time.time() - ORPHAN_GRACE
+        with self.lock:
+            sizes = self._scan()
+            mtimes = {}
+            for digest in sizes:
+                try: mtimes[digest] = os.path.getmtime(self._path(digest))
+                except OSError: mtimes[digest] = 0.0
+            for digest in sorted(sizes, key=lambda d: (d in referenced, mtimes[d])):
+                if digest not in referenced and mtimes[digest] > cutoff:
+                    # Even over the limit: it may be the put() of a save that hasn't committed yet.
+                    continue
+                if self.bytes <= self.max_bytes and digest in referenced:
+                    continue
+                size = sizes.pop(digest)
+                try: os.remove(self._path(digest))
+                except FileNotFoundError: pass
+                self.bytes -= size
+                freed += size
+        return freed
+
+blob_store = BlobStore(BLOB_DIR, int(BLOB_STORE_MB * 1024 * 1024))
@@ -1,6 +1,10 @@
-from sqlalchemy import create_engine, Column, String, Integer, BigInteger, Float, LargeBinary
-from sqlalchemy.orm import DeclarativeBase, sessionmaker
-from sqlalchemy.pool import NullPool
+from sqlalchemy import create_engine, inspect, text, update, Column, String, Integer, BigInteger, Float, LargeBinary
+from sqlalchemy.orm import DeclarativeBase, sessionmaker, deferred
+from modules.utils.blob_store import blob_store, ORPHAN_GRACE
+from modules.utils.metrics import metrics
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import asyncio
 import os
 import time
 
@@ -13,6 +17,10 @@ else:
         DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
     DB_PATH = DATABASE_URL
 
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+IMAGE_INDEX_BLOCK = int(os.getenv("IMAGE_INDEX_BLOCK", "100"))
+
 class Base(DeclarativeBase):
     pass
 
@@ -21,8 +29,10 @@ class UserSession(Base):
     user_id = Column(String, primary_key=True)
     channel_id = Column(BigInteger)
     last_img_name = Column(String, nullable=True)
-    last_img_bytes = Column(LargeBinary, nullable=True)
-    updated_at = Column(Float, default=time.time, onupdate=time.time)
+    last_img_hash = Column(String, nullable=True)
+    # Legacy inline blobs, migrated into the blob store by init_db; never loaded with the row.
+    last_img_bytes = deferred(Column(LargeBinary, nullable=True))
+    updated_at = Column(Float, default=time.time, onupdate=time.time, index=True)
 
 class GlobalCounter(Base):
     __tablename__ = "counters"
@@ -32,10 +42,22 @@ class GlobalCounter(Base):
 if DB_PATH.startswith("sqlite"):
     engine = create_engine(DB_PATH, connect_args={"check_same_thread": False})
 else:
-    engine = create_engine(DB_PATH, poolclass=NullPool, pool_pre_ping=True)
+    engine = create_engine(
+        DB_PATH, pool_size=DB_POOL_SIZE, max_overflow=DB_POOL_SIZE,
+        pool_pre_ping=True, pool_recycle=DB_POOL_RECYCLE
+    )
 
 SessionLocal = sessionmaker(bind=engine)
 
+# Queries run here instead of on the event loop; one thread per pooled connection.
+db_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+
+session_listeners = []
+
+async def run_db(func, *args):
+    with metrics.timer("stage_seconds", stage="db", op=func.__name__.lstrip("_")):
+        return await asyncio.get_running_loop().run_in_executor(db_executor, func, *args)
+
 def init_db():
 
     """Initialize database, creating tables and default records if needed."""
@@ -46,42 +68,175 @@ def init_db():
             os.makedirs(db_dir)
 
     Base.metadata.create_all(engine)
+    migrate_blobs()
+    with engine.begin() as conn:
+        # create_all doesn't add indexes to a table that already exists.
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_sessions_updated_at ON sessions (updated_at)"))
     
     with SessionLocal() as session:
         if not session.get(GlobalCounter, "image_count"):
             session.add(GlobalCounter(name="image_count", value=0))
             session.commit()
 
-def get_db_session(user_id):
+def migrate_blobs():
+    columns = {c["name"] for c in inspect(engine).get_columns("sessions")}
+    if "last_img_hash" not in columns:
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE sessions ADD COLUMN last_img_hash VARCHAR"))
+    with SessionLocal() as session:
+        rows = session.query(UserSession.user_id).filter(UserSession.last_img_bytes.isnot(None)).all()
+        for n, (user_id,) in enumerate(rows, 1):
+            s = session.get(UserSession, user_id)
+            s.last_img_hash = blob_store.put(s.last_img_bytes)
+            s.last_img_bytes = None
+            if n % 200 == 0:
+                session.commit()
+                session.expunge_all()
+        session.commit()
+        if rows:
+            print(f"Moved {len(rows)} session images into the blob store")
+
+def _get_db_session(user_id):
     with SessionLocal() as session:
         return session.get(UserSession, str(user_id))
 
-def save_db_session(user_id, channel_id, img_bytes=None, img_name=None):
+def _save_db_session(user_id, channel_id, img_bytes=None, img_name=None):
+    img_hash = blob_store.put(img_bytes) if img_bytes else None
     with SessionLocal() as session:
         s = session.get(UserSession, str(user_id))
         if not s:
             s = UserSession(user_id=str(user_id), channel_id=channel_id, updated_at=time.time())
+            old_hash = None
         else:
             s.channel_id = channel_id
             s.updated_at = time.time()
+            old_hash = s.last_img_hash
             
-        s.last_img_bytes = img_bytes
+        s.last_img_hash = img_hash
         s.last_img_name = img_name
             
         session.merge(s)
         session.commit()
 
-def delete_db_session(channel_id):
+        if old_hash and old_hash != img_hash:
+            _release_blob(session, old_hash)
+    if blob_store.over_limit():
+        with SessionLocal() as session:
+            blob_store.prune({h for (h,) in session.query(UserSession.last_img_hash).filter(UserSession.last_img_hash.isnot(None))})
+
+def _release_blob(session, digest):
+    # Blobs are shared by content; only drop one once no session points at it. A fresh blob may
+    # have just been put() by a save that hasn't committed yet: leave it for prune() to collect.
+    if not session.query(UserSession.user_id).filter(UserSession.last_img_hash == digest).first():
+        blob_store.delete(digest, grace=ORPHAN_GRACE)
+
+def _delete_db_session(channel_id):
     with SessionLocal() as session:
-        session.query(UserSession).filter(UserSession.channel_id == channel_id).delete()
+        query = session.query(UserSession).filter(UserSession.channel_id == channel_id)
+        hashes = {h for (h,) in query.with_entities(UserSession.last_img_hash) if h}
+        query.delete()
         session.commit()
+        for digest in hashes:
+            _release_blob(session, digest)
 
-def get_next_image_index():
+def _get_session_times(since=None, channel_ids=None):
+    # Columns only, through the updated_at index; never touches image data.
     with SessionLocal() as session:
-        counter = session.get(GlobalCounter, "image_count")
-        counter.value += 1
-        val = counter.value
-        session.commit()
-        return val
+        query = session.query(UserSession.channel_id, UserSession.updated_at).filter(UserSession.updated_at.isnot(None))
+        if since is not None:
+            query = query.filter(UserSession.updated_at >= since)
+        if channel_ids is not None:
+            query = query.filter(UserSession.channel_id.in_(list(channel_ids)))
+        return [(channel_id, updated_at) for channel_id, updated_at in query.order_by(UserSession.updated_at)]
+
+def _get_last_image(img_hash):
+    return blob_store.get(img_hash)
+
+class IndexAllocator:
+    """Hands out image numbers from blocks claimed with one atomic UPDATE ... RETURNING.
+
+    Numbers left in a block when the process exits are skipped, never reused, so
+    indexes stay unique across restarts and between several bot processes.
+    """
+
+    def __init__(self, counter: str, block: int):
+        self.counter = counter
+        self.block = max(1, block)
+        self.lock = threading.Lock()
+        self.next = 0
+        self.end = 0
+
+    def take(self):
+        # Runs on the event loop: never wait for a refill holding the lock across its DB round-trip.
+        if not self.lock.acquire(blocking=False):
+            return None
+        try:
+            if self.next < self.end:
+                self.next += 1
+                return self.next
+            return None
+        finally:
+            self.lock.release()
+
+    def _claim(self) -> int:
+        stmt = (
+            update(GlobalCounter)
+            .where(GlobalCounter.name == self.counter)
+            .values(value=GlobalCounter.value + self.block)
+            .returning(GlobalCounter.value)
+        )
+        with engine.begin() as conn:
+            return conn.execute(stmt).scalar_one()
+
+    def allocate(self) -> int:
+        with self.lock:
+            if self.next >= self.end:
+                self.end = self._claim()
+                self.next = self.end - self.block
+            self.next += 1
+            return self.next
+
+image_indexes = IndexAllocator("image_count", IMAGE_INDEX_BLOCK)
+
+async def get_db_session(user_id):
+    return await run_db(_get_db_session, user_id)
+
+async def save_db_session(user_id, channel_id, img_bytes=None, img_name=None):
+    await run_db(_save_db_session, user_id, channel_id, img_bytes, img_name)
+    for callback in session_listeners:
+        callback(channel_id, time.time())
+
+async def delete_db_session(channel_id):
+    await run_db(_delete_db_session, channel_id)
+    for callback in session_listeners:
+        callback(channel_id, None)
+
+async def get_session_times(since=None, channel_ids=None):
+    return await run_db(_get_session_times, since, channel_ids)
+
+def subscribe_sessions(callback):
+    """callback(channel_id, updated_at) on every save; updated_at is None once the session is deleted."""
+    session_listeners.append(callback)
+
+def unsubscribe_sessions(callback):
+    if callback in session_listeners:
+        session_listeners.remove(callback)
+
+async def get_last_image(db_s):
+    """Bytes of the session's last image, or None if it was never stored or has been pruned."""
+    if not db_s or not db_s.last_img_hash:
+        return None
+    return await run_db(_get_last_image, db_s.last_img_hash)
+
+async def get_next_image_index():
+    # Only a block refill touches the database.
+    idx = image_indexes.take()
+    if idx is None:
+        idx = await run_db(image_indexes.allocate)
+    return idx
+
+def close_db():
+    db_executor.shutdown(wait=True)
+    engine.dispose()
 
 init_db()
@@ -1,17 +1,25 @@
 from PIL import Image
 import io
 
+FORMATS = {"jpeg": "jpg", "webp": "webp", "png": "png"}
+
+def encode_image(img, fmt="jpeg", quality=95):
+    if fmt != "png" and img.mode in ("RGBA", "P", "LA"):
+        img = img.convert("RGB")
+
+    output_buffer = io.BytesIO()
+    if fmt == "jpeg":
+        img.save(output_buffer, format="JPEG", quality=quality, subsampling=0)
+    elif fmt == "webp":
+        img.save(output_buffer, format="WEBP", quality=quality, method=4)
+    else:
+        img.save(output_buffer, format="PNG", optimize=True)
+    return output_buffer.getvalue()
+
 def sanitize_image(image_bytes):
     try:
         img = Image.open(io.BytesIO(image_bytes))
-        
-        if img.mode in ("RGBA", "P"):
-            img = img.convert("RGB")
-        
-        output_buffer = io.BytesIO()
-        img.save(output_buffer, format="JPEG", quality=95, subsampling=0)
-        
-        return output_buffer.getvalue()
+        return encode_image(img, "jpeg", 95)
     except Exception as e:
         print(f"Sanitization Error: {e}")
         return None
@@ -0,0 +1,81 @@
+import os
+import io
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image
+from modules.utils.image_filter import FORMATS, encode_image
+from modules.utils.metrics import metrics
+
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_QUEUE_LIMIT = int(os.getenv("IMAGE_QUEUE_LIMIT", "8"))
+UPLOAD_FORMAT = os.getenv("UPLOAD_FORMAT", "webp").lower()
+UPLOAD_QUALITY = int(os.getenv("UPLOAD_QUALITY", "90"))
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "256"))
+
+def _write(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def render_outputs(image_bytes, stem, fmt, quality, export_dir=None, thumb_size=0):
+    """Runs in a worker process: upload encoding, export write and thumbnail."""
+    img = Image.open(io.BytesIO(image_bytes))
+    img.load()
+    if fmt not in FORMATS:
+        fmt = "jpeg"
+    upload = encode_image(img, fmt, quality)
+    filename = f"{stem}.{FORMATS[fmt]}"
+
+    if export_dir:
+        try:
+            os.makedirs(export_dir, exist_ok=True)
+            # The export keeps the original full-quality output from ComfyUI.
+            source_ext = FORMATS.get((img.format or "").lower(), "png")
+            _write(os.path.join(export_dir, f"{stem}.{source_ext}"), image_bytes)
+            if thumb_size > 0:
+                thumb_dir = os.path.join(export_dir, "thumbs")
+                os.makedirs(thumb_dir, exist_ok=True)
+                thumb = img.copy()
+                thumb.thumbnail((thumb_size, thumb_size))
+                _write(os.path.join(thumb_dir, f"{stem}.webp"), encode_image(thumb, "webp", 80))
+        except OSError as e:
+            print(f"Export Error: {e}")
+
+    return {"image_bytes": upload, "filename": filename}
+
+class ImagePipeline:
+    def __init__(self, workers: int = IMAGE_WORKERS, limit: int = IMAGE_QUEUE_LIMIT):
+        self.workers = max(1, workers)
+        self.limit = max(1, limit)
+        self.slots = asyncio.Semaphore(self.limit)
+        self._executor = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        # Spawned, not forked: the bot process already runs DB and aiohttp threads.
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def process(self, image_bytes: bytes, stem: str, export_dir: str = None) -> dict:
+        # Callers wait here once `limit` images are queued, so a burst cannot pile up unbounded work.
+        async with self.slots:
+            loop = asyncio.get_running_loop()
+            args = (image_bytes, stem, UPLOAD_FORMAT, UPLOAD_QUALITY, export_dir, THUMBNAIL_SIZE)
+            with metrics.timer("stage_seconds", stage="encode"):
+                try:
+                    return await loop.run_in_executor(self.executor, render_outputs, *args)
+                except BrokenProcessPool:
+                    print("Image worker died, restarting pool")
+                    self._executor = None
+                    return await loop.run_in_executor(self.executor, render_outputs, *args)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+image_pipeline = ImagePipeline()
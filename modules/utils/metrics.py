@@ -0,0 +1,170 @@
+import os
+import time
+import bisect
+from aiohttp import web
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0") or 0)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Seconds; spans a DB round trip up to a long generation or a stalled upload.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BATCH_BUCKETS = (1, 2, 3, 4, 6, 8, 12, 16)
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation; coarse but free to compute.
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+class Timer:
+    __slots__ = ("metrics", "name", "labels", "started")
+
+    def __init__(self, metrics, name, labels):
+        self.metrics, self.name, self.labels = metrics, name, labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.started, **self.labels)
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+class Metrics:
+    """Counters and histograms recorded in place; gauges are read from collectors at scrape time."""
+
+    def __init__(self, prefix: str = "fullet"):
+        self.prefix = prefix
+        self.histograms = {}
+        self.counters = {}
+        self.collectors = []
+        self.help = {}
+        self._runner = None
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        series = self.histograms.setdefault(name, {})
+        key = _label_key(labels)
+        hist = series.get(key)
+        if hist is None:
+            hist = series[key] = Histogram(buckets)
+        hist.observe(value)
+
+    def timer(self, name, **labels) -> Timer:
+        return Timer(self, name, labels)
+
+    def inc(self, name, amount=1, **labels):
+        series = self.counters.setdefault(name, {})
+        key = _label_key(labels)
+        series[key] = series.get(key, 0) + amount
+
+    def collector(self, fn):
+        """Registers fn() -> iterable of (name, labels, value); called only when metrics are read."""
+        self.collectors.append(fn)
+        return fn
+
+    def gauges(self):
+        samples = {}
+        for fn in self.collectors:
+            try:
+                for name, labels, value in fn():
+                    samples.setdefault(name, []).append((_label_key(labels), value))
+            except Exception as e:
+                print(f"[METRICS] Collector {getattr(fn, '__name__', fn)} failed: {e}")
+        return samples
+
+    def render(self) -> str:
+        lines = []
+        def header(name, kind):
+            full = f"{self.prefix}_{name}"
+            if name in self.help:
+                lines.append(f"# HELP {full} {self.help[name]}")
+            lines.append(f"# TYPE {full} {kind}")
+            return full
+
+        for name, series in sorted(self.counters.items()):
+            full = header(name, "counter")
+            for key, value in series.items():
+                lines.append(f"{full}_total{_format_labels(key)} {value}")
+        for name, series in sorted(self.histograms.items()):
+            full = header(name, "histogram")
+            for key, hist in series.items():
+                cumulative = 0
+                for bound, n in zip(hist.bounds, hist.counts):
+                    cumulative += n
+                    lines.append(f"{full}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{full}_bucket{_format_labels(key, [('le', '+Inf')])} {hist.count}")
+                lines.append(f"{full}_sum{_format_labels(key)} {hist.sum}")
+                lines.append(f"{full}_count{_format_labels(key)} {hist.count}")
+        for name, samples in sorted(self.gauges().items()):
+            full = header(name, "gauge")
+            for key, value in samples:
+                lines.append(f"{full}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self, name, by=None) -> list:
+        """(label value, count, p50, p95, mean) per series of one histogram, merged over labels other than `by`."""
+        merged = {}
+        for key, hist in self.histograms.get(name, {}).items():
+            group = dict(key).get(by, "") if by else ""
+            into = merged.get(group)
+            if into is None:
+                into = merged[group] = Histogram(hist.bounds)
+            into.counts = [a + b for a, b in zip(into.counts, hist.counts)]
+            into.sum += hist.sum
+            into.count += hist.count
+        return [(group, h.count, h.quantile(0.5), h.quantile(0.95), h.sum / h.count if h.count else 0.0)
+                for group, h in sorted(merged.items())]
+
+    async def _handle(self, request):
+        return web.Response(text=self.render(), content_type="text/plain", charset="utf-8")
+
+    async def start_server(self, port: int = METRICS_PORT, host: str = METRICS_HOST):
+        if not port or self._runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        print(f"[METRICS] Serving on http://{host}:{port}/metrics")
+
+    async def stop_server(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+metrics = Metrics()
+metrics.describe("stage_seconds", "Time spent per pipeline stage")
+metrics.describe("job_seconds", "Enqueue to delivered, per model")
+metrics.describe("batch_size", "Jobs per dispatched batch")
@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from modules.utils.metrics import metrics
+
+RESULT_CACHE_MB = float(os.getenv("RESULT_CACHE_MB", "128"))
+RESULT_CACHE_DISK_MB = float(os.getenv("RESULT_CACHE_DISK_MB", "1024"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "86400"))
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join("database", "results"))
+
+def cache_digest(key) -> str:
+    return hashlib.sha256(json.dumps(list(key), ensure_ascii=False).encode()).hexdigest()
+
+class DiskTier:
+    def __init__(self, root: str, max_bytes: int, ttl: float):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.index = None
+        self.bytes = 0
+
+    def _path(self, digest):
+        return os.path.join(self.root, f"{digest}.bin")
+
+    def _scan(self):
+        # digest -> (size, mtime), oldest first; built once, then kept in step with writes.
+        if self.index is None:
+            entries = []
+            if os.path.isdir(self.root):
+                for entry in os.scandir(self.root):
+                    if entry.name.endswith(".bin"):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+            self.index = OrderedDict((d, (size, mtime)) for mtime, d, size in sorted(entries))
+            self.bytes = sum(size for size, _ in self.index.values())
+        return self.index
+
+    def _drop(self, digest):
+        self.bytes -= self._scan().pop(digest, (0, 0))[0]
+        try: os.remove(self._path(digest))
+        except FileNotFoundError: pass
+
+    def get(self, digest):
+        entry = self._scan().get(digest)
+        if entry is None:
+            return None
+        if time.time() - entry[1] > self.ttl:
+            self._drop(digest)
+            return None
+        try:
+            with open(self._path(digest), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            self.bytes -= self._scan().pop(digest, (0, 0))[0]
+            return None
+
+    def put(self, digest, data):
+        if self.max_bytes <= 0 or len(data) > self.max_bytes:
+            return
+        index = self._scan()
+        os.makedirs(self.root, exist_ok=True)
+        tmp = f"{self._path(digest)}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self._path(digest))
+        self.bytes -= index.pop(digest, (0, 0))[0]
+        index[digest] = (len(data), time.time())
+        self.bytes += len(data)
+        while self.bytes > self.max_bytes and index:
+            self._drop(next(iter(index)))
+
+class ResultCache:
+    """Finished images of deterministic (seeded) requests: an in-memory LRU over a disk tier."""
+
+    def __init__(self, max_bytes: int, disk_bytes: int, ttl: float, root: str):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.disk = DiskTier(root, disk_bytes, ttl)
+        self.lock = asyncio.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def _remember(self, digest, data):
+        if len(data) > self.max_bytes:
+            return
+        if digest in self.entries:
+            self.bytes -= len(self.entries.pop(digest)[0])
+        self.entries[digest] = (data, time.time())
+        self.bytes += len(data)
+        while self.bytes > self.max_bytes:
+            _, (old, _) = self.entries.popitem(last=False)
+            self.bytes -= len(old)
+
+    async def get(self, key):
+        digest = cache_digest(key)
+        entry = self.entries.get(digest)
+        if entry is not None and time.time() - entry[1] <= self.ttl:
+            self.entries.move_to_end(digest)
+            data = entry[0]
+        else:
+            if entry is not None:
+                self.bytes -= len(self.entries.pop(digest)[0])
+            async with self.lock:
+                data = await asyncio.to_thread(self.disk.get, digest)
+            if data is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(digest, data)
+        self.hits += 1
+        self.bytes_saved += len(data)
+        return data
+
+    async def put(self, key, data: bytes):
+        digest = cache_digest(key)
+        self._remember(digest, data)
+        async with self.lock:
+            try:
+                await asyncio.to_thread(self.disk.put, digest, data)
+            except OSError as e:
+                print(f"[CACHE] Disk write failed: {e}")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "bytes_saved": self.bytes_saved,
+            "memory_entries": len(self.entries),
+            "memory_bytes": self.bytes,
+        }
+
+result_cache = ResultCache(
+    int(RESULT_CACHE_MB * 1024 * 1024),
+    int(RESULT_CACHE_DISK_MB * 1024 * 1024),
+    RESULT_CACHE_TTL,
+    RESULT_CACHE_DIR,
+)
+
+@metrics.collector
+def result_cache_gauges():
+    for name, value in result_cache.stats().items():
+        yield f"result_cache_{name}", {}, value
@@ -0,0 +1,120 @@
+import os
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from modules.utils.db_manager import get_db_session, save_db_session, delete_db_session
+from modules.utils.metrics import metrics
+
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "1024"))
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "300"))
+
+class CachedSession:
+    __slots__ = ("user_id", "channel_id", "updated_at", "last_img_name", "last_img_hash", "cached_at")
+
+    def __init__(self, user_id, channel_id, updated_at, last_img_name=None, last_img_hash=None):
+        self.user_id = user_id
+        self.channel_id = channel_id
+        self.updated_at = updated_at
+        self.last_img_name = last_img_name
+        self.last_img_hash = last_img_hash
+        self.cached_at = time.time()
+
+class SessionCache:
+    """Per-user session rows kept in memory, with writes coalesced into at most one in flight per user."""
+
+    def __init__(self, max_entries: int = SESSION_CACHE_SIZE, ttl: float = SESSION_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.flushers = {}
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.flushes = 0
+
+    def _store(self, entry: CachedSession):
+        self.entries[entry.user_id] = entry
+        self.entries.move_to_end(entry.user_id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def get(self, user_id):
+        user_id = str(user_id)
+        entry = self.entries.get(user_id)
+        if entry is not None and time.time() - entry.cached_at <= self.ttl:
+            self.hits += 1
+            self.entries.move_to_end(user_id)
+            return entry
+        self.misses += 1
+        if user_id in self.flushers:
+            # The row is about to change; read it after our own write lands.
+            await self.flush(user_id)
+        row = await get_db_session(user_id)
+        if row is None:
+            self.entries.pop(user_id, None)
+            return None
+        entry = CachedSession(user_id, row.channel_id, row.updated_at, row.last_img_name, row.last_img_hash)
+        self._store(entry)
+        return entry
+
+    async def save(self, user_id, channel_id, img_bytes=None, img_name=None):
+        user_id = str(user_id)
+        img_hash = None
+        if img_bytes:
+            # Same digest the blob store uses, so readers can find the image before the write lands.
+            img_hash = (await asyncio.to_thread(hashlib.sha256, img_bytes)).hexdigest()
+        self._store(CachedSession(user_id, channel_id, time.time(), img_name, img_hash))
+        self.writes += 1
+        self.pending[user_id] = (channel_id, img_bytes, img_name)
+        if user_id not in self.flushers:
+            self.flushers[user_id] = asyncio.create_task(self._flush_loop(user_id))
+        if img_bytes:
+            # Image saves are awaited: a follow-up /edit must find the blob on disk.
+            await self.flush(user_id)
+
+    async def _flush_loop(self, user_id):
+        try:
+            while user_id in self.pending:
+                channel_id, img_bytes, img_name = self.pending.pop(user_id)
+                self.flushes += 1
+                try:
+                    await save_db_session(user_id, channel_id, img_bytes, img_name)
+                except Exception as e:
+                    print(f"[SESSION CACHE] Write failed for {user_id}: {e}")
+                    self.entries.pop(user_id, None)
+        finally:
+            self.flushers.pop(user_id, None)
+
+    async def flush(self, user_id=None):
+        tasks = [self.flushers.get(str(user_id))] if user_id is not None else list(self.flushers.values())
+        tasks = [t for t in tasks if t is not None]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def delete(self, channel_id):
+        for user_id, entry in list(self.entries.items()):
+            if entry.channel_id == channel_id:
+                del self.entries[user_id]
+                self.pending.pop(user_id, None)
+                await self.flush(user_id)
+        await delete_db_session(channel_id)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "writes": self.writes,
+            "db_writes": self.flushes,
+            "entries": len(self.entries),
+        }
+
+session_cache = SessionCache()
+
+@metrics.collector
+def session_cache_gauges():
+    for name, value in session_cache.stats().items():
+        yield f"session_cache_{name}", {}, value
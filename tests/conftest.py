@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.harness import prepare_environment
+
+# Settings are read when the bot modules are imported, so this runs before any test module loads them.
+prepare_environment(tempfile.mkdtemp(prefix="fullet-tests-"), gpus=1, base_port=18600)
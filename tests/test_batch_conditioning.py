@@ -0,0 +1,111 @@
+import json
+import multiprocessing
+import pytest
+import torch
+from benchmarks.stub_clip import StubCLIP, prompt_of
+from various_indications_node.batch_conditioning import CLIPTextEncodeBatch, align_lcm, align_pad, encode_cache
+
+MIXED_SETS = [(1, 2), (1, 2, 3), (2, 3, 5), (1, 2, 3, 4, 5, 6)]
+
+def encode(clip, chunks, alignment):
+    encode_cache.clear()
+    prompts = [prompt_of(n, i) for i, n in enumerate(chunks)]
+    (cond, extra), = CLIPTextEncodeBatch().encode(clip, len(prompts), "", "", texts=json.dumps(prompts), alignment=alignment)[0]
+    return cond, extra["pooled_output"]
+
+@pytest.mark.parametrize("chunks", MIXED_SETS)
+def test_pad_is_max_length_while_lcm_grows_multiplicatively(chunks):
+    clip = StubCLIP(width=64, pooled_width=32, layers=1)
+    lcm, lcm_pooled = encode(clip, chunks, "lcm")
+    pad, pad_pooled = encode(clip, chunks, "pad")
+    assert pad.shape == (len(chunks), 77 * max(chunks), 64)
+    assert lcm.shape[0] == len(chunks) and lcm.shape[1] % (77 * max(chunks)) == 0
+    assert pad.nelement() <= lcm.nelement()
+    assert torch.equal(pad_pooled, lcm_pooled)
+
+def test_pad_keeps_each_prompt_and_fills_with_the_empty_encoding():
+    clip = StubCLIP(width=64, pooled_width=32, layers=1)
+    conds = [clip.encode_from_tokens(clip.tokenize(prompt_of(n, n))) for n in (1, 3)]
+    empty = clip.encode_from_tokens(clip.tokenize(""))
+    short, long = align_pad(conds, empty)
+    assert torch.equal(long, conds[1])
+    assert torch.equal(short[:, :77], conds[0])
+    assert torch.equal(short[:, 77:154], empty) and torch.equal(short[:, 154:], empty)
+
+def test_equal_lengths_are_left_alone():
+    clip = StubCLIP(width=64, pooled_width=32, layers=1)
+    lcm, _ = encode(clip, (2, 2, 2), "lcm")
+    pad, _ = encode(clip, (2, 2, 2), "pad")
+    assert torch.equal(lcm, pad)
+
+def aligned_peak(strategy, chunks, width, results):
+    # Runs in a fresh process so ru_maxrss only sees this alignment.
+    import resource
+    conds = [torch.randn(1, 77 * n, width) for n in chunks]
+    empty = torch.randn(1, 77, width)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    aligned = align_lcm(conds) if strategy == "lcm" else align_pad(conds, empty)
+    batch = torch.cat(aligned)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    results.put((tuple(batch.shape), peak_kb * 1024))
+
+def measure(strategy, chunks, width=1024):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=aligned_peak, args=(strategy, chunks, width, results))
+    process.start()
+    shape, peak = results.get(timeout=120)
+    process.join()
+    return shape, peak
+
+def test_peak_memory_of_lcm_and_pad_on_long_mixed_prompts():
+    chunks = (1, 2, 3, 4, 5, 6)
+    lcm_shape, lcm_peak = measure("lcm", chunks)
+    pad_shape, pad_peak = measure("pad", chunks)
+    # LCM of 1..6 chunks is 60 chunks: every prompt becomes 4620 tokens instead of 462.
+    assert lcm_shape == (6, 4620, 1024) and pad_shape == (6, 462, 1024)
+    lcm_bytes = 6 * 4620 * 1024 * 4
+    assert lcm_peak >= lcm_bytes
+    assert pad_peak < lcm_peak / 4
+
+def reset_cache():
+    encode_cache.clear()
+    encode_cache.hits = encode_cache.misses = 0
+
+def test_cache_skips_the_encoder_across_consecutive_batches():
+    reset_cache()
+    clip, node = StubCLIP(width=64, pooled_width=32, layers=1), CLIPTextEncodeBatch()
+    batches = [["p1", "p2", "p3", "p4"], ["p1", "p5", "p2", "p6"], ["p1", "p2", "p3", "p4"]]
+    outputs = []
+    for prompts in batches:
+        # Positive prompts, then the four empty negatives the bot sends to the second batch node.
+        outputs.append(node.encode(clip, 4, "", "", texts=json.dumps(prompts), alignment="pad")[0][0][0])
+        node.encode(clip, 4, "", "", "", "", alignment="pad")
+    assert clip.encodes == 7
+    assert encode_cache.stats()["hits"] == 24 - 7
+    assert torch.equal(outputs[0], outputs[2])
+    fresh = StubCLIP(width=64, pooled_width=32, layers=1)
+    assert torch.equal(outputs[2][0:1], fresh.encode_from_tokens(fresh.tokenize("p1")))
+
+def test_cache_keeps_clips_apart():
+    reset_cache()
+    node = CLIPTextEncodeBatch()
+    first, second = StubCLIP(width=64, pooled_width=32, layers=1), StubCLIP(width=64, pooled_width=32, layers=1)
+    node.encode(first, 2, "a", "b")
+    node.encode(second, 2, "a", "b")
+    assert first.encodes == 2 and second.encodes == 2
+
+def test_cache_evicts_least_recently_used_within_its_budget():
+    from various_indications_node.batch_conditioning import EncodeCache
+    clip = StubCLIP(width=64, pooled_width=32, layers=1)
+    entry_bytes = 77 * 64 * 4 + 32 * 4
+    cache = EncodeCache(2 * entry_bytes)
+    cache.encode(clip, "a")
+    cache.encode(clip, "b")
+    cache.encode(clip, "a")
+    cache.encode(clip, "c")
+    assert cache.bytes <= 2 * entry_bytes and cache.stats()["entries"] == 2
+    cache.encode(clip, "a")
+    cache.encode(clip, "b")
+    assert clip.encodes == 4
+    assert cache.stats()["hits"] == 2
@@ -0,0 +1,47 @@
+import os
+import time
+from modules.utils import db_manager as db
+from modules.utils.blob_store import BlobStore, blob_store, ORPHAN_GRACE
+
+def age(digest, seconds):
+    then = time.time() - seconds
+    os.utime(blob_store._path(digest), (then, then))
+
+def test_replacing_an_image_keeps_a_blob_another_save_just_put():
+    shared, other = os.urandom(1024), os.urandom(1024)
+    db._save_db_session("blob-a", 1, shared, "a.png")
+    digest = db._get_db_session("blob-a").last_img_hash
+    age(digest, ORPHAN_GRACE * 2)
+    # A second save has written the same image but not committed its row yet.
+    assert blob_store.put(shared) == digest
+    db._save_db_session("blob-a", 1, other, "b.png")
+    assert blob_store.get(digest) == shared
+
+def test_replacing_an_image_drops_a_stale_orphan():
+    old, new = os.urandom(1024), os.urandom(1024)
+    db._save_db_session("blob-b", 2, old, "a.png")
+    digest = db._get_db_session("blob-b").last_img_hash
+    age(digest, ORPHAN_GRACE * 2)
+    db._save_db_session("blob-b", 2, new, "b.png")
+    assert blob_store.get(digest) is None
+
+def test_a_referenced_blob_is_never_released():
+    shared = os.urandom(1024)
+    db._save_db_session("blob-c", 3, shared, "a.png")
+    db._save_db_session("blob-d", 4, shared, "a.png")
+    digest = db._get_db_session("blob-c").last_img_hash
+    age(digest, ORPHAN_GRACE * 2)
+    db._save_db_session("blob-c", 3, os.urandom(1024), "b.png")
+    assert blob_store.get(digest) == shared
+
+def test_prune_over_the_limit_spares_young_orphans(tmp_path):
+    store = BlobStore(str(tmp_path), max_bytes=2048)
+    young, stale, kept, oldest = (store.put(os.urandom(1024)) for _ in range(4))
+    for digest, seconds in ((stale, ORPHAN_GRACE * 2), (kept, ORPHAN_GRACE * 3), (oldest, ORPHAN_GRACE * 4)):
+        then = time.time() - seconds
+        os.utime(store._path(digest), (then, then))
+    store.prune({kept, oldest})
+    # The stale orphan and then the oldest referenced blob go; the fresh put() survives.
+    assert store.get(young) is not None and store.get(kept) is not None
+    assert store.get(stale) is None and store.get(oldest) is None
+    assert store.total_bytes == 2048
@@ -0,0 +1,156 @@
+import asyncio
+from modules.ai.gpu_pool import GPUPool, GPUInstance
+from modules.queue_manager.manager import QueueManager
+from modules.queue_manager.batching import create_policy
+
+class Bot:
+    """The parts of ImageBot the queue talks to: a processor that answers like finish_job, and delivery."""
+
+    def __init__(self, manager, fail=False):
+        self.manager = manager
+        self.fail = fail
+        self.gate = asyncio.Event()
+        self.gate.set()
+        self.batches = []
+        self.delivered = []
+
+    async def process(self, jobs, gpu):
+        self.batches.append([job.user_id for job in jobs])
+        await self.gate.wait()
+        if self.fail:
+            raise RuntimeError("sampler crashed")
+        for job in jobs:
+            if job.cancelled and not job.subscribers:
+                continue
+            result = {"status": "success"}
+            if not job.cancelled:
+                await self.deliver(job, result)
+            job.resolve(result)
+
+    async def deliver(self, job, result):
+        self.delivered.append((job.user_id, result["status"], result.get("message")))
+
+def make_manager():
+    pool = GPUPool()
+    pool.gpus = [GPUInstance(url="sim://gpu0", api_key="", total_vram=24.0)]
+    manager = QueueManager(max_jobs_per_user=2, policy=create_policy("adaptive", max_batch=4, max_wait=0.05))
+    return manager, pool
+
+async def start(manager, pool, bot):
+    return asyncio.create_task(manager.start_worker(bot.process, pool=pool, deliver_callback=bot.deliver))
+
+async def settle(manager, timeout=5.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while manager.pending or manager._batches or manager._tasks or manager.inflight:
+        assert loop.time() < deadline, "queue never drained"
+        await asyncio.sleep(0.01)
+    await manager.stop()
+
+def assert_quota_released(manager):
+    assert not manager.queued_by_user and not manager.running_by_user
+
+def test_a_cancelled_subscriber_gets_nothing_and_the_primary_still_runs():
+    async def run():
+        manager, pool = make_manager()
+        bot = Bot(manager)
+        bot.gate.clear()
+        await manager.add_job(1, "a red fox", None, "alice")
+        await manager.add_job(1, "a red fox", None, "bob")
+        worker = await start(manager, pool, bot)
+        while not bot.batches:
+            await asyncio.sleep(0.01)
+        # The shared job is on the GPU; bob only stops waiting for it.
+        assert manager.cancel_user("bob") == 1
+        bot.gate.set()
+        await settle(manager)
+        worker.cancel()
+        assert bot.batches == [["alice"]]
+        assert bot.delivered == [("alice", "success", None)]
+        assert_quota_released(manager)
+        assert await manager.add_job(1, "again", None, "bob") != -1
+    asyncio.run(run())
+
+def test_a_cancelled_primary_without_subscribers_never_reaches_the_gpu():
+    async def run():
+        manager, pool = make_manager()
+        bot = Bot(manager)
+        await manager.add_job(1, "a red fox", None, "alice")
+        assert manager.cancel_user("alice") == 1
+        assert manager.cancel_user("alice") == 0
+        worker = await start(manager, pool, bot)
+        await settle(manager)
+        worker.cancel()
+        assert bot.batches == []
+        assert bot.delivered == []
+        assert_quota_released(manager)
+    asyncio.run(run())
+
+def test_a_cancelled_primary_still_runs_for_its_subscribers():
+    async def run():
+        manager, pool = make_manager()
+        bot = Bot(manager)
+        await manager.add_job(1, "a red fox", None, "alice")
+        await manager.add_job(1, "a  red fox ", None, "bob")
+        await manager.add_job(1, "a red fox", None, "carol")
+        assert manager.cancel_user("alice") == 1
+        worker = await start(manager, pool, bot)
+        await settle(manager)
+        worker.cancel()
+        assert bot.batches == [["alice"]]
+        assert sorted(bot.delivered) == [("bob", "success", None), ("carol", "success", None)]
+        assert_quota_released(manager)
+    asyncio.run(run())
+
+def test_a_processor_exception_reaches_every_requester_once():
+    async def run():
+        manager, pool = make_manager()
+        bot = Bot(manager, fail=True)
+        await manager.add_job(1, "a red fox", None, "alice")
+        await manager.add_job(1, "a red fox", None, "bob")
+        await manager.add_job(1, "a red fox", None, "carol")
+        await manager.add_job(1, "a blue whale", None, "dave")
+        worker = await start(manager, pool, bot)
+        await settle(manager)
+        worker.cancel()
+        assert bot.batches == [["alice", "dave"]]
+        assert sorted(bot.delivered) == [(user, "error", "Generation failed") for user in ("alice", "bob", "carol", "dave")]
+        assert_quota_released(manager)
+    asyncio.run(run())
+
+def test_cancel_frees_the_slot_at_once_even_with_no_gpu_up():
+    async def run():
+        manager, pool = make_manager()
+        pool.gpus[0].is_healthy = False
+        bot = Bot(manager)
+        worker = await start(manager, pool, bot)
+        await manager.add_job(1, "a red fox", None, "alice")
+        await manager.add_job(1, "a grey wolf", None, "alice")
+        assert await manager.add_job(1, "a brown bear", None, "alice") == -1
+        assert manager.cancel_user("alice") == 2
+        assert len(manager.pending) == 0 and not manager.inflight
+        # Re-queued right away; the cancelled jobs don't take places in the next batch either.
+        assert await manager.add_job(1, "a brown bear", None, "alice") != -1
+        await manager.add_job(1, "a black cat", None, "alice")
+        for user in ("bob", "carol"):
+            await manager.add_job(1, f"{user}'s owl", None, user)
+        pool.gpus[0].is_healthy = True
+        await pool.notify(pool.gpus[0])
+        await settle(manager)
+        worker.cancel()
+        assert [sorted(batch) for batch in bot.batches] == [["alice", "alice", "bob", "carol"]]
+        assert_quota_released(manager)
+    asyncio.run(run())
+
+def test_a_cancelled_primary_leaves_the_queue_once_its_subscribers_cancel():
+    async def run():
+        manager, pool = make_manager()
+        await manager.add_job(1, "a red fox", None, "alice")
+        await manager.add_job(1, "a red fox", None, "bob")
+        assert manager.cancel_user("alice") == 1
+        assert len(manager.pending) == 1
+        assert manager.cancel_user("bob") == 1
+        await asyncio.sleep(0.01)
+        assert len(manager.pending) == 0 and not manager.inflight
+        assert_quota_released(manager)
+    asyncio.run(run())
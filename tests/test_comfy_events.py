@@ -0,0 +1,74 @@
+import time
+import asyncio
+from types import SimpleNamespace
+from benchmarks.fake_comfy import FakeComfy
+from modules.ai import comfy_api
+from modules.ai.comfy_events import history_error
+from modules.ai.gpu_pool import GPUInstance
+
+WORKFLOW = {"9": {"class_type": "SaveImage", "inputs": {"batch_size": 2}}}
+
+async def run_prompt(fake, during=None, timeout=20):
+    await fake.start()
+    gpu = GPUInstance(url=fake.url, api_key="", total_vram=fake.vram_gb)
+    progress = []
+    try:
+        response = await comfy_api.queue_prompt(WORKFLOW, gpu)
+        waiting = asyncio.ensure_future(comfy_api.wait_for_image(
+            response["prompt_id"], gpu, timeout=timeout, on_progress=lambda v, t: progress.append((v, t))))
+        if during is not None:
+            await during(gpu)
+        entry = await asyncio.wait_for(waiting, timeout + 5)
+        return entry, progress, gpu
+    finally:
+        await gpu.client.close()
+        await fake.stop()
+
+def test_completion_and_progress_arrive_over_websocket():
+    fake = FakeComfy(18610, base_time=1.0, per_image_time=0.0, steps=4)
+    entry, progress, _ = asyncio.run(run_prompt(fake))
+    assert [img["filename"] for img in entry["outputs"]["9"]["images"]] == ["18610-1_9_0.png", "18610-1_9_1.png"]
+    assert progress == [(1, 4), (2, 4), (3, 4), (4, 4)]
+    # One history read to sync while the socket connects; the rest comes from events.
+    assert fake.counts["history"] <= 2
+
+def test_execution_error_is_reported():
+    fake = FakeComfy(18611, base_time=0.2, exec_fail=1.0)
+    entry, _, _ = asyncio.run(run_prompt(fake))
+    assert history_error(entry) == "Injected execution failure"
+
+def test_falls_back_to_history_polling_without_websocket():
+    fake = FakeComfy(18612, base_time=0.5, ws=False)
+    entry, progress, _ = asyncio.run(run_prompt(fake))
+    assert "9" in entry["outputs"]
+    assert progress == []
+    assert fake.counts["history"] >= 2
+
+def test_polling_reports_the_execution_error_from_history_status():
+    async def run():
+        fake = FakeComfy(18614, base_time=0.4, exec_fail=1.0, ws=False)
+        await fake.start()
+        gpu = GPUInstance(url=fake.url, api_key="", total_vram=fake.vram_gb)
+        template = SimpleNamespace(name="flux", output_node="9")
+        started = time.perf_counter()
+        try:
+            results = await comfy_api.run_batch_workflow(WORKFLOW, template, [object(), object()], gpu)
+        finally:
+            await gpu.client.close()
+            await fake.stop()
+        return results, time.perf_counter() - started, fake
+    results, elapsed, fake = asyncio.run(run())
+    # The error is read from status.messages, not waited out until the timeout.
+    assert results == [{"status": "error", "message": "Injected execution failure"}] * 2
+    assert elapsed < 5
+    assert fake.counts["history"] >= 1
+
+def test_recovers_when_the_socket_drops_mid_prompt():
+    fake = FakeComfy(18613, base_time=1.5, steps=3)
+    async def drop(gpu):
+        await asyncio.sleep(0.4)
+        assert gpu.client.events.connected
+        for ws in list(fake.sockets.values()):
+            await ws.close()
+    entry, _, _ = asyncio.run(run_prompt(fake, during=drop))
+    assert "9" in entry["outputs"]
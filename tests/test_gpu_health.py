@@ -0,0 +1,129 @@
+import asyncio
+from benchmarks.fake_comfy import FakeComfy
+from modules.ai import gpu_pool as pool_module, comfy_api
+from modules.ai.gpu_pool import GPUPool, GPUInstance, CLOSED, OPEN, HALF_OPEN, FAILURE_THRESHOLD
+from modules.ai.comfy_events import history_error
+
+async def wait_until(condition, timeout=5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "condition not reached"
+        await asyncio.sleep(0.01)
+
+def test_flapping_gpu_trips_and_recovers(monkeypatch):
+    monkeypatch.setattr(pool_module, "HEALTH_INTERVAL", 0.05)
+    monkeypatch.setattr(pool_module, "BREAKER_COOLDOWN", 0.3)
+    async def run():
+        fake = FakeComfy(18620, vram_gb=16.0)
+        await fake.start()
+        pool = GPUPool()
+        gpu = GPUInstance(url=fake.url, api_key="", total_vram=8.0)
+        pool.gpus = [gpu]
+        notified = []
+        pool.subscribe(notified.append)
+        pool.start_health_checks()
+        try:
+            # Probes replace the configured VRAM with what the server reports.
+            await wait_until(lambda: gpu.last_check)
+            assert gpu.total_vram == 16.0 and gpu.breaker == CLOSED
+
+            tracker = gpu.client.events.track("in-flight")
+            fake.available = False
+            await wait_until(lambda: gpu.breaker != CLOSED)
+            assert not gpu.is_healthy and not gpu.can_accept("flux")
+            assert gpu.failures == FAILURE_THRESHOLD
+            # Jobs already waiting on this GPU fail now instead of at their timeout.
+            assert history_error(await asyncio.wait_for(tracker.future, 1)) == "GPU unavailable"
+
+            fake.available = True
+            await wait_until(lambda: gpu.is_healthy)
+            assert gpu.breaker == CLOSED and gpu.failures == 0
+            assert notified[-1] is gpu
+        finally:
+            await pool.close()
+            await fake.stop()
+    asyncio.run(run())
+
+def test_failed_half_open_probe_doubles_the_cooldown():
+    async def run():
+        fake = FakeComfy(18621)
+        await fake.start()
+        pool = GPUPool()
+        gpu = GPUInstance(url=fake.url, api_key="", total_vram=24.0, cooldown=1.0)
+        pool.gpus = [gpu]
+        try:
+            fake.available = False
+            for _ in range(FAILURE_THRESHOLD):
+                await pool.health_check(gpu)
+            assert gpu.breaker == OPEN
+            gpu.breaker = HALF_OPEN
+            await pool.health_check(gpu)
+            assert gpu.breaker == OPEN and gpu.cooldown == 2.0
+            fake.available = True
+            gpu.breaker = HALF_OPEN
+            assert await pool.health_check(gpu)
+            assert gpu.breaker == CLOSED
+        finally:
+            await pool.close()
+            await fake.stop()
+    asyncio.run(run())
+
+def test_reported_usage_replaces_static_guesses():
+    gpu = GPUInstance(url="sim://gpu", api_key="", total_vram=8.0)
+    gib = 1024 ** 3
+    gpu.reserve("flux")
+    gpu.apply_stats({"devices": [{"vram_total": 24 * gib, "vram_free": 10 * gib, "torch_vram_free": 2 * gib}]},
+                    {"queue_running": [[0, "a"]], "queue_pending": []})
+    # torch_vram_free is part of vram_free: counting it again would hide 2 GB that are in use.
+    assert gpu.total_vram == 24.0 and gpu.reported_vram == 14.0
+    assert gpu.free_vram == 10.0
+    assert gpu.max_batch("flux", 16) == 7
+    gpu.release("flux")
+    gpu.used_vram = 3.0
+    gpu.apply_stats({"devices": []}, {"queue_running": [], "queue_pending": []})
+    assert gpu.used_vram == 0.0
+
+def test_upload_cache_survives_blips_and_is_dropped_on_restart():
+    async def run():
+        fake = FakeComfy(18622, base_time=0.05, per_image_time=0.0, steps=1, ws=False)
+        await fake.start()
+        pool = GPUPool()
+        gpu = GPUInstance(url=fake.url, api_key="", total_vram=24.0)
+        pool.gpus = [gpu]
+
+        async def upload_and_run():
+            await comfy_api.upload_image(b"source image", "a.png", gpu)
+            response = await comfy_api.queue_prompt({"9": {"class_type": "SaveImage", "inputs": {}}}, gpu)
+            await comfy_api.wait_for_image(response["prompt_id"], gpu, timeout=5)
+
+        try:
+            await upload_and_run()
+            assert await pool.health_check(gpu)
+            assert len(gpu.client.uploads.entries) == 1
+
+            # A probe lost to the network is not a restart.
+            fake.available = False
+            await pool.health_check(gpu)
+            assert gpu.failures == 1
+            fake.available = True
+            assert await pool.health_check(gpu)
+            assert len(gpu.client.uploads.entries) == 1
+
+            # Same install restarted between two probes: its history is gone.
+            fake.restart()
+            assert await pool.health_check(gpu)
+            assert not gpu.client.uploads.entries
+
+            # Another install behind the same URL, even one whose history happens to hold the marker.
+            await upload_and_run()
+            assert await pool.health_check(gpu)
+            marker = gpu.client.history_marker
+            kept = fake.history[marker]
+            fake.restart(version="0.3.41")
+            fake.history[marker] = kept
+            assert await pool.health_check(gpu)
+            assert not gpu.client.uploads.entries
+        finally:
+            await pool.close()
+            await fake.stop()
+    asyncio.run(run())
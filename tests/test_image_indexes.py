@@ -0,0 +1,28 @@
+import time
+import asyncio
+from modules.utils import db_manager as db
+
+def test_a_slow_block_claim_never_blocks_the_event_loop(monkeypatch):
+    allocator = db.IndexAllocator("image_count", 5)
+    claim = allocator._claim
+    def slow_claim():
+        time.sleep(0.3)
+        return claim()
+    monkeypatch.setattr(allocator, "_claim", slow_claim)
+    monkeypatch.setattr(db, "image_indexes", allocator)
+
+    async def run():
+        stalls = []
+        async def tick():
+            while True:
+                started = time.perf_counter()
+                await asyncio.sleep(0.01)
+                stalls.append(time.perf_counter() - started - 0.01)
+        ticker = asyncio.create_task(tick())
+        ids = await asyncio.gather(*(db.get_next_image_index() for _ in range(12)))
+        ticker.cancel()
+        return ids, max(stalls)
+
+    ids, worst = asyncio.run(run())
+    assert len(set(ids)) == 12
+    assert worst < 0.1
@@ -0,0 +1,22 @@
+import os
+import sys
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run with app.py as __main__, the way the bot starts: spawned workers re-import it as __mp_main__.
+PROBE = """
+import os, sys, __main__
+__main__.__file__ = os.path.abspath("app.py")
+from modules.utils.image_pipeline import image_pipeline
+loaded = image_pipeline.executor.submit(eval, "sorted(m for m in __import__('sys').modules if m.startswith('modules.'))").result(60)
+image_pipeline.close()
+print(" ".join(loaded))
+"""
+
+def test_spawned_image_workers_do_not_load_the_bot():
+    proc = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, capture_output=True, text=True, timeout=120)
+    assert proc.returncode == 0, proc.stderr
+    loaded = proc.stdout.split()
+    assert "modules.discord.bot" not in loaded
+    assert "modules.utils.db_manager" not in loaded
@@ -0,0 +1,127 @@
+import time
+import asyncio
+from modules.ai.gpu_pool import GPUPool, GPUInstance
+from modules.queue_manager.manager import QueueManager
+from modules.queue_manager.batching import create_policy
+
+def make_pool(*sizes):
+    pool = GPUPool()
+    pool.gpus = [GPUInstance(url=f"sim://{i}-{size}gb", api_key="", total_vram=size) for i, size in enumerate(sizes)]
+    return pool
+
+def make_manager(pool, **policy):
+    manager = QueueManager(max_jobs_per_user=10 ** 6, policy=create_policy("adaptive", **policy))
+    manager.pool = pool
+    return manager
+
+def test_gpus_of_different_sizes_never_sit_idle_under_backlog():
+    async def run():
+        pool = make_pool(8.0, 12.0, 24.0)
+        manager = make_manager(pool, max_batch=8)
+        runs = {gpu.url: [] for gpu in pool.gpus}
+        executors = {gpu.url: asyncio.Lock() for gpu in pool.gpus}
+        async def process(jobs, gpu):
+            # One prompt at a time per server, like ComfyUI.
+            async with executors[gpu.url]:
+                started = time.perf_counter()
+                await asyncio.sleep(0.1 + 0.02 * len(jobs))
+                runs[gpu.url].append((started, time.perf_counter(), len(jobs)))
+            for job in jobs:
+                job.resolve({"status": "success"})
+        worker = asyncio.create_task(manager.start_worker(process, pool=pool))
+        for i in range(120):
+            await manager.add_job(1, f"prompt {i}", None, i)
+        while sum(size for batches in runs.values() for *_, size in batches) < 120:
+            await asyncio.sleep(0.02)
+        await manager.stop()
+        worker.cancel()
+        return runs
+    runs = asyncio.run(run())
+    last_start = max(start for batches in runs.values() for start, _, _ in batches)
+    for url, batches in runs.items():
+        assert batches, f"{url} got no work"
+        batches.sort()
+        gaps = [b[0] - a[1] for a, b in zip(batches, batches[1:]) if b[0] < last_start]
+        assert max(gaps, default=0) < 0.05, f"{url} idle for {max(gaps):.3f}s with jobs queued"
+    # Batches are sized by each card's free VRAM: 4 GB for flux plus 1 GB per extra image.
+    assert max(size for *_, size in runs["sim://0-8.0gb"]) <= 5
+
+def test_job_no_gpu_can_fit_fails_at_once_and_frees_the_slot():
+    async def run():
+        manager = make_manager(make_pool(4.0))
+        delivered = []
+        async def deliver(job, result):
+            delivered.append((job.prompt, result["message"]))
+        manager.deliver_callback = deliver
+        await manager.add_job(1, "make it winter", None, 7, is_edit=True, input_image_bytes=b"png")
+        manager.expire_unplaceable()
+        await asyncio.sleep(0.01)
+        return manager, delivered
+    manager, delivered = asyncio.run(run())
+    assert delivered == [("make it winter", "No GPU has enough VRAM for flux_edit")]
+    assert manager.active_jobs(7) == 0
+    assert len(manager.pending) == 0
+
+def test_jobs_fail_after_max_wait_with_every_breaker_open():
+    async def run():
+        pool = make_pool(24.0, 24.0)
+        for gpu in pool.gpus:
+            gpu.is_healthy = False
+        manager = make_manager(pool)
+        await manager.add_job(1, "a lighthouse", None, 1)
+        await manager.add_job(1, "a lighthouse", None, 2)
+        primary = manager.inflight[("a lighthouse", "flux", None, None)]
+        now = time.time()
+        manager.expire_unplaceable(now)
+        manager.expire_unplaceable(now + manager.max_queue_wait - 1)
+        still_queued = len(manager.pending)
+        manager.expire_unplaceable(now + manager.max_queue_wait)
+        # The subscriber's follower delivers and releases its own slot.
+        await asyncio.sleep(0.01)
+        return manager, primary, still_queued
+    manager, primary, still_queued = asyncio.run(run())
+    assert still_queued == 1
+    assert primary.future.result() == {"status": "error", "message": "No GPU available"}
+    assert manager.active_jobs(1) == 0 and manager.active_jobs(2) == 0
+    assert not manager.unplaceable_since
+
+def test_recovered_gpu_resets_the_wait():
+    async def run():
+        pool = make_pool(24.0)
+        pool.gpus[0].is_healthy = False
+        manager = make_manager(pool)
+        await manager.add_job(1, "a lighthouse", None, 1)
+        now = time.time()
+        manager.expire_unplaceable(now)
+        pool.gpus[0].is_healthy = True
+        manager.expire_unplaceable(now + manager.max_queue_wait - 1)
+        pool.gpus[0].is_healthy = False
+        manager.expire_unplaceable(now + manager.max_queue_wait + 1)
+        return manager
+    manager = asyncio.run(run())
+    assert len(manager.pending) == 1
+
+def test_a_key_that_overtakes_the_held_one_gets_a_full_window():
+    async def run():
+        pool = make_pool(24.0)
+        manager = QueueManager(max_jobs_per_user=10 ** 6, policy=create_policy("fixed", max_batch=2, max_wait=0.4))
+        dispatched = {}
+        async def process(jobs, gpu):
+            for job in jobs:
+                dispatched[job.model_type] = time.perf_counter()
+                job.resolve({"status": "success"})
+        worker = asyncio.create_task(manager.start_worker(process, pool=pool))
+        started = time.perf_counter()
+        await manager.add_job(1, "a barn", None, 1, model_type="flux")
+        await asyncio.sleep(0.3)
+        # Higher priority and another key: the worker switches to it mid-window.
+        arrived = time.perf_counter()
+        await manager.add_job(0, "a barn", None, 2, model_type="z-image")
+        while len(dispatched) < 2:
+            await asyncio.sleep(0.01)
+        await manager.stop()
+        worker.cancel()
+        return dispatched["z-image"] - arrived, dispatched["flux"] - started
+    z_wait, flux_wait = asyncio.run(run())
+    assert z_wait >= 0.35
+    assert flux_wait >= 0.4
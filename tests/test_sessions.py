@@ -0,0 +1,39 @@
+import asyncio
+from modules.utils import db_manager as db
+from modules.discord.cogs.sessions import SessionManager
+
+class Bot:
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.ready = asyncio.Event()
+
+    async def wait_until_ready(self):
+        await self.ready.wait()
+
+def test_reloading_the_cog_leaves_no_session_listener_behind():
+    async def run():
+        bot = Bot()
+        baseline = len(db.session_listeners)
+        for _ in range(3):
+            cog = SessionManager(bot)
+            assert len(db.session_listeners) == baseline
+            await cog.cog_load()
+            assert cog.reaper.touch in db.session_listeners
+            await cog.cog_unload()
+            assert len(db.session_listeners) == baseline
+        # The unloaded cog's reaper must not start once the bot becomes ready.
+        bot.ready.set()
+        await asyncio.sleep(0.05)
+        assert cog.reaper._task is None
+    asyncio.run(run())
+
+def test_saves_reach_the_loaded_cogs_reaper():
+    async def run():
+        cog = SessionManager(Bot())
+        await cog.cog_load()
+        try:
+            await db.save_db_session("reaper-user", 4242)
+            assert 4242 in cog.reaper.deadlines
+        finally:
+            await cog.cog_unload()
+    asyncio.run(run())
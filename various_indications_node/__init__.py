@@ -1,11 +1,24 @@
-from .batch_conditioning import CLIPTextEncodeBatch, StringInput, BatchString
+from .batch_conditioning import CLIPTextEncodeBatch, StringInput, BatchString, encode_cache
+from .image_batch import LoadImageBatch, CropImageBatch
 
 NODE_CLASS_MAPPINGS = {
     "CLIP Text Encode (Batch)": CLIPTextEncodeBatch,
     "String Input": StringInput,
-    "Batch String": BatchString
+    "Batch String": BatchString,
+    "Load Image Batch (FuLLet)": LoadImageBatch,
+    "Crop Image Batch (FuLLet)": CropImageBatch
 }
 
 WEB_DIRECTORY = "./js"
 
+try:
+    from aiohttp import web
+    from server import PromptServer
+
+    @PromptServer.instance.routes.get("/fullet/encode_cache")
+    async def encode_cache_stats(request):
+        return web.json_response(encode_cache.stats())
+except (ImportError, AttributeError):
+    pass
+
 __all__ = ["NODE_CLASS_MAPPINGS", "WEB_DIRECTORY"]
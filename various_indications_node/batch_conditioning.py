@@ -1,5 +1,10 @@
 import torch
 import math
+import json
+import os
+import itertools
+import weakref
+from collections import OrderedDict
 
 def get_lcm(a, b):
     return abs(a * b) // math.gcd(a, b)
@@ -11,6 +16,103 @@ def get_lcm_list(numbers):
         res = get_lcm(res, n)
     return res
 
+def parse_batch_texts(texts="", batch_string=None):
+    if batch_string:
+        return [t if t is not None else "" for t in batch_string]
+    if not texts or not texts.strip():
+        return []
+    stripped = texts.strip()
+    if stripped.startswith("["):
+        try:
+            parsed = json.loads(stripped)
+            if isinstance(parsed, list):
+                return [str(t) if t is not None else "" for t in parsed]
+        except ValueError:
+            pass
+    return texts.splitlines()
+
+class EncodeCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._clip_ids = weakref.WeakKeyDictionary()
+        self._next_id = itertools.count()
+
+    def _clip_key(self, clip):
+        # Ids are never reused, so entries of a collected CLIP just age out of the LRU.
+        try:
+            key = self._clip_ids.get(clip)
+            if key is None:
+                key = self._clip_ids[clip] = next(self._next_id)
+            return key
+        except TypeError:
+            return id(clip)
+
+    @staticmethod
+    def _size(cond, pooled):
+        size = cond.element_size() * cond.nelement()
+        if pooled is not None:
+            size += pooled.element_size() * pooled.nelement()
+        return size
+
+    def encode(self, clip, text):
+        key = (self._clip_key(clip), text)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0], entry[1]
+
+        self.misses += 1
+        cond, pooled = clip.encode_from_tokens(clip.tokenize(text), return_pooled=True)
+        size = self._size(cond, pooled)
+        if size <= self.max_bytes:
+            self.entries[key] = (cond, pooled, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, _, old_size) = self.entries.popitem(last=False)
+                self.bytes -= old_size
+        return cond, pooled
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+        }
+
+encode_cache = EncodeCache(int(float(os.getenv("FULLET_ENCODE_CACHE_MB", "256")) * 1024 * 1024))
+
+ALIGNMENT_MODES = ["lcm", "pad"]
+
+def align_lcm(conds):
+    # Repeats each conditioning up to the LCM of all lengths; size grows multiplicatively.
+    lcm_val = get_lcm_list([c.shape[1] for c in conds])
+    return [c.repeat(1, lcm_val // c.shape[1] if c.shape[1] > 0 else 1, 1) for c in conds]
+
+def align_pad(conds, empty_cond):
+    # Extends shorter conditionings with empty-prompt tokens up to the longest one.
+    target = max(c.shape[1] for c in conds)
+    aligned = []
+    for cond in conds:
+        missing = target - cond.shape[1]
+        if missing > 0:
+            repeat = -(-missing // empty_cond.shape[1])
+            pad = empty_cond.to(device=cond.device, dtype=cond.dtype).repeat(1, repeat, 1)[:, :missing]
+            cond = torch.cat([cond, pad], dim=1)
+        aligned.append(cond)
+    return aligned
+
 class CLIPTextEncodeBatch:
     @classmethod
     def INPUT_TYPES(s):
@@ -22,14 +124,20 @@ class CLIPTextEncodeBatch:
                 "text_2": ("STRING", {"multiline": True}),
                 "text_3": ("STRING", {"multiline": True}),
                 "text_4": ("STRING", {"multiline": True}),
+            },
+            "optional": {
+                "texts": ("STRING", {"multiline": True, "default": ""}),
+                "batch_string": ("BATCH_STRING", ),
+                "alignment": (ALIGNMENT_MODES, {"default": "lcm"}),
             }
         }
     RETURN_TYPES = ("CONDITIONING",)
     FUNCTION = "encode"
     CATEGORY = "conditioning_batch"
 
-    def encode(self, clip, batch_size, text_1, text_2, text_3="", text_4=""):
-        all_texts = [text_1, text_2, text_3, text_4]
+    def encode(self, clip, batch_size, text_1, text_2, text_3="", text_4="", texts="", batch_string=None, alignment="lcm"):
+        # A JSON array / one-prompt-per-line `texts` or a BATCH_STRING lifts the 4-prompt limit.
+        all_texts = parse_batch_texts(texts, batch_string) or [text_1, text_2, text_3, text_4]
         target_size = max(1, batch_size)
         texts = all_texts[:target_size]
         
@@ -41,22 +149,20 @@ class CLIPTextEncodeBatch:
         num_tokens = []
         
         for text in texts:
-            tokens = clip.tokenize(text if text is not None else "")
-            cond, pooled = clip.encode_from_tokens(tokens, return_pooled=True)
+            cond, pooled = encode_cache.encode(clip, text if text is not None else "")
             conds.append(cond)
             pooleds.append(pooled)
             num_tokens.append(cond.shape[1])
         
         if not conds:
-            tokens = clip.tokenize("")
-            cond, pooled = clip.encode_from_tokens(tokens, return_pooled=True)
+            cond, pooled = encode_cache.encode(clip, "")
             return ([[cond, {"pooled_output": pooled}]], )
 
-        lcm_val = get_lcm_list(num_tokens)
-        final_conds = []
-        for cond, num in zip(conds, num_tokens):
-            repeat = lcm_val // num if num > 0 else 1
-            final_conds.append(cond.repeat(1, repeat, 1))
+        if alignment == "pad" and len(set(num_tokens)) > 1:
+            empty_cond, _ = encode_cache.encode(clip, "")
+            final_conds = align_pad(conds, empty_cond)
+        else:
+            final_conds = align_lcm(conds)
             
         conds_tensor = torch.cat(final_conds)
         
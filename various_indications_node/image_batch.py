@@ -0,0 +1,114 @@
+import math
+import json
+import torch
+import numpy as np
+from PIL import Image, ImageOps
+
+RESIZE_MODES = ["pad", "crop"]
+
+def parse_image_names(images):
+    stripped = (images or "").strip()
+    if stripped.startswith("["):
+        try:
+            parsed = json.loads(stripped)
+            if isinstance(parsed, list):
+                return [str(name) for name in parsed if name]
+        except ValueError:
+            pass
+    return [line.strip() for line in stripped.splitlines() if line.strip()]
+
+def common_size(sizes, megapixels=1.0, multiple=16):
+    # Geometric mean of the aspect ratios, so no single image dictates the frame.
+    log_aspect = sum(math.log(w / h) for w, h in sizes) / len(sizes)
+    aspect = math.exp(log_aspect)
+    area = megapixels * 1024 * 1024
+    width = max(multiple, round(math.sqrt(area * aspect) / multiple) * multiple)
+    height = max(multiple, round(math.sqrt(area / aspect) / multiple) * multiple)
+    return width, height
+
+def fit_image(img, width, height, mode):
+    """Resize into width x height. Returns the frame and the content box as fractions of it."""
+    src_w, src_h = img.size
+    if mode == "crop":
+        scale = max(width / src_w, height / src_h)
+        new_w, new_h = max(1, round(src_w * scale)), max(1, round(src_h * scale))
+        resized = img.resize((new_w, new_h), Image.LANCZOS)
+        left, top = (new_w - width) // 2, (new_h - height) // 2
+        return resized.crop((left, top, left + width, top + height)), {"x": 0.0, "y": 0.0, "w": 1.0, "h": 1.0}
+
+    scale = min(width / src_w, height / src_h)
+    new_w, new_h = max(1, round(src_w * scale)), max(1, round(src_h * scale))
+    frame = Image.new("RGB", (width, height), (0, 0, 0))
+    left, top = (width - new_w) // 2, (height - new_h) // 2
+    frame.paste(img.resize((new_w, new_h), Image.LANCZOS), (left, top))
+    return frame, {"x": left / width, "y": top / height, "w": new_w / width, "h": new_h / height}
+
+class LoadImageBatch:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "images": ("STRING", {"multiline": True, "default": ""}),
+                "width": ("INT", {"default": 0, "min": 0, "max": 8192, "step": 16}),
+                "height": ("INT", {"default": 0, "min": 0, "max": 8192, "step": 16}),
+                "resize_mode": (RESIZE_MODES, {"default": "pad"}),
+            }
+        }
+    RETURN_TYPES = ("IMAGE", "CROP_META")
+    RETURN_NAMES = ("images", "crops")
+    FUNCTION = "load"
+    CATEGORY = "conditioning_batch"
+
+    def load(self, images, width=0, height=0, resize_mode="pad"):
+        # `images` is a JSON array (or one name per line) of files in ComfyUI's input folder.
+        import folder_paths
+        names = parse_image_names(images)
+        if not names:
+            raise ValueError("Load Image Batch: no images given")
+
+        pictures = []
+        for name in names:
+            img = ImageOps.exif_transpose(Image.open(folder_paths.get_annotated_filepath(name)))
+            pictures.append(img.convert("RGB"))
+
+        if not width or not height:
+            width, height = common_size([p.size for p in pictures])
+
+        frames, crops = [], []
+        for picture in pictures:
+            frame, crop = fit_image(picture, width, height, resize_mode)
+            frames.append(torch.from_numpy(np.array(frame).astype(np.float32) / 255.0))
+            crops.append(crop)
+
+        return {"ui": {"crops": crops}, "result": (torch.stack(frames), crops)}
+
+class CropImageBatch:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {"required": {"images": ("IMAGE", ), "crops": ("CROP_META", )}}
+    RETURN_TYPES = ("IMAGE",)
+    OUTPUT_IS_LIST = (True,)
+    FUNCTION = "crop"
+    CATEGORY = "conditioning_batch"
+
+    def crop(self, images, crops):
+        # Undo the letterboxing of Load Image Batch; sizes differ, so items come out as a list.
+        results = []
+        _, height, width, _ = images.shape
+        for i in range(images.shape[0]):
+            box = crops[i] if i < len(crops) else {"x": 0.0, "y": 0.0, "w": 1.0, "h": 1.0}
+            left, top = round(box["x"] * width), round(box["y"] * height)
+            right = max(left + 1, min(width, left + round(box["w"] * width)))
+            bottom = max(top + 1, min(height, top + round(box["h"] * height)))
+            results.append(images[i:i + 1, top:bottom, left:right, :])
+        return (results, )
+
+NODE_CLASS_MAPPINGS = {
+    "Load Image Batch (FuLLet)": LoadImageBatch,
+    "Crop Image Batch (FuLLet)": CropImageBatch
+}
+
+NODE_DISPLAY_NAME_MAPPINGS = {
+    "Load Image Batch (FuLLet)": "Load Image Batch (FuLLet)",
+    "Crop Image Batch (FuLLet)": "Crop Image Batch (FuLLet)"
+}